@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""bench_screening.py
+
+This file is part of PAutoDock.
+Copyright (C) 2020 Giuseppe Marco Randazzo <gmrandazzo@gmail.com>
+PAutoDock is distributed under GPLv3 license.
+To know more in detail how the license work,
+please read the file "LICENSE" or
+go to "http://www.gnu.org/licenses/gpl-3.0.en.html"
+
+End-to-end benchmark of the screening orchestration.
+
+virtual_screening runs on a synthetic receptor and a synthetic library
+with the stub vina, autogrid4, autodock4, obabel and MGLTools of
+benchmarks/stubs, selected through PAUTODOCK_BIN_PATH and
+PAUTODOCK_HOME. The wall time of the docking programs, as recorded by
+the runner, is subtracted from the screening wall time to give the
+orchestration overhead (obabel and receptor preparation count as
+overhead). Every library size runs in a fresh process and reports wall
+time, overhead per ligand, peak memory and the number of files written.
+
+    python benchmarks/bench_screening.py --ligands 1000 10000 --json now.json
+    python benchmarks/bench_screening.py --ligands 1000 --baseline now.json
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+STUBS = Path(__file__).absolute().parent / "stubs"
+
+
+def write_receptor(path, natoms=400, seed=0):
+    rng = random.Random(seed)
+    elements = ["C", "N", "O", "S"]
+    with open(path, "w") as f:
+        for i in range(natoms):
+            el = elements[i % len(elements)]
+            x, y, z = (rng.uniform(-15.0, 15.0) for _ in range(3))
+            f.write(
+                "ATOM  %5d  %-3s ALA A%4d    %8.3f%8.3f%8.3f  1.00  0.00          %2s\n"
+                % (i + 1, el, i // 10 + 1, x, y, z, el)
+            )
+        f.write("END\n")
+
+
+def write_library(path, nligands, natoms=24, seed=0):
+    rng = random.Random(seed)
+    types = ["C.3", "C.ar", "N.am", "O.2", "H"]
+    with open(path, "w") as f:
+        for n in range(nligands):
+            f.write(f"@<TRIPOS>MOLECULE\nlig{n:07d}\n {natoms} {natoms - 1} 0 0 0\n")
+            f.write("SMALL\nGASTEIGER\n\n@<TRIPOS>ATOM\n")
+            for i in range(natoms):
+                t = types[i % len(types)]
+                x, y, z = (rng.uniform(-3.0, 3.0) for _ in range(3))
+                f.write(
+                    "%7d %-4s %10.4f %10.4f %10.4f %-6s 1  UNL1 %10.4f\n"
+                    % (i + 1, t[0] + str(i), x, y, z, t, rng.uniform(-0.5, 0.5))
+                )
+            f.write("@<TRIPOS>BOND\n")
+            for i in range(1, natoms):
+                f.write("%6d %5d %5d    1\n" % (i, i, i + 1))
+
+
+def stub_environment(root):
+    """
+    Directory of stub binaries and a PAUTODOCK_HOME with a stub MGLTools.
+
+    The stubs are installed with the absolute path of this interpreter
+    (without site packages) in their shebang, to keep their start-up
+    cost low and independent of shims on the PATH.
+    """
+    bindir = root / "bin"
+    bindir.mkdir()
+    home = root / "home"
+    mglbin = home / "MGLTools" / "bin"
+    mglbin.mkdir(parents=True)
+    shutil.copy(STUBS / "_stub.py", bindir / "_stub.py")
+    # ADParallel looks for "autodock" and runs "autodock4"
+    stubs = {
+        "vina": bindir / "vina",
+        "autogrid4": bindir / "autogrid4",
+        "autodock4": bindir / "autodock4",
+        "obabel": bindir / "obabel",
+        "python2": mglbin / "python2",
+    }
+    for name, dst in stubs.items():
+        body = (STUBS / name).read_text().split("\n", 1)[1]
+        dst.write_text(f"#!{sys.executable} -S\n{body}")
+        dst.chmod(0o755)
+    os.symlink(bindir / "autodock4", bindir / "autodock")
+    os.symlink(bindir / "_stub.py", mglbin / "_stub.py")
+    return {"PAUTODOCK_BIN_PATH": str(bindir), "PAUTODOCK_HOME": str(home)}
+
+
+def count_files(path):
+    return sum(len(files) for _, _, files in os.walk(path))
+
+
+def run_single(args):
+    """
+    Run one screening in this process and print its measures as JSON.
+    """
+    from pautodock.adparallel import ADParallel
+
+    root = Path(args.root)
+    dock = ADParallel(
+        str(root / "rec.pdb"), None, str(root / "lib.mol2"), str(root / "wdir")
+    )
+    dock.cx, dock.cy, dock.cz = 0.0, 0.0, 0.0
+    dock.atd = args.atd
+    dock.vina = True
+    dock.cores = args.cores
+    dock.prep_batch_size = args.prep_batch
+    dock.vina_batch_size = args.vina_batch
+    start = time.monotonic()
+    dock.virtual_screening(str(root / "results.sqlite"))
+    wall = time.monotonic() - start
+    conn = sqlite3.connect(str(root / "results.sqlite"))
+    (jobs_wall,) = conn.execute("SELECT COALESCE(SUM(wall), 0) FROM metrics").fetchone()
+    (nresults,) = conn.execute("SELECT COUNT(*) FROM results").fetchone()
+    conn.close()
+    parent = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    print(
+        json.dumps(
+            {
+                "wall": wall,
+                "jobs_wall": jobs_wall,
+                "results": nresults,
+                "parent_maxrss_kb": parent.ru_maxrss,
+                "children_maxrss_kb": children.ru_maxrss,
+                "files": count_files(root / "wdir"),
+            }
+        )
+    )
+
+
+def bench(nligands, args):
+    with tempfile.TemporaryDirectory(prefix="pautodock_bench_") as tmp:
+        root = Path(tmp)
+        env = dict(os.environ, **stub_environment(root))
+        env["PAUTODOCK_STUB_SLEEP"] = str(args.sleep)
+        write_receptor(root / "rec.pdb")
+        write_library(root / "lib.mol2", nligands)
+        cmd = [sys.executable, __file__, "--single", str(root)]
+        cmd += [
+            "--prep_batch",
+            str(args.prep_batch),
+            "--vina_batch",
+            str(args.vina_batch),
+        ]
+        if args.cores is not None:
+            cmd += ["--cores", str(args.cores)]
+        if args.atd:
+            cmd += ["--atd"]
+        res = subprocess.run(cmd, env=env, capture_output=True, text=True)
+        if res.returncode != 0:
+            raise RuntimeError(f"benchmark of {nligands} ligands failed:\n{res.stderr}")
+        m = json.loads(res.stdout.strip().splitlines()[-1])
+    if m["results"] != nligands:
+        raise RuntimeError(f"{m['results']} results for {nligands} ligands")
+    # time of the docking programs, as measured by the runner
+    docking = m["jobs_wall"] / (args.cores or os.cpu_count())
+    m["ligands"] = nligands
+    m["overhead_ms_per_ligand"] = 1000.0 * max(0.0, m["wall"] - docking) / nligands
+    m["files_per_ligand"] = m["files"] / nligands
+    return m
+
+
+def report(results):
+    print(
+        "%10s %10s %14s %14s %14s %10s"
+        % ("Ligands", "Wall (s)", "Overhead/lig", "Parent RSS", "Worker RSS", "Files")
+    )
+    for m in results:
+        print(
+            "%10d %10.1f %11.2f ms %11.1f MB %11.1f MB %10d"
+            % (
+                m["ligands"],
+                m["wall"],
+                m["overhead_ms_per_ligand"],
+                m["parent_maxrss_kb"] / 1024.0,
+                m["children_maxrss_kb"] / 1024.0,
+                m["files"],
+            )
+        )
+
+
+def regressions(results, baseline, tolerance):
+    """
+    Measures worse than the baseline of the same library size by more
+    than tolerance (a fraction).
+    """
+    base = {m["ligands"]: m for m in baseline}
+    found = []
+    for m in results:
+        b = base.get(m["ligands"])
+        if b is None:
+            continue
+        for key in ["overhead_ms_per_ligand", "parent_maxrss_kb", "files"]:
+            if m[key] > b[key] * (1.0 + tolerance):
+                found.append(
+                    f"{m['ligands']} ligands: {key} {b[key]:.2f} -> {m[key]:.2f}"
+                )
+    return found
+
+
+def main():
+    p = argparse.ArgumentParser(
+        description="PAutoDock orchestration benchmark with stub docking programs",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    p.add_argument(
+        "--ligands", type=int, nargs="+", default=[1000], help="Library sizes"
+    )
+    p.add_argument("--cores", type=int, default=None, help="Number of cores")
+    p.add_argument("--atd", action="store_true", help="Run AutoGrid/AutoDock stubs too")
+    p.add_argument("--sleep", type=float, default=0.0, help="Fake docking time (s)")
+    p.add_argument("--prep_batch", type=int, default=1, help="Ligands per obabel run")
+    p.add_argument("--vina_batch", type=int, default=1, help="Ligands per vina run")
+    p.add_argument(
+        "--json", type=str, default=None, help="Write the measures to a file"
+    )
+    p.add_argument(
+        "--baseline", type=str, default=None, help="Measures to compare with"
+    )
+    p.add_argument("--tolerance", type=float, default=0.2, help="Allowed regression")
+    p.add_argument("--single", type=str, default=None, help=argparse.SUPPRESS)
+    p.add_argument("--root", type=str, default=None, help=argparse.SUPPRESS)
+    args = p.parse_args(sys.argv[1:])
+
+    if args.single is not None:
+        args.root = args.single
+        run_single(args)
+        return 0
+
+    results = [bench(n, args) for n in args.ligands]
+    report(results)
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}")
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,58 @@
+"""
+Helpers shared by the stub docking programs of the benchmark.
+
+The stubs reproduce the files the real programs write, with canned
+values, so the orchestration of PAutoDock can be measured without the
+docking itself. PAUTODOCK_STUB_SLEEP (seconds) makes vina and autodock4
+sleep as if they were docking.
+"""
+
+import hashlib
+import os
+import sys
+import time
+
+
+def option(args, name, default=None):
+    """Value following name in args."""
+    if name in args:
+        return args[args.index(name) + 1]
+    return default
+
+
+def options(args, name):
+    """Every value following name in args."""
+    return [args[i + 1] for i, a in enumerate(args[:-1]) if a == name]
+
+
+def dock_sleep():
+    time.sleep(float(os.environ.get("PAUTODOCK_STUB_SLEEP", "0")))
+
+
+def energy(name, mode=0):
+    """Deterministic fake binding energy of a ligand."""
+    h = int(hashlib.md5(name.encode()).hexdigest()[:8], 16)
+    return -4.0 - (h % 600) / 100.0 + mode * 0.3
+
+
+def pdbqt_atom(i, name, x, y, z, charge, atype):
+    return "ATOM  %5d %-4s UNL     1    %8.3f%8.3f%8.3f%6.2f%6.2f    %6.3f %-2s\n" % (
+        i,
+        name,
+        x,
+        y,
+        z,
+        0.0,
+        0.0,
+        charge,
+        atype,
+    )
+
+
+def atom_lines(pdbqt):
+    with open(pdbqt) as f:
+        return [line for line in f if line.startswith(("ATOM", "HETATM"))]
+
+
+def main(run):
+    sys.exit(run(sys.argv[1:]))
@@ -13,7 +13,97 @@ Provides a commandline script to recover the output result of a virtualscreening
 """
 
 import argparse
+import gzip
+import multiprocessing
 import sys
+from pathlib import Path
+
+import numpy as np
+
+
+def _fields(vals):
+    """
+    Format values as " %12.5E" fields with array operations.
+
+    Return an (n, 13) uint8 array of ASCII characters, or None if a
+    field is wider than 13 characters (negative values with a three
+    digit exponent). Digits are computed from the values scaled to six
+    significant figures; values close to a rounding tie, non finite
+    values or exponents beyond two digits are formatted by Python so
+    that the text is always identical to the one of "%12.5E".
+    """
+    vals = np.asarray(vals, dtype=np.float64)
+    absv = np.abs(vals)
+    finite = np.isfinite(vals) & (absv > 0)
+    exp = np.zeros(len(vals), dtype=np.int64)
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        exp[finite] = np.floor(np.log10(absv[finite])).astype(np.int64)
+        scaled = absv * 10.0 ** (5 - exp)
+        near_tie = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+        # log10 may miss the exponent by one around the powers of ten
+        for _ in range(2):
+            digits = np.rint(scaled)
+            over = finite & (digits >= 1000000)
+            under = finite & (digits < 100000)
+            exp += over.astype(np.int64) - under.astype(np.int64)
+            scaled = absv * 10.0 ** (5 - exp)
+            near_tie |= np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+        digits = np.rint(scaled)
+    digits = np.where(finite & (np.abs(exp) <= 99), digits, 0).astype(np.int64)
+    exp = np.where(finite, exp, 0)
+    fallback = np.flatnonzero(
+        (np.isfinite(vals) == 0) | (finite & near_tie) | (np.abs(exp) > 99)
+    )
+
+    out = np.empty((len(vals), 13), dtype=np.uint8)
+    out[:, 0] = ord(" ")
+    out[:, 1] = np.where(np.signbit(vals), ord("-"), ord(" "))
+    # six significant digits: d.ddddd
+    for col in [8, 7, 6, 5, 4, 2]:
+        out[:, col] = ord("0") + digits % 10
+        digits //= 10
+    out[:, 3] = ord(".")
+    out[:, 9] = ord("E")
+    out[:, 10] = np.where(exp < 0, ord("-"), ord("+"))
+    aexp = np.abs(exp)
+    out[:, 11] = ord("0") + aexp // 10 % 10
+    out[:, 12] = ord("0") + aexp % 10
+    for i in fallback:
+        field = " %12.5E" % vals[i]
+        if len(field) != 13:
+            return None
+        out[i] = np.frombuffer(field.encode("ascii"), dtype=np.uint8)
+    return out
+
+
+def format_values(vals):
+    """
+    Return the " %12.5E" fields of values, concatenated.
+    """
+    out = _fields(vals)
+    if out is None:
+        return "".join(" %12.5E" % v for v in vals)
+    return out.tobytes().decode("ascii")
+
+
+def format_lines(vals):
+    """
+    Return the DX body lines of values: three " %12.5E" fields per line.
+    """
+    out = _fields(vals)
+    if out is None:
+        # fields wider than 13 characters: format line by line
+        return "".join(
+            format_values(vals[i : i + 3]) + "\n"  # noqa: E203
+            for i in range(0, len(vals), 3)
+        )
+    nfull = len(vals) // 3 * 3
+    fields = out[:nfull].reshape(-1, 39)
+    newline = np.full((len(fields), 1), ord("\n"), dtype=np.uint8)
+    text = np.hstack([fields, newline]).tobytes().decode("ascii")
+    if nfull < len(vals):
+        text += out[nfull:].tobytes().decode("ascii") + "\n"
+    return text
 
 
 class AutoGridMap2DX:
@@ -25,7 +115,7 @@ class AutoGridMap2DX:
         self.origin = [0, 0, 0]
         self.nelem = 0
         self.spacing = 0.0
-        self.values = []
+        self.values = np.zeros(0, dtype=np.float64)
         self.datafile = ""
         self.molecule = ""
         self.paramfile = ""
@@ -53,51 +143,107 @@ class AutoGridMap2DX:
         for i in range(3):
             self.n[i] = self.npts[i] + 1
         self.nelem = self.n[0] * self.n[1] * self.n[2]
-        i = 0
-        while i < self.nelem:
-            val = float(fp.readline())
-            self.values.append(val)
-            i += 1
+        # Parse the whole map body in bulk into a contiguous float64 array,
+        # the values of the float() parsing of the original reader
+        self.values = np.array(fp.read().split(), dtype=np.float64)
+        if self.values.size < self.nelem:
+            raise ValueError(
+                f"{self.name}: expected {self.nelem} values, found {self.values.size}"
+            )
+        self.values = self.values[: self.nelem]
         for i in range(3):
             self.origin[i] = self.center[i] - self.npts[i] / 2 * self.spacing
 
-    def writeDX(self, fname):
-        with open(fname, "w") as fp:
-            nx, ny, nz = self.n
-            ori = self.origin
-            spacing = self.spacing
-            vals = self.values
-
-            print("#==================================", file=fp)
-            print(f"# AutoGrid Map File: {self.name}", file=fp)
-            print(f"# Receptor File Name: {self.molecule}", file=fp)
-            print("#==================================", file=fp)
-            print(f"object 1 class gridpositions counts {nx} {ny} {nz}", file=fp)
-            print(f"origin {ori[0]:12.5E} {ori[1]:12.5E} {ori[2]:12.5E}", file=fp)
-            print(f"delta {spacing:12.5E} {0:12.5E} {0:12.5E}", file=fp)
-            print(f"delta {0:12.5E} {spacing:12.5E} {0:12.5E}", file=fp)
-            print(f"delta {0:12.5E} {0:12.5E} {spacing:12.5E}", file=fp)
-            print(f"object 2 class gridconnections counts {nx} {ny} {nz}", file=fp)
-            print(
-                f"object 3 class array type double rank 0 items {len(vals)} data follows",
-                file=fp,
-            )
-            col = 0
-            for k in range(nz):
-                for j in range(ny):
-                    for i in range(nx):
-                        fp.write(f" {vals[i*ny*nz + j*nz + k]:12.5E}")
-                        col += 1
-                        if col == 3:
-                            print(file=fp)
-                            col = 0
-            if col != 0:
-                print(file=fp)
-            print('attribute "dep" string "positions"', file=fp)
-            print('object "regular positions regular connections" class field', file=fp)
-            print('component "positions" value 1', file=fp)
-            print('component "connections" value 2', file=fp)
-            print('component "data" value 3', file=fp)
+    def dx_values(self):
+        """
+        Return the map values in the order of the DX body.
+
+        The values are indexed as [i, j, k] with k fastest, as in the
+        original writer, and written with i fastest: a x/z transposition.
+        """
+        nx, ny, nz = self.n
+        return self.values.reshape(nx, ny, nz).transpose(2, 1, 0).ravel()
+
+    def writeDX(self, fname, chunk_lines=65536):
+        """
+        Write the map in DX format; gzip compressed if fname ends in .gz
+        """
+        if str(fname).endswith(".gz"):
+            fp = gzip.open(fname, "wt", compresslevel=6)
+        else:
+            fp = open(fname, "w")
+        with fp:
+            self._writeDX(fp, chunk_lines)
+
+    def _writeDX(self, fp, chunk_lines=65536):
+        nx, ny, nz = self.n
+        ori = self.origin
+        spacing = self.spacing
+        vals = self.dx_values()
+
+        print("#==================================", file=fp)
+        print(f"# AutoGrid Map File: {self.name}", file=fp)
+        print(f"# Receptor File Name: {self.molecule}", file=fp)
+        print("#==================================", file=fp)
+        print(f"object 1 class gridpositions counts {nx} {ny} {nz}", file=fp)
+        print(f"origin {ori[0]:12.5E} {ori[1]:12.5E} {ori[2]:12.5E}", file=fp)
+        print(f"delta {spacing:12.5E} {0:12.5E} {0:12.5E}", file=fp)
+        print(f"delta {0:12.5E} {spacing:12.5E} {0:12.5E}", file=fp)
+        print(f"delta {0:12.5E} {0:12.5E} {spacing:12.5E}", file=fp)
+        print(f"object 2 class gridconnections counts {nx} {ny} {nz}", file=fp)
+        print(
+            f"object 3 class array type double rank 0 items {len(vals)} data follows",
+            file=fp,
+        )
+        # Three values per line, formatted by chunks of lines at once
+        step = 3 * chunk_lines
+        for start in range(0, len(vals), step):
+            fp.write(format_lines(vals[start : start + step]))  # noqa: E203
+        print('attribute "dep" string "positions"', file=fp)
+        print('object "regular positions regular connections" class field', file=fp)
+        print('component "positions" value 1', file=fp)
+        print('component "connections" value 2', file=fp)
+        print('component "data" value 3', file=fp)
+
+
+def read_fld_maps(fld):
+    """
+    Return the maps referenced by an AutoGrid .maps.fld file.
+    """
+    maps = []
+    with open(fld, "r") as fp:
+        for line in fp:
+            if line.startswith("variable"):
+                for token in line.split():
+                    if token.startswith("file="):
+                        maps.append(str(Path(fld).parent / token.split("=", 1)[1]))
+    return maps
+
+
+def collect_maps(path):
+    """
+    Return the maps of a .maps.fld file or of a directory.
+    """
+    if Path(path).is_dir():
+        return sorted(str(p) for p in Path(path).glob("*.map"))
+    return read_fld_maps(path)
+
+
+def convert_map(job):
+    map_file, dx_file = job
+    AutoGridMap2DX(map_file).writeDX(dx_file)
+    return dx_file
+
+
+def convert_maps(maps, outdir, compress=False, nprocs=None):
+    """
+    Convert a set of maps to DX files in outdir with a process pool.
+    """
+    Path(outdir).mkdir(parents=True, exist_ok=True)
+    ext = ".dx.gz" if compress else ".dx"
+    jobs = [(m, str(Path(outdir) / (Path(m).stem + ext))) for m in maps]
+    with multiprocessing.Pool(nprocs or multiprocessing.cpu_count()) as pool:
+        return list(pool.imap_unordered(convert_map, jobs))
 
 
 def main():
@@ -107,14 +253,29 @@ def main():
     p = argparse.ArgumentParser()
     p.add_argument("--map", default=None, type=str, help="autodoc4 map")
     p.add_argument("--dx", default=None, type=str, help="DX output")
+    p.add_argument(
+        "--fld", default=None, type=str, help="convert all the maps of a .maps.fld"
+    )
+    p.add_argument(
+        "--dir", default=None, type=str, help="convert all the maps of a directory"
+    )
+    p.add_argument("--outdir", default=None, type=str, help="DX output directory")
+    p.add_argument("--gzip", action="store_true", help="write gzip compressed DX")
+    p.add_argument("--nprocs", default=None, type=int, help="number of processes")
     args = p.parse_args(sys.argv[1:])
 
-    if args.map is None or args.dx is None:
+    if (args.fld or args.dir) and args.outdir:
+        maps = collect_maps(args.fld or args.dir)
+        for dx in convert_maps(maps, args.outdir, args.gzip, args.nprocs):
+            print(dx)
+    elif args.map is None or args.dx is None:
         print("\nUsage: %s --map [input autodock4 map]" % sys.argv[0])
         print("                --dx [output DX]")
+        print("   or: %s --fld [maps.fld] | --dir [maps dir]" % sys.argv[0])
+        print("                --outdir [output dir] [--gzip] [--nprocs N]")
     else:
         agm = AutoGridMap2DX(args.map)
-        agm.writeDX(args.dx)
+        agm.writeDX(args.dx + (".gz" if args.gzip else ""))
 
 
 if __name__ in "__main__":
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""extract.py
+
+This file is part of PAutoDock.
+Copyright (C) 2020 Giuseppe Marco Randazzo <gmrandazzo@gmail.com>
+PAutoDock is distributed under GPLv3 license.
+To know more in detail how the license work,
+please read the file "LICENSE" or
+go to "http://www.gnu.org/licenses/gpl-3.0.en.html"
+
+Provides a commandline script to extract ligands from the shard archive
+of a work directory.
+
+Only the members of the requested ligands are read.
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+from pautodock.adparallel import ARCHIVE_DIR
+from pautodock.archive import ShardArchive
+
+
+def main() -> int:
+    p = argparse.ArgumentParser(
+        description="Extract ligands packed in a PAutoDock work directory",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    p.add_argument("--wdir", required=True, type=str, help="work directory")
+    p.add_argument(
+        "--molname", required=True, nargs="+", type=str, help="ligands to extract"
+    )
+    p.add_argument("--out", default=".", type=str, help="output directory")
+    p.add_argument(
+        "--file",
+        default=None,
+        type=str,
+        help="extract only this file of each ligand (e.g. vina_log.txt)",
+    )
+    args = p.parse_args(sys.argv[1:])
+
+    path = Path(args.wdir) / ARCHIVE_DIR
+    if not path.is_dir():
+        print(f"Error: {args.wdir} has no archive", file=sys.stderr)
+        return 1
+    archive = ShardArchive(path)
+    status = 0
+    for molname in args.molname:
+        if not archive.has(molname):
+            print(f"Error: {molname} is not archived", file=sys.stderr)
+            status = 1
+        elif args.file is None:
+            for fpath in archive.extract(molname, f"{args.out}/{molname}"):
+                print(fpath)
+        else:
+            data = archive.read(molname, args.file)
+            if data is None:
+                print(f"Error: {molname} has no {args.file}", file=sys.stderr)
+                status = 1
+                continue
+            fpath = Path(f"{args.out}/{molname}/{args.file}")
+            fpath.parent.mkdir(parents=True, exist_ok=True)
+            fpath.write_bytes(data)
+            print(fpath)
+    archive.close()
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -15,11 +15,19 @@ in parallel.
 """
 
 import argparse
+import os
+import shutil
 import sys
-from dataclasses import dataclass
-from typing import Optional
+import tempfile
+from dataclasses import asdict, dataclass, fields, replace
+from pathlib import Path
+from typing import Optional, Tuple
 
 from pautodock.adparallel import ADParallel
+from pautodock.fileutils import pautodock_home
+from pautodock.funnel import funnel_screening
+from pautodock.multimol2op import Mol2Index
+from pautodock.workqueue import WorkQueue, merge_results
 
 
 @dataclass
@@ -42,6 +50,35 @@ class DockingConfig:
     vina_enabled: bool = True
     vina_exhaustiveness: int = 32
     vina_num_modes: int = 18
+    prep_batch_size: int = 1
+    vina_batch_size: int = 1
+    vina_engine: str = "cli"
+    job_timeout: Optional[float] = None
+    trace: Optional[str] = None
+    result_cache: bool = False
+    result_cache_size: int = 2048
+    ligand_store: bool = False
+    pack_ligands: bool = False
+    cores: Optional[int] = None
+    db_start: int = 0
+    db_stop: Optional[int] = None
+    db_shard: Tuple[int, int] = (0, 1)
+    db_sample: Optional[int] = None
+    db_seed: int = 0
+    db_index: Optional[str] = None
+    queue: Optional[str] = None
+    shard_size: int = 1000
+    lease_timeout: int = 1800
+    funnel_top: Optional[int] = None
+    funnel_percent: Optional[float] = None
+    funnel_exhaustiveness: int = 4
+    funnel_num_modes: int = 3
+
+    @classmethod
+    def from_dict(cls, data):
+        config = cls(**{f.name: data[f.name] for f in fields(cls) if f.name in data})
+        config.db_shard = tuple(config.db_shard)
+        return config
 
 
 def parse_arguments() -> DockingConfig:
@@ -84,7 +121,10 @@ def parse_arguments() -> DockingConfig:
         help="Screening mode",
     )
     dock_group.add_argument(
-        "--out", type=str, default="output.txt", help="Output file path"
+        "--out",
+        type=str,
+        default="output.txt",
+        help="Output file path (.sqlite or .db for an SQLite table, .tsv for tabs)",
     )
     dock_group.add_argument(
         "--atd", type=str, default="OFF", choices=["ON", "OFF"], help="Enable Autodock"
@@ -98,6 +138,138 @@ def parse_arguments() -> DockingConfig:
     dock_group.add_argument(
         "--num_modes", type=int, default=18, help="Number of binding modes to generate"
     )
+    dock_group.add_argument(
+        "--prep_batch",
+        type=int,
+        default=1,
+        help="Number of ligands converted by a single obabel run",
+    )
+    dock_group.add_argument(
+        "--vina_batch",
+        type=int,
+        default=1,
+        help="Number of ligands docked by a single vina process (needs vina >= 1.2)",
+    )
+    dock_group.add_argument(
+        "--vina_engine",
+        type=str,
+        default="cli",
+        choices=["cli", "python"],
+        help="Run the vina executable or dock in process with the vina Python package",
+    )
+    dock_group.add_argument(
+        "--timeout",
+        type=float,
+        default=None,
+        help="Kill AutoGrid/AutoDock/vina jobs running longer than this (seconds)",
+    )
+    dock_group.add_argument(
+        "--trace",
+        type=str,
+        default=None,
+        help="Write per-stage timings as Chrome/Perfetto trace JSON to this file",
+    )
+    dock_group.add_argument(
+        "--result_cache",
+        type=str,
+        default="OFF",
+        choices=["ON", "OFF"],
+        help="Reuse the docking results of identical jobs of earlier screens, "
+        "cached in ~/.pautodock/results",
+    )
+    dock_group.add_argument(
+        "--result_cache_size",
+        type=int,
+        default=2048,
+        help="Maximum size of the result cache (MB)",
+    )
+    dock_group.add_argument(
+        "--ligand_store",
+        type=str,
+        default="OFF",
+        choices=["ON", "OFF"],
+        help="Reuse the ligands prepared by earlier screens, stored in "
+        "~/.pautodock/ligands (see pautodock-prepare-ligands)",
+    )
+    dock_group.add_argument(
+        "--pack",
+        type=str,
+        default="OFF",
+        choices=["ON", "OFF"],
+        help="Pack the files of finished ligands in shard archives (see pautodock-extract)",
+    )
+    dock_group.add_argument(
+        "--cores",
+        type=int,
+        default=None,
+        help="Number of cores to use (default: all the cores of the machine)",
+    )
+
+    # Library selection
+    lib_group = parser.add_argument_group("Library Selection")
+    lib_group.add_argument(
+        "--start", type=int, default=0, help="Index of the first record to screen"
+    )
+    lib_group.add_argument(
+        "--stop", type=int, default=None, help="Index after the last record to screen"
+    )
+    lib_group.add_argument(
+        "--shard",
+        type=str,
+        default="0/1",
+        help="Screen shard k of M (k/M, 0 <= k < M) of the selected records",
+    )
+    lib_group.add_argument(
+        "--sample", type=int, default=None, help="Screen a random pilot subset"
+    )
+    lib_group.add_argument(
+        "--seed", type=int, default=0, help="Random seed for --sample"
+    )
+
+    # Funnel screening
+    funnel_group = parser.add_argument_group("Funnel Screening")
+    funnel_group.add_argument(
+        "--funnel_top",
+        type=int,
+        default=None,
+        help="Rescore the N best ligands of a fast vina pass",
+    )
+    funnel_group.add_argument(
+        "--funnel_percent",
+        type=float,
+        default=None,
+        help="Rescore the best percent of the ligands of a fast vina pass",
+    )
+    funnel_group.add_argument(
+        "--funnel_exhaustiveness",
+        type=int,
+        default=4,
+        help="Vina exhaustiveness of the fast pass",
+    )
+    funnel_group.add_argument(
+        "--funnel_modes",
+        type=int,
+        default=3,
+        help="Number of binding modes of the fast pass",
+    )
+
+    # Distributed screening
+    queue_group = parser.add_argument_group("Distributed Screening")
+    queue_group.add_argument(
+        "--queue",
+        type=str,
+        default=None,
+        help="Shared directory of the work queue; run pautodock-worker on other nodes",
+    )
+    queue_group.add_argument(
+        "--shard_size", type=int, default=1000, help="Number of ligands per shard"
+    )
+    queue_group.add_argument(
+        "--lease_timeout",
+        type=int,
+        default=1800,
+        help="Seconds without heartbeat before a shard is given to another worker",
+    )
 
     args = parser.parse_args(sys.argv[1:])
 
@@ -116,6 +288,28 @@ def parse_arguments() -> DockingConfig:
             "Grid center coordinates (--cx, --cy, --cz) are required when no ligand is provided"
         )
 
+    try:
+        shard = tuple(int(x) for x in args.shard.split("/"))
+        if len(shard) != 2 or not 0 <= shard[0] < shard[1]:
+            raise ValueError
+    except ValueError:
+        parser.error("--shard must be k/M with 0 <= k < M")
+
+    if args.queue is not None and (
+        args.db is None or args.sample is not None or shard != (0, 1)
+    ):
+        parser.error(
+            "--queue needs --db and cannot be combined with --shard or --sample"
+        )
+
+    if args.funnel_top is not None and args.funnel_percent is not None:
+        parser.error("--funnel_top and --funnel_percent are mutually exclusive")
+    if args.funnel_percent is not None and not 0 < args.funnel_percent <= 100:
+        parser.error("--funnel_percent must be in (0, 100]")
+    funnel = args.funnel_top is not None or args.funnel_percent is not None
+    if funnel and args.queue is not None:
+        parser.error("--queue cannot be combined with a funnel screening")
+
     return DockingConfig(
         receptor=args.receptor,
         ligand=args.ligand,
@@ -133,7 +327,158 @@ def parse_arguments() -> DockingConfig:
         vina_enabled=args.vina == "ON",
         vina_exhaustiveness=args.exhaustiveness,
         vina_num_modes=args.num_modes,
+        prep_batch_size=args.prep_batch,
+        vina_batch_size=args.vina_batch,
+        vina_engine=args.vina_engine,
+        job_timeout=args.timeout,
+        trace=args.trace,
+        result_cache=args.result_cache == "ON",
+        result_cache_size=args.result_cache_size,
+        ligand_store=args.ligand_store == "ON",
+        pack_ligands=args.pack == "ON",
+        cores=args.cores,
+        db_start=args.start,
+        db_stop=args.stop,
+        db_shard=shard,
+        db_sample=args.sample,
+        db_seed=args.seed,
+        queue=args.queue,
+        shard_size=args.shard_size,
+        lease_timeout=args.lease_timeout,
+        funnel_top=args.funnel_top,
+        funnel_percent=args.funnel_percent,
+        funnel_exhaustiveness=args.funnel_exhaustiveness,
+        funnel_num_modes=args.funnel_modes,
+    )
+
+
+def make_dock(config: DockingConfig) -> ADParallel:
+    """
+    Create the ADParallel screening of a configuration.
+    """
+    dock = ADParallel(
+        receptor=config.receptor,
+        ligand=config.ligand,
+        db=config.db,
+        wpath=config.wdir,
+    )
+
+    # Configure docking parameters
+    if config.ligand is None:
+        dock.cx = config.center_x
+        dock.cy = config.center_y
+        dock.cz = config.center_z
+
+    dock.atd = config.autodock_enabled
+    dock.vina = config.vina_enabled
+    dock.speed = config.screening_mode
+    dock.gsize_x = config.grid_x
+    dock.gsize_y = config.grid_y
+    dock.gsize_z = config.grid_z
+    dock.exhaustiveness = config.vina_exhaustiveness
+    dock.num_modes = config.vina_num_modes
+    dock.prep_batch_size = config.prep_batch_size
+    dock.vina_batch_size = config.vina_batch_size
+    dock.vina_engine = config.vina_engine
+    dock.job_timeout = config.job_timeout
+    dock.trace = config.trace
+    if config.result_cache:
+        dock.result_cache_dir = f"{pautodock_home()}/results"
+    dock.result_cache_size = config.result_cache_size << 20
+    if config.ligand_store:
+        dock.ligand_store_dir = f"{pautodock_home()}/ligands"
+    dock.pack_ligands = config.pack_ligands
+    dock.cores = config.cores
+    dock.db_start = config.db_start
+    dock.db_stop = config.db_stop
+    dock.db_shard = config.db_shard
+    dock.db_sample = config.db_sample
+    dock.db_seed = config.db_seed
+    dock.db_index = config.db_index
+    return dock
+
+
+def library_index(config: DockingConfig, idx_dir: str) -> Mol2Index:
+    """
+    The side-car index of the library, in idx_dir for a read-only library.
+    """
+    try:
+        return Mol2Index(config.db)
+    except PermissionError:
+        return Mol2Index(config.db, f"{idx_dir}/{Path(config.db).name}.idx")
+
+
+def library_shards(config: DockingConfig, index: Mol2Index) -> list:
+    """
+    Split the selected library records in shards of config.shard_size.
+    """
+    stop = len(index) if config.db_stop is None else min(config.db_stop, len(index))
+    return [
+        {"start": start, "stop": min(start + config.shard_size, stop)}
+        for start in range(config.db_start, stop, config.shard_size)
+    ]
+
+
+def run_shards(
+    queue: WorkQueue,
+    config: DockingConfig,
+    cores: Optional[int] = None,
+    scratch: Optional[str] = None,
+) -> int:
+    """
+    Screen shards leased from queue until the queue is finished.
+
+    Each shard runs in its own working directory under scratch (node
+    local storage), so a restarted worker resumes from its ledger, and
+    only the finished shard results are copied to the queue. The
+    working directory of a shard is removed once its results, and its
+    trace, are published.
+    """
+    scratch = Path(scratch or f"{tempfile.gettempdir()}/pautodock").absolute()
+
+    def run_shard(lease):
+        wdir = scratch / lease.name
+        shard_config = replace(
+            config,
+            wdir=str(wdir),
+            db_start=lease.spec["start"],
+            db_stop=lease.spec["stop"],
+            cores=cores,
+            queue=None,
+            trace=config.trace and f"{wdir}/trace.json",
+        )
+        resdb = f"{wdir}/results.sqlite"
+        make_dock(shard_config).virtual_screening(resdb)
+        if queue.publish_result(lease, resdb, shard_config.trace):
+            shutil.rmtree(wdir, ignore_errors=True)
+
+    return queue.serve(run_shard)
+
+
+def distributed_screening(config: DockingConfig):
+    """
+    Publish the library shards, screen them with the workers and merge
+    the shard results into config.output_path.
+    """
+    config = replace(
+        config,
+        receptor=os.path.abspath(config.receptor),
+        ligand=config.ligand and os.path.abspath(config.ligand),
+        db=os.path.abspath(config.db),
+        wdir=os.path.abspath(config.wdir),
     )
+    queue = WorkQueue(config.queue, config.lease_timeout)
+    os.makedirs(config.wdir, exist_ok=True)
+    with library_index(config, config.wdir) as index:
+        # the shards read the index built here instead of scanning again
+        config = replace(config, db_index=index.idx)
+        shards = library_shards(config, index)
+    queue.publish(asdict(config), shards)
+    run_shards(queue, config, config.cores, config.wdir)
+    status = queue.status()
+    if status["failed"]:
+        print(f"Warning: {status['failed']} shards failed", file=sys.stderr)
+    merge_results(queue, config.output_path, config.trace)
 
 
 def main() -> int:
@@ -146,28 +491,22 @@ def main() -> int:
     try:
         config = parse_arguments()
 
-        # Initialize docking
-        dock = ADParallel(
-            receptor=config.receptor,
-            ligand=config.ligand,
-            db=config.db,
-            wpath=config.wdir,
-        )
+        if config.queue is not None:
+            distributed_screening(config)
+            return 0
+
+        dock = make_dock(config)
 
-        # Configure docking parameters
-        if config.ligand is None:
-            dock.cx = config.center_x
-            dock.cy = config.center_y
-            dock.cz = config.center_z
-
-        dock.atd = config.autodock_enabled
-        dock.vina = config.vina_enabled
-        dock.speed = config.screening_mode
-        dock.gsize_x = config.grid_x
-        dock.gsize_y = config.grid_y
-        dock.gsize_z = config.grid_z
-        dock.exhaustiveness = config.vina_exhaustiveness
-        dock.num_modes = config.vina_num_modes
+        if config.funnel_top is not None or config.funnel_percent is not None:
+            funnel_screening(
+                dock,
+                config.output_path,
+                top=config.funnel_top,
+                fraction=config.funnel_percent and config.funnel_percent / 100.0,
+                exhaustiveness=config.funnel_exhaustiveness,
+                num_modes=config.funnel_num_modes,
+            )
+            return 0
 
         # Run virtual screening
         dock.virtual_screening(config.output_path)
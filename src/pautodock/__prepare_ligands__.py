@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""prepare_ligands.py
+
+This file is part of PAutoDock.
+Copyright (C) 2020 Giuseppe Marco Randazzo <gmrandazzo@gmail.com>
+PAutoDock is distributed under GPLv3 license.
+To know more in detail how the license work,
+please read the file "LICENSE" or
+go to "http://www.gnu.org/licenses/gpl-3.0.en.html"
+
+Provides a commandline script to prepare a library in the ligand store.
+
+Every later screen of the library, against any receptor, copies the
+prepared ligands from the store instead of running obabel.
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+from pautodock import multimol2op, scheduler
+from pautodock.fileutils import pautodock_home
+from pautodock.ligandstore import LigandStore
+
+
+def chunks(records, size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def prepare_library(store, db, cores=None, batch_size=100):
+    """
+    Prepare the ligands of a multimol2 missing from the store, in
+    parallel. Return the number of ligands read and prepared.
+    """
+    nread = 0
+    nprepared = 0
+
+    def tasks():
+        nonlocal nread
+        for chunk in chunks(multimol2op.iter_mol2(db), batch_size):
+            nread += len(chunk)
+            yield scheduler.Task("prepare_batch", (chunk,))
+
+    for _, n in scheduler.Scheduler(store, cores).run(tasks()):
+        nprepared += n
+    return nread, nprepared
+
+
+def main() -> int:
+    p = argparse.ArgumentParser(
+        description="Prepare a multimol2 library in the PAutoDock ligand store",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    p.add_argument("--db", required=True, type=str, help="Path multimol2 to prepare")
+    p.add_argument(
+        "--cores",
+        type=int,
+        default=None,
+        help="Number of cores to use (default: all the cores of the machine)",
+    )
+    p.add_argument(
+        "--prep_batch",
+        type=int,
+        default=100,
+        help="Number of ligands converted by a single obabel run",
+    )
+    args = p.parse_args(sys.argv[1:])
+
+    try:
+        home = pautodock_home()
+        store = LigandStore(f"{home}/ligands", Path(f"{home}/MGLTools"))
+        nread, nprepared = prepare_library(store, args.db, args.cores, args.prep_batch)
+        print(f"{nread} ligands read, {nprepared} prepared")
+        return 0
+    except Exception as err:
+        print(f"Error: {str(err)}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
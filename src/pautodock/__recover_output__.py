@@ -10,14 +10,90 @@ please read the file "LICENSE" or
 go to "http://www.gnu.org/licenses/gpl-3.0.en.html"
 
 Provides a commandline script to recover the output result of a virtualscreening.
+
+The ligand directories of the work directory are listed with scandir,
+the packed ligands from the shard archive index, and both are parsed in
+a process pool; every ligand is stored in the results database as soon
+as it is parsed, then the table is exported.
 """
 
 import argparse
+import multiprocessing
 import os
 import sys
 from pathlib import Path
 
-from pautodock.adparallel import ADParallel
+from pautodock import archive, molop, results, scheduler
+from pautodock.adparallel import ARCHIVE_DIR, LIGANDS_DIR, ADParallel
+
+
+def subdirs(path):
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                yield entry
+
+
+def ligand_dirs(wpath):
+    """
+    Yield the path of every ligand directory of a work directory, in the
+    hashed fan-out of ADParallel.ligand_path and in the flat layout of
+    older work directories.
+    """
+    for entry in subdirs(wpath):
+        if entry.name == ARCHIVE_DIR:
+            continue
+        if entry.name != LIGANDS_DIR:
+            yield entry.path
+            continue
+        for level1 in subdirs(entry.path):
+            for level2 in subdirs(level1.path):
+                for ligand in subdirs(level2.path):
+                    yield ligand.path
+
+
+def recover_items(wpath, archived):
+    """
+    Yield the (worker method, argument) recovering every ligand; the
+    archived ligands with a directory left are recovered from it.
+    """
+    seen = set()
+    for mpath in ligand_dirs(wpath):
+        seen.add(Path(mpath).name)
+        yield "recover_ligand", mpath
+    for molname in archived:
+        if molname not in seen:
+            yield "recover_archived", molname
+
+
+def recover_task(item):
+    method, arg = item
+    return scheduler.call_worker(method, (arg,), {})
+
+
+def recover(dock, resdb, cores=None, chunksize=64):
+    """
+    Parse the ligand directories and the archived ligands of dock.wpath
+    in parallel and add the results of every ligand to resdb. Return the
+    number of ligands.
+    """
+    nrecovered = 0
+    # listed here: the items are consumed by the pool feeder thread
+    archived = dock.archive.molnames() if dock.archive is not None else []
+    with multiprocessing.Pool(
+        cores, initializer=scheduler.init_worker, initargs=(dock,)
+    ) as pool:
+        for res in pool.imap_unordered(
+            recover_task, recover_items(dock.wpath, archived), chunksize
+        ):
+            if res is None:
+                continue
+            header, row, vina_poses, dlg_result = res
+            resdb.add(header, row)
+            resdb.add_poses(row[0], vina_poses, dlg_result)
+            nrecovered += 1
+    resdb.commit()
+    return nrecovered
 
 
 def main():
@@ -28,33 +104,39 @@ def main():
     p.add_argument("--wdir", default=None, type=str, help="work directory")
     p.add_argument("--out", default=None, type=str, help="screening output")
     p.add_argument("--ligand", default=None, type=str, help="ligand")
+    for axis in ["x", "y", "z"]:
+        p.add_argument(
+            f"--c{axis}", default=0.0, type=float, help=f"grid center {axis}"
+        )
+    p.add_argument("--cores", default=None, type=int, help="number of cores")
     args = p.parse_args(sys.argv[1:])
 
     if args.wdir is None or args.out is None:
-        print("\nUsage: %s --receptor [input pdb]" % sys.argv[0])
-        print("                --wdir [work path]")
+        print("\nUsage: %s --wdir [work path]" % sys.argv[0])
         print("                --ligand [ligand PDB]")
+        print("                --cx --cy --cz [grid center, without ligand]")
         print("                --out [screening output]")
+        print("                --cores [number of cores]")
     else:
-        dock = ADParallel("", None, None, args.ligand, None, args.wdir)
-        vinalogout = []
-        dpfout = []
-        mnames = []
-        for root, directories, filenames in os.walk(str(Path(args.wdir).absolute())):
-            for filename in filenames:
-                if "vina_log.txt" in filename:
-                    vinalogout.append(os.path.join(root, filename))
-                    mname = str(Path(vinalogout[-1]).parents[0].name)
-                    if mname not in mnames:
-                        mnames.append(mname)
-                elif "ind.dlg" in filename:
-                    dpfout.append(os.path.join(root, filename))
-                    mname = str(Path(dpfout[-1]).parents[0].name)
-                    if mname not in mnames:
-                        mnames.append(mname)
-                else:
-                    continue
-        dock.gen_vs_output(vinalogout, dpfout, mnames, args.out)
+        wpath = str(Path(args.wdir).absolute())
+        dock = ADParallel(None, args.ligand, None, wpath)
+        dock.cx, dock.cy, dock.cz = args.cx, args.cy, args.cz
+        if os.path.isdir(f"{wpath}/{ARCHIVE_DIR}"):
+            dock.archive = archive.ShardArchive(f"{wpath}/{ARCHIVE_DIR}")
+        if args.ligand is not None:
+            # parsed once, shared with the pool workers
+            dock.template = molop.MolModel.from_file(args.ligand)
+        if results.is_results_db(args.out):
+            resdb = results.ResultsDB(args.out)
+        else:
+            resdb = results.ResultsDB(f"{wpath}/results.sqlite")
+        # every ligand of the working directory is recovered
+        resdb.clear_library()
+        n = recover(dock, resdb, args.cores)
+        if not results.is_results_db(args.out):
+            resdb.export(args.out)
+        resdb.close()
+        print(f"{n} ligands recovered")
 
 
 if __name__ == "__main__":
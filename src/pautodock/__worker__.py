@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""worker.py
+
+This file is part of PAutoDock.
+Copyright (C) 2020 Giuseppe Marco Randazzo <gmrandazzo@gmail.com>
+PAutoDock is distributed under GPLv3 license.
+To know more in detail how the license work,
+please read the file "LICENSE" or
+go to "http://www.gnu.org/licenses/gpl-3.0.en.html"
+
+Provides a commandline worker of a distributed virtual screening.
+
+The screen is published by "pautodock --queue DIR"; start one worker
+per node with "pautodock-worker --queue DIR".
+"""
+
+import argparse
+import sys
+
+from pautodock.__main__ import DockingConfig, run_shards
+from pautodock.workqueue import WorkQueue
+
+
+def main() -> int:
+    """
+    Lease and screen shards until the queue is finished.
+    """
+    p = argparse.ArgumentParser(
+        description="PAutoDock distributed screening worker",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    p.add_argument("--queue", required=True, type=str, help="Shared queue directory")
+    p.add_argument(
+        "--cores",
+        type=int,
+        default=None,
+        help="Number of cores to use (default: all the cores of the machine)",
+    )
+    p.add_argument(
+        "--scratch",
+        type=str,
+        default=None,
+        help="Node local working directory (default: the system temporary directory)",
+    )
+    args = p.parse_args(sys.argv[1:])
+
+    try:
+        queue = WorkQueue(args.queue)
+        config = DockingConfig.from_dict(queue.read_config())
+        queue.lease_timeout = config.lease_timeout
+        nrun = run_shards(queue, config, args.cores, args.scratch)
+        print(f"{nrun} shards screened")
+        return 0
+    except Exception as err:
+        print(f"Error: {str(err)}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -14,18 +14,41 @@ Provides the basic code to run autodock in parallel on a machine.
 
 """
 
+import hashlib
 import logging
 import math
-import multiprocessing
 import os
+import resource
 import shutil
 import tempfile
+import time
+from dataclasses import dataclass, field
 from pathlib import Path
+from typing import Optional
 
-from pautodock import molop, multimol2op
-from pautodock.fileutils import get_bin_path
+from pautodock import (
+    archive,
+    gridcache,
+    ledger,
+    ligandstore,
+    molop,
+    multimol2op,
+    parsers,
+    receptorcache,
+    resultcache,
+    results,
+    runner,
+    scheduler,
+    trace,
+    vinaengine,
+)
+from pautodock.fileutils import get_bin_path, pautodock_home
 from pautodock.mgltoolsinstall import install_mgltools
 
+# subdirectories of the work directory
+LIGANDS_DIR = "ligands"
+ARCHIVE_DIR = "archive"
+
 
 class ADParallel(object):
     def __init__(self, receptor, ligand, db, wpath):
@@ -38,14 +61,14 @@ class ADParallel(object):
         except ValueError:
             self.vinapath = None
 
-        if not self.atdpath and not self.vinapath:
+        if not self.atdpath and not self.vinapath and not vinaengine.available():
             msg = "Error!! autodock and vina are not installed!\n"
             msg += "Unable to run any calculation."
             raise ValueError(msg)
 
-        self.mglpath = Path(f"{Path.home()}/.pautodock/MGLTools")
+        self.mglpath = Path(f"{pautodock_home()}/MGLTools")
         if not self.mglpath.exists():
-            install_mgltools(f"{Path.home()}/.pautodock")
+            install_mgltools(pautodock_home())
         self.receptor = receptor
         self.ligand = ligand
         self.db = db
@@ -62,6 +85,39 @@ class ADParallel(object):
         self.vina = True
         self.exhaustiveness = 32
         self.num_modes = 18
+        self.gridcache_dir = f"{pautodock_home()}/gridmaps"
+        self.gridmaps = None
+        # opt-in: wpath/results.sqlite already resumes a screen
+        self.result_cache_dir = None
+        self.result_cache_size = 2 << 30
+        self.result_cache = None
+        # opt-in: one file per ligand, kept until removed by the user
+        self.ligand_store_dir = None
+        self.ligand_store = None
+        self.receptor_cache_dir = f"{pautodock_home()}/receptors"
+        self.pack_ligands = False
+        self.pack_batch_size = 256
+        self.archive_shard_size = 1 << 30
+        self.archive = None
+        self.vina_conf = None
+        self.rec_pdbqt = None
+        self.rec_digest = None
+        self.prep_batch_size = 1
+        self.vina_batch_size = 1
+        self.vina_engine = "cli"
+        self.engine = None
+        self.job_timeout = None
+        self.trace = None
+        self.cores = None
+        self.ledger = None
+        self.receptor_model = None
+        self.template = None
+        self.db_start = 0
+        self.db_stop = None
+        self.db_shard = (0, 1)
+        self.db_sample = None
+        self.db_seed = 0
+        self.db_index = None
 
     def read_atom_types(self, rec_mol):
         """
@@ -86,36 +142,41 @@ class ADParallel(object):
             atypes_str += " %s" % atlst[i]
         return atypes_str, atlst
 
+    def receptor_types(self, rec_pdbqt):
+        """
+        Atom types of the receptor, from the parsed receptor model if any.
+        """
+        model = self.receptor_model
+        if model is not None and model.path == str(rec_pdbqt):
+            return " ".join(model.unique_types), model.unique_types
+        return self.read_atom_types(rec_pdbqt)
+
     def write_autodock_param_files(self, path, rec_pdbqt, mol_pdbqt, cc):
-        path_ = Path(path).absolute()
-        rat_str, _ = self.read_atom_types(rec_pdbqt)
-        lat_str, lat_lst = self.read_atom_types(path + "/" + mol_pdbqt)
+        _, rat_lst = self.receptor_types(rec_pdbqt)
+        _, lat_lst = self.read_atom_types(path + "/" + mol_pdbqt)
         # write the GPF
-        f = open(path + "/grid.gpf", "w")
-        f.write(
-            "npts %d %d %d # num.grid points in xyz\n"
-            % (self.gsize_x, self.gsize_y, self.gsize_z)
+        grid_path = gridcache.write_gpf(
+            path + "/grid.gpf",
+            rec_pdbqt,
+            rat_lst,
+            lat_lst,
+            cc,
+            [self.gsize_x, self.gsize_y, self.gsize_z],
+            path,
         )
-        f.write("gridfld %s/receptor_model.maps.fld     # grid_data_file\n" % (path_))
-        f.write("spacing 0.33 # spacing(A)\n")
-        f.write("receptor_types %s # receptor atom types\n" % (rat_str))
-        f.write("ligand_types %s # ligand atom types\n" % (lat_str))
-        f.write("receptor %s    # macromolecule\n" % (rec_pdbqt))
-        f.write(
-            "gridcenter %.3f %.3f %.3f       # xyz-coordinates or auto\n"
-            % (cc[0], cc[1], cc[2])
-        )
-        f.write("smooth 0.5  # store minimum energy w/in rad(A)\n")
-        for at in lat_lst:
-            f.write(
-                "map %s/receptor_model.%s.map # atom-specific aff. map\n" % (path_, at)
-            )
-        f.write("elecmap %s/receptor_model.e.map # El. Pot potential map\n" % (path_))
-        f.write("dsolvmap %s/receptor_model.d.map # desolv. potential map\n" % (path_))
-        f.write("dielectric -0.1465 # <0, AD4 dist-dep.diel;>0, constant\n")
-        f.close()
+        ind_path = self.write_dock_param_file(path, mol_pdbqt, cc, lat_lst, path)
+        return grid_path, ind_path
+
+    def write_dock_param_file(self, path, mol_pdbqt, cc, lat_lst, maps_path):
+        """
+        Write the AutoDock parameter file ind.dpf in path.
 
-        # Write autodock file
+        maps_path is the directory holding the AutoGrid maps, either the
+        ligand directory or a shared gridcache.GridMapCache path.
+        """
+        path_ = Path(path).absolute()
+        maps_ = f"{Path(maps_path).absolute()}/{gridcache.MAPS_PREFIX}"
+        lat_str = " ".join(lat_lst)
         f = open(path + "/ind.dpf", "w")
         f.write("autodock_parameter_version 4.2")
         f.write("# used by autodock to validate parameter set\n")
@@ -123,13 +184,11 @@ class ADParallel(object):
         f.write("intelec # calculate internal electrostatics\n")
         f.write("seed time pid # seeds for random generator\n")
         f.write("ligand_types %s # atoms types in ligand\n" % (lat_str))
-        f.write("fld %s/receptor_model.maps.fld      # grid_data_file\n" % (path_))
+        f.write("fld %s.maps.fld      # grid_data_file\n" % (maps_))
         for at in lat_lst:
-            f.write(
-                "map %s/receptor_model.%s.map # atom-specific aff. map\n" % (path_, at)
-            )
-        f.write("elecmap %s/receptor_model.e.map    # electrostatics map\n" % (path_))
-        f.write("desolvmap %s/receptor_model.d.map   # desolvation map\n" % (path_))
+            f.write("map %s.%s.map # atom-specific aff. map\n" % (maps_, at))
+        f.write("elecmap %s.e.map    # electrostatics map\n" % (maps_))
+        f.write("desolvmap %s.d.map   # desolvation map\n" % (maps_))
         f.write("move %s/%s                    # small molecule\n" % (path_, mol_pdbqt))
         f.write(
             "about %.4f %.4f %.4f       # small molecule center\n"
@@ -189,9 +248,7 @@ class ADParallel(object):
         f.write("analysis ")
         f.write("# perform a ranked cluster analysis\n")
         f.close()
-        grid_path = Path(path + "/grid.gpf").absolute()
-        ind_path = Path(path + "/ind.dpf").absolute()
-        return grid_path, ind_path
+        return Path(path + "/ind.dpf").absolute()
 
     def write_vina_param_files(self, path, cc, ss):
         vina_conf_path = Path(path) / "vina_conf.txt"
@@ -206,227 +263,1043 @@ class ADParallel(object):
             f.write(f"exhaustiveness = {self.exhaustiveness}\n")
         return vina_conf_path.resolve()
 
-    def RunAutoGrid(self, cmd):
+    def RunAutoGrid(self, args, log=None):
         atg_path = str(Path("%s/autogrid4" % (self.atdpath)).absolute())
-        return os.system("%s %s" % (atg_path, cmd))
+        return runner.run([atg_path] + args, log, self.job_timeout)
 
-    def RunAutoDock(self, cmd):
+    def RunAutoDock(self, args, log=None):
         atd_path = str(Path("%s/autodock4" % (self.atdpath)).absolute())
-        return os.system("%s %s" % (atd_path, cmd))
+        return runner.run([atd_path] + args, log, self.job_timeout)
 
-    def RunVina(self, cmd):
+    def RunVina(self, args, log=None):
         vina_path = str(Path("%s/vina" % (self.vinapath)).absolute())
-        return os.system("%s %s" % (vina_path, cmd))
+        return runner.run([vina_path] + args, log, self.job_timeout)
+
+    def run_failed(self, molname, res):
+        if res.timed_out:
+            logging.error(
+                "%s timed out for %s after %.0f s", res.program, molname, res.wall
+            )
+        else:
+            logging.error(
+                "%s failed for %s (exit status %s)",
+                res.program,
+                molname,
+                res.returncode,
+            )
 
     def ReadOutput(self, ofile):
-        r = []
-        header = []
-        benergy = []
-        c_rmsd = []
-        r_rmsd = []
-        f = open(str(Path(ofile).absolute()), "r")
-        for line in f:
-            if "Partition function, Q =" in line:
-                header.append("Part. Func.")
-                r.append(molop.nsplit(line.strip(), " ")[4])
-            elif "Free energy,        A ~" in line:
-                r.append(molop.nsplit(line.strip(), " ")[4])
-                header.append("Free Energy")
-            elif "Internal energy,    U =" in line:
-                header.append("Internal Energy")
-                r.append(molop.nsplit(line.strip(), " ")[4])
-            elif "Entropy,            S =" in line:
-                header.append("Entropy")
-                r.append(molop.nsplit(line.strip(), " ")[3])
-            elif "RANKING" in line:
-                v = molop.nsplit(line.strip(), " ")
-                benergy.append(float(v[3]))
-                c_rmsd.append(float(v[4]))
-                r_rmsd.append(float(v[5]))
-        f.close()
-        header.append("Binding Energy Average")
-        r.append(round(sum(benergy) / float(len(benergy)), 3))
-        header.append("Cluster RMSD Average")
-        r.append(round(sum(c_rmsd) / float(len(c_rmsd)), 3))
-        header.append("Ref. RMSD Average")
-        r.append(round(sum(r_rmsd) / float(len(r_rmsd)), 3))
-        return header, r
+        return parsers.read_dlg(ofile).summary()
 
     def LigandPosesBaricentreDistance(self, dock_pdbqt: str) -> float:
         """
         Calculate the distance between the ligand and docking pose baricentres.
         """
         poses_cc = molop.get_mol_baricentre(dock_pdbqt)
-        if int(self.cx) == 0:
-            self.cx, self.cy, self.cz = molop.get_mol_baricentre(self.ligand)
+        if self.template is None and self.ligand is not None:
+            self.template = molop.MolModel.from_file(self.ligand)
+        if self.template is not None:
+            cc = self.template.centroid
+        else:
+            cc = [self.cx, self.cy, self.cz]
         return math.sqrt(
-            (self.cx - poses_cc[0]) ** 2
-            + (self.cy - poses_cc[1]) ** 2
-            + (self.cz - poses_cc[2]) ** 2
+            (cc[0] - poses_cc[0]) ** 2
+            + (cc[1] - poses_cc[1]) ** 2
+            + (cc[2] - poses_cc[2]) ** 2
         )
 
     def read_vina_output(self, ofile):
-        benergy = []
-        f = open(str(Path(ofile).absolute()), "r")
-        getres = False
-        for line in f:
-            if getres:
-                # Filter double outputs
-                if "Writing output ... done." in line or "AutoDock Vina" in line:
-                    getres = False
-                else:
-                    try:
-                        v = molop.nsplit(line.strip(), " ")
-                        benergy.append(float(v[1]))
-                    except ValueError as err:
-                        logging.error("Error with file %s - %s" % (ofile, err))
-            else:
-                if "-----+------------+----------+----------" in line:
-                    getres = True
-                else:
-                    continue
+        stats = parsers.energy_stats(parsers.read_vina_log(ofile))
+        if stats is None:
+            return 9999.0, 9999.0, 9999.0
+        return stats
 
-        f.close()
-        if len(benergy) > 0:
-            return (
-                round(sum(benergy) / float(len(benergy)), 3),
-                min(benergy),
-                max(benergy),
+    def ligand_results(
+        self, molname, vinalog=None, dlg=None, vina_poses=None, dlg_result=None
+    ):
+        """
+        Collect the AutoDock and vina results of a ligand.
+
+        vina_poses and dlg_result are the records parsed by the worker
+        right after docking; the log files are read only when missing.
+        Without a vina log the poses are read from the REMARK VINA RESULT
+        records of the docked poses.
+
+        Return the AutoDock header and the result row
+        [molname, AutoDock values..., vina avg/min/max, pose distance].
+        """
+        h = []
+        r = []
+        if dlg_result is None and dlg is not None and Path(dlg).is_file():
+            dlg_result = parsers.read_dlg(dlg)
+        if dlg_result is not None:
+            h, r = dlg_result.summary()
+        avg_b, min_b, max_b = 9999.0, 9999.0, 9999.0
+        lp_dst = 9999.0
+        if vinalog is not None:
+            dock_poses = Path(
+                f"{Path(vinalog).parent.absolute()}/dock_confs_{molname}.pdbqt"
             )
-        else:
-            return 9999.0, 9999.0, 9999.0
+            if vina_poses is None:
+                vina_poses = self.parse_vina(vinalog, dock_poses)
+            stats = parsers.energy_stats(vina_poses)
+            if stats is not None:
+                avg_b, min_b, max_b = stats
+            if Path(vinalog).is_file() or dock_poses.is_file():
+                try:
+                    lp_dst = self.LigandPosesBaricentreDistance(str(dock_poses))
+                except FileNotFoundError as err:
+                    logging.error("%s not found", err)
+        return h, [molname] + r + [avg_b, min_b, max_b, lp_dst]
+
+    def parse_vina(self, vinalog, poses):
+        """
+        The poses of the vina log, or of the REMARK VINA RESULT records of
+        the docked poses when the log has no score table.
+        """
+        vina_poses = []
+        if Path(vinalog).is_file():
+            vina_poses = parsers.read_vina_log(vinalog)
+        if not vina_poses and Path(poses).is_file():
+            vina_poses = parsers.read_vina_poses(poses)
+        return vina_poses
+
+    def recover_ligand(self, mpath):
+        """
+        Parse the docking outputs left in a ligand directory.
+
+        Return the (header, row, vina poses, DLG result) of the ligand,
+        or None if the directory holds no docking output.
+        """
+        molname = Path(mpath).name
+        vinalog = f"{mpath}/vina_log.txt"
+        poses = f"{mpath}/dock_confs_{molname}.pdbqt"
+        dlg = f"{mpath}/ind.dlg"
+        has_vina = os.path.isfile(vinalog) or os.path.isfile(poses)
+        if not has_vina and not os.path.isfile(dlg):
+            return None
+        vina_poses = self.parse_vina(vinalog, poses) if has_vina else None
+        dlg_result = parsers.read_dlg(dlg) if os.path.isfile(dlg) else None
+        header, row = self.ligand_results(
+            molname, vinalog if has_vina else None, dlg, vina_poses, dlg_result
+        )
+        return header, row, vina_poses, dlg_result
+
+    def recover_archived(self, molname):
+        """
+        Parse the docking outputs of a ligand packed in the shard archive.
+        """
+        tmppath = tempfile.mkdtemp(prefix="recover_", dir=self.wpath)
+        try:
+            mpath = f"{tmppath}/{molname}"
+            self.archive.extract(molname, mpath)
+            return self.recover_ligand(mpath)
+        finally:
+            shutil.rmtree(tmppath, ignore_errors=True)
+
+    def write_vs_output(self, header, rows, otab):
+        """
+        Write the screening table from the rows given by ligand_results.
+        """
+        fo = open(otab, "w")
+        fo.write("Molname;")
+        for j in range(len(header)):
+            fo.write("%s;" % (header[j]))
+        fo.write("Avg. vina Binding Energy;")
+        fo.write("Min vina Binding Energy;Max vina Binding Energy;")
+        fo.write("Template-Ligand Baricenter Distance (docking pose check)\n")
+        for row in rows:
+            fo.write("%s;" % (row[0]))
+            for j in range(1, len(row) - 4):
+                fo.write("%s;" % (row[j]))
+            fo.write("%f;%f;%f;%f\n" % tuple(row[-4:]))
+        fo.close()
 
     def gen_vs_output(self, vinalogout, dpfout, mnames, otab):
         """
         Collect vina results
         """
-        # Collect the vina results
-        vbind = []
-        for i, vout in enumerate(vinalogout):
-            avg_b, min_b, max_b = self.read_vina_output(vout)
-            try:
-                dock_poses = (
-                    f"{Path(vout).parent.absolute()}/dock_confs_{mnames[i]}.pdbqt"
+        header = []
+        rows = []
+        for i, mname in enumerate(mnames):
+            vinalog = vinalogout[i] if i < len(vinalogout) else None
+            dlg = dpfout[i] if i < len(dpfout) else None
+            h, row = self.ligand_results(mname, vinalog, dlg)
+            header = header or h
+            rows.append(row)
+        self.write_vs_output(header, rows, otab)
+
+    def ligand_path(self, molname):
+        """
+        Directory of a ligand: wpath/<molname>, or, when the ligands are
+        packed, wpath/ligands/<h[:2]>/<h[2:4]>/<molname>, h the sha1 of
+        molname, so no directory holds more than a few hundred ligands.
+        The flat directory of older work directories is kept when it
+        exists.
+        """
+        wpath = Path(self.wpath).absolute()
+        flat = wpath / molname
+        if not self.pack_ligands or (
+            molname not in (LIGANDS_DIR, ARCHIVE_DIR) and flat.is_dir()
+        ):
+            return str(flat)
+        h = hashlib.sha1(molname.encode("utf8")).hexdigest()
+        return str(wpath / LIGANDS_DIR / h[:2] / h[2:4] / molname)
+
+    def ligand_dir(self, molname, record):
+        """
+        Create the ligand directory and write the mol2 record in it.
+        """
+        job = LigandJob(molname, self.ligand_path(molname))
+        try:
+            os.makedirs(job.mpath, exist_ok=True)
+        except FileNotFoundError:
+            # an empty fan-out directory was pruned by pack meanwhile
+            os.makedirs(job.mpath, exist_ok=True)
+        mol2_path = Path(job.mpath + "/" + molname + ".mol2").absolute()
+        if not mol2_path.exists():
+            mol2_path.write_bytes(record)
+        return job, str(mol2_path)
+
+    def pack(self, jobs):
+        """
+        Move the files of finished ligands to the shard archive, and
+        remove their directories and the fan-out directories left empty.
+        """
+        ligands = [(job.molname, job.mpath) for job in jobs if os.path.isdir(job.mpath)]
+        if not ligands:
+            return
+        with trace.span("pack"):
+            self.archive.add(ligands)
+        fanout = Path(self.wpath).absolute() / LIGANDS_DIR
+        for _, mpath in ligands:
+            shutil.rmtree(mpath, ignore_errors=True)
+            parent = Path(mpath).parent
+            while parent != fanout and fanout in parent.parents:
+                try:
+                    parent.rmdir()
+                except OSError:
+                    break
+                parent = parent.parent
+
+    def unpack(self, molname):
+        """
+        Extract the archived files of a ligand to its directory.
+        Return the directory, or None if the ligand is not archived.
+        """
+        if self.archive is None or not self.archive.has(molname):
+            return None
+        mpath = self.ligand_path(molname)
+        self.archive.extract(molname, mpath)
+        return mpath
+
+    def stage_done(self, molname, stage):
+        """
+        Return the output of a stage recorded as done in the ledger.
+        """
+        if self.ledger is None:
+            return None
+        return self.ledger.done(molname, stage)
+
+    def mark_stage(self, molname, stage, output=None):
+        if self.ledger is not None:
+            self.ledger.mark(molname, stage, output)
+
+    def prepared_job(self, molname):
+        """
+        Return the job of a ligand already prepared, or None.
+        """
+        mol_pdbqt = self.stage_done(molname, ledger.PREPARED)
+        if not mol_pdbqt:
+            return None
+        job = LigandJob(molname, str(Path(mol_pdbqt).parent), mol_pdbqt)
+        if self.atd:
+            _, job.lat_lst = self.read_atom_types(job.mol_pdbqt)
+        return job
+
+    def prepare_ligand(self, molname, record):
+        """
+        Write the mol2 in the ligand directory and convert it to pdbqt.
+        """
+        job = self.prepared_job(molname)
+        if job is not None:
+            return job
+        job, mol2_path = self.ligand_dir(molname, record)
+        if self.ligand_store is not None:
+            self.prepare_from_store([job], [record])
+            if job.failed:
+                return job
+        else:
+            mol = molop.Molecule(mol2_path, self.mglpath)
+            job.mol_pdbqt = mol.topdbqt([self.cx, self.cy, self.cz])
+        self.mark_stage(molname, ledger.PREPARED, job.mol_pdbqt)
+        if self.atd:
+            _, job.lat_lst = self.read_atom_types(job.mol_pdbqt)
+        return job
+
+    def prepare_batch(self, chunk):
+        """
+        Prepare a chunk of (molname, record) with a single obabel run.
+        The jobs of the molecules that cannot be converted are marked
+        failed, the others go on.
+        """
+        jobs = []
+        todo = []
+        mol2lst = []
+        records = []
+        for molname, record in chunk:
+            job = self.prepared_job(molname)
+            if job is None:
+                job, mol2_path = self.ligand_dir(molname, record)
+                todo.append(job)
+                mol2lst.append(mol2_path)
+                records.append(record)
+            jobs.append(job)
+        if mol2lst:
+            if self.ligand_store is not None:
+                self.prepare_from_store(todo, records)
+            else:
+                pdbqtlst = molop.batch_topdbqt(
+                    mol2lst, self.mglpath, [self.cx, self.cy, self.cz]
                 )
-                lp_dst = self.LigandPosesBaricentreDistance(dock_poses)
-            except FileNotFoundError as err:
-                logging.error("%s not found", err)
-                lp_dst = 9999.0
-            vbind.append([avg_b, min_b, max_b, lp_dst])
-        # Collect results
-        fo = open(otab, "w")
-        firstline = True
-        for i in range(len(mnames)):
-            h = []
-            r = []
-            if len(dpfout) > 0:
-                if Path(dpfout[i]).is_file():
-                    h, r = self.ReadOutput(dpfout[i])
-            if firstline:
-                firstline = False
-                fo.write("Molname;")
-                for j in range(len(h)):
-                    fo.write("%s;" % (h[j]))
-                fo.write("Avg. vina Binding Energy;")
-                fo.write("Min vina Binding Energy;Max vina Binding Energy;")
-                fo.write("Template-Ligand Baricenter Distance (docking pose check)\n")
-            fo.write("%s;" % (mnames[i]))
-            for j in range(len(r)):
-                fo.write("%s;" % (r[j]))
-            fo.write(
-                "%f;%f;%f;%f\n" % (vbind[i][0], vbind[i][1], vbind[i][2], vbind[i][3])
+                for job, mol_pdbqt in zip(todo, pdbqtlst):
+                    job.mol_pdbqt = mol_pdbqt
+                    job.failed = mol_pdbqt is None
+            for job in todo:
+                if job.failed:
+                    continue
+                self.mark_stage(job.molname, ledger.PREPARED, job.mol_pdbqt)
+                if self.atd:
+                    _, job.lat_lst = self.read_atom_types(job.mol_pdbqt)
+        return jobs
+
+    def prepare_from_store(self, jobs, records):
+        """
+        Copy the prepared ligands of the records from the ligand store,
+        preparing the missing ones with a single obabel run, and
+        translate them to the box centre. The ligands that cannot be
+        prepared are marked failed.
+        """
+        self.ligand_store.prepare_batch(
+            [(job.molname, record) for job, record in zip(jobs, records)]
+        )
+        for job, record in zip(jobs, records):
+            mol_pdbqt = str(Path(f"{job.mpath}/{job.molname}.pdbqt").absolute())
+            try:
+                if not self.ligand_store.fetch(record, mol_pdbqt):
+                    raise ValueError("not in the ligand store")
+                with trace.span("translate"):
+                    molop.translate_pdbqt(mol_pdbqt, [self.cx, self.cy, self.cz])
+            except ValueError as err:
+                logging.error("Unable to prepare the ligand %s: %s", job.molname, err)
+                job.failed = True
+                continue
+            job.mol_pdbqt = mol_pdbqt
+
+    def build_grid(self, lat_lst):
+        """
+        Compute the shared AutoGrid maps of the given ligand atom types.
+        """
+        self.gridmaps.ensure(lat_lst, lambda args: self.RunAutoGrid(args).returncode)
+        return lat_lst
+
+    def dock_autodock(self, job):
+        job.dlg = self.stage_done(job.molname, ledger.DOCKED_AUTODOCK)
+        if job.dlg or self.restore_autodock(job):
+            return job
+        dpf_path = self.stage_done(job.molname, ledger.GRIDDED)
+        if not dpf_path:
+            dpf_path = self.write_dock_param_file(
+                job.mpath,
+                str(Path(job.mol_pdbqt).name),
+                [self.cx, self.cy, self.cz],
+                job.lat_lst,
+                self.gridmaps.path,
             )
-        fo.close()
+            self.mark_stage(job.molname, ledger.GRIDDED, dpf_path)
+        job.dlg = str(dpf_path).replace(".dpf", ".dlg")
+        res = self.RunAutoDock(["-p", str(dpf_path), "-l", job.dlg])
+        job.metrics.append(res.metrics())
+        if res.returncode == 0 and Path(job.dlg).is_file():
+            job.dlg_result = parsers.read_dlg(job.dlg)
+            self.mark_stage(job.molname, ledger.DOCKED_AUTODOCK, job.dlg)
+            self.store_result(job, "autodock", dlg=job.dlg)
+        else:
+            self.run_failed(job.molname, res)
+        return job
+
+    def dock_vina(self, job, ncpu=1):
+        job.vinalog = f"{job.mpath}/vina_log.txt"
+        if self.stage_done(job.molname, ledger.DOCKED_VINA):
+            return job
+        if self.restore_vina(job):
+            return job
+        if self.engine is not None:
+            return self.dock_vina_engine(job)
+        vconf_path = self.vina_conf or self.write_vina_param_files(
+            job.mpath,
+            [self.cx, self.cy, self.cz],
+            [self.gsize_x, self.gsize_y, self.gsize_z],
+        )
+        # a killed run may have left a partial log and poses
+        poses = Path(f"{job.mpath}/dock_confs_{job.molname}.pdbqt")
+        for partial in [Path(job.vinalog), poses]:
+            if partial.exists():
+                partial.unlink()
+        res = self.RunVina(
+            self.make_vina_cmd(
+                vconf_path,
+                self.rec_pdbqt,
+                job.mol_pdbqt,
+                job.mpath,
+                job.molname,
+                ncpu,
+            ),
+            job.vinalog,
+        )
+        job.metrics.append(res.metrics())
+        if res.returncode == 0 and poses.is_file():
+            job.vina_poses = self.parse_vina(job.vinalog, poses)
+            self.mark_stage(job.molname, ledger.DOCKED_VINA, poses)
+            self.store_result(job, "vina", poses=poses, log=job.vinalog)
+        else:
+            self.run_failed(job.molname, res)
+        return job
+
+    def dock_vina_engine(self, job):
+        """
+        Dock a ligand with the in-process vina engine of this worker.
+
+        The poses are written next to the ligand and parsed into the job
+        for the results writer.
+        """
+        start = time.monotonic()
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        res = self.engine.dock(job.mol_pdbqt)
+        end = resource.getrusage(resource.RUSAGE_SELF)
+        job.metrics.append(
+            {
+                "program": "vina-python",
+                "returncode": 0,
+                "wall": time.monotonic() - start,
+                "user": end.ru_utime - usage.ru_utime,
+                "sys": end.ru_stime - usage.ru_stime,
+                "maxrss": end.ru_maxrss,
+                "timed_out": False,
+            }
+        )
+        poses = Path(f"{job.mpath}/dock_confs_{job.molname}.pdbqt")
+        tmp = poses.with_suffix(".tmp")
+        tmp.write_text(res.poses, encoding="utf8")
+        os.replace(tmp, poses)
+        job.vina_poses = parsers.vina_remarks(res.poses) or [
+            parsers.VinaPose(i + 1, e, 0.0, 0.0) for i, e in enumerate(res.energies)
+        ]
+        self.mark_stage(job.molname, ledger.DOCKED_VINA, poses)
+        self.store_result(job, "vina", poses=poses)
+        return job
+
+    def dock_vina_batch(self, jobs, ncpu=1):
+        """
+        Dock a batch of ligands with a single vina process (vina >= 1.2).
+
+        The receptor is read and its grid computed once for the whole
+        batch. vina writes every output in one directory; the poses are
+        moved to the ligand directories and the per-ligand score table is
+        rebuilt from the REMARK VINA RESULT records of the poses. If vina
+        fails or times out, its outputs are discarded and the ligands are
+        docked again one at a time.
+        """
+        if self.engine is not None:
+            return [self.dock_vina(job, ncpu) for job in jobs]
+        todo = []
+        for job in jobs:
+            job.vinalog = f"{job.mpath}/vina_log.txt"
+            if self.stage_done(job.molname, ledger.DOCKED_VINA):
+                continue
+            if not self.restore_vina(job):
+                todo.append(job)
+        if not todo:
+            return jobs
+        bpath = Path(tempfile.mkdtemp(prefix="vina_batch_", dir=self.wpath))
+        vconf_path = self.vina_conf or self.write_vina_param_files(
+            bpath,
+            [self.cx, self.cy, self.cz],
+            [self.gsize_x, self.gsize_y, self.gsize_z],
+        )
+        args = ["--config", vconf_path, "--cpu", ncpu, "--receptor", self.rec_pdbqt]
+        for job in todo:
+            args += ["--batch", job.mol_pdbqt]
+        args += ["--dir", bpath]
+        res = self.RunVina(args, bpath / "vina_batch_log.txt")
+        # the batch resources are shared evenly among its ligands
+        metrics = res.metrics()
+        metrics["program"] = "vina-batch"
+        for key in ["wall", "user", "sys"]:
+            metrics[key] /= len(todo)
+        for job in todo:
+            job.metrics.append(dict(metrics))
+        if res.returncode != 0 or res.timed_out:
+            self.run_failed(f"a batch of {len(todo)} ligands", res)
+            shutil.rmtree(bpath, ignore_errors=True)
+            for job in todo:
+                self.dock_vina(job, ncpu)
+            return jobs
+        for job in todo:
+            out = bpath / f"{Path(job.mol_pdbqt).stem}_out.pdbqt"
+            if not out.is_file():
+                self.run_failed(job.molname, res)
+                continue
+            poses = Path(f"{job.mpath}/dock_confs_{job.molname}.pdbqt")
+            os.replace(out, poses)
+            job.vina_poses = parsers.read_vina_poses(poses)
+            self.write_vina_log(job.vina_poses, job.vinalog)
+            self.mark_stage(job.molname, ledger.DOCKED_VINA, poses)
+            self.store_result(job, "vina", poses=poses, log=job.vinalog)
+        shutil.rmtree(bpath, ignore_errors=True)
+        return jobs
+
+    def cache_key(self, program, mol_pdbqt):
+        """
+        Result cache key of a vina or AutoDock job of a prepared ligand.
+        """
+        params = [
+            program,
+            resultcache.pdbqt_digest(mol_pdbqt),
+            self.rec_digest,
+            "%.3f %.3f %.3f" % (self.cx, self.cy, self.cz),
+            "%d %d %d" % (self.gsize_x, self.gsize_y, self.gsize_z),
+        ]
+        if program == "vina":
+            params += [self.vina_engine, self.exhaustiveness, self.num_modes]
+        else:
+            params += [
+                self.speed,
+                gridcache.GRID_SPACING,
+                gridcache.GRID_SMOOTH,
+                gridcache.GRID_DIELECTRIC,
+            ]
+        return resultcache.make_key(*params)
+
+    def store_result(self, job, program, **files):
+        """
+        Add the output files of a successful job to the result cache.
+        """
+        if self.result_cache is None:
+            return
+        texts = {
+            name: Path(path).read_text(encoding="utf8")
+            for name, path in files.items()
+            if Path(path).is_file()
+        }
+        self.result_cache.put(self.cache_key(program, job.mol_pdbqt), program, texts)
+
+    def restore_files(self, texts, paths):
+        for name, path in paths.items():
+            if name in texts:
+                tmp = f"{path}.tmp"
+                with open(tmp, "w", encoding="utf8") as f:
+                    f.write(texts[name])
+                os.replace(tmp, path)
+            elif os.path.exists(path):
+                os.unlink(path)
+
+    def restore_vina(self, job):
+        """
+        Write the cached vina outputs of an identical job, if any, in the
+        ligand directory. Return True on a cache hit.
+        """
+        if self.result_cache is None:
+            return False
+        texts = self.result_cache.get(self.cache_key("vina", job.mol_pdbqt))
+        if texts is None:
+            return False
+        job.vinalog = f"{job.mpath}/vina_log.txt"
+        poses = f"{job.mpath}/dock_confs_{job.molname}.pdbqt"
+        self.restore_files(texts, {"poses": poses, "log": job.vinalog})
+        job.vina_poses = self.parse_vina(job.vinalog, poses)
+        self.mark_stage(job.molname, ledger.DOCKED_VINA, poses)
+        return True
+
+    def restore_autodock(self, job):
+        """
+        Write the cached DLG of an identical AutoDock job, if any.
+        Return True on a cache hit.
+        """
+        if self.result_cache is None:
+            return False
+        texts = self.result_cache.get(self.cache_key("autodock", job.mol_pdbqt))
+        if texts is None:
+            return False
+        job.dlg = f"{job.mpath}/ind.dlg"
+        self.restore_files(texts, {"dlg": job.dlg})
+        job.dlg_result = parsers.read_dlg(job.dlg)
+        self.mark_stage(job.molname, ledger.DOCKED_AUTODOCK, job.dlg)
+        return True
+
+    def write_vina_log(self, vina_poses, vinalog):
+        """
+        Write the vina score table of a ligand from its parsed poses.
+        """
+        with open(vinalog, "w", encoding="utf8") as fo:
+            fo.write("mode |   affinity | dist from best mode\n")
+            fo.write("     | (kcal/mol) | rmsd l.b.| rmsd u.b.\n")
+            fo.write("-----+------------+----------+----------\n")
+            for p in vina_poses:
+                fo.write(
+                    "%4d %12.1f %10.3f %10.3f\n"
+                    % (p.mode, p.energy, p.rmsd_lb, p.rmsd_ub)
+                )
+
+    def parse_ligand(self, job):
+        return self.ligand_results(
+            job.molname, job.vinalog, job.dlg, job.vina_poses, job.dlg_result
+        )
 
     def make_vina_cmd(
-        self, vconf_path, rec_pdbqt, mol_pdbqt, mpath, molname, vinalogout
-    ) -> str:
-        vc = f'--config "{vconf_path}"'
-        vc += f' --receptor "{rec_pdbqt}"'
-        vc += f' --ligand "{mol_pdbqt}"'
-        vc += f' --out "{mpath}/dock_confs_{molname}.pdbqt" >> {vinalogout}'
+        self, vconf_path, rec_pdbqt, mol_pdbqt, mpath, molname, ncpu=None
+    ) -> list:
+        vc = ["--config", str(vconf_path)]
+        if ncpu is not None:
+            vc += ["--cpu", str(ncpu)]
+        vc += ["--receptor", str(rec_pdbqt)]
+        vc += ["--ligand", str(mol_pdbqt)]
+        vc += ["--out", f"{mpath}/dock_confs_{molname}.pdbqt"]
         return vc
 
-    def virtual_screening(self, otab):
-        # Prepare the receptor
-        rec = molop.Receptor(self.receptor, self.mglpath)
-        rec_pdbqt = rec.topdbqt()
+    def library_records(self, resdbs=()):
+        """
+        Return the (molname, mol2 record) of the library slice to screen.
+
+        The whole library is streamed once; a slice, a shard or a random
+        sample is read through the multimol2op.Mol2Index side-car index.
+        The index of every record in the library is stored in the
+        results.ResultsDB of resdbs, so they export this library only.
+        """
+        if (
+            self.db_start == 0
+            and self.db_stop is None
+            and tuple(self.db_shard) == (0, 1)
+            and self.db_sample is None
+        ):
+            for i, (molname, record) in enumerate(multimol2op.iter_mol2(self.db)):
+                for resdb in resdbs:
+                    resdb.add_library(i, molname)
+                yield molname, record
+            return
+        with self.library_index() as index:
+            selection = self.library_selection(index)
+            for i, (molname, record) in zip(selection, index.iter_records(selection)):
+                for resdb in resdbs:
+                    resdb.add_library(i, molname)
+                yield molname, record
+
+    def library_index(self):
+        """
+        The side-car index of the library, db_index if given.
+        """
+        if self.db_index is not None:
+            return multimol2op.Mol2Index(self.db, self.db_index)
+        try:
+            return multimol2op.Mol2Index(self.db)
+        except PermissionError:
+            # read-only library: keep the index in the working directory
+            os.makedirs(self.wpath, exist_ok=True)
+            idx = f"{Path(self.wpath).absolute()}/{Path(self.db).name}.idx"
+            return multimol2op.Mol2Index(self.db, idx)
+
+    def library_selection(self, index):
+        return index.select(
+            self.db_start,
+            self.db_stop,
+            self.db_shard[0],
+            self.db_shard[1],
+            self.db_sample,
+            self.db_seed,
+        )
+
+    def library_size(self):
+        """
+        Number of records of the library slice to screen.
+        """
+        with self.library_index() as index:
+            return len(self.library_selection(index))
+
+    def prepare_screen(self):
+        """
+        Prepare the receptor, the grid maps, the vina engine and the
+        ledger of a screen.
+        """
+        # Prepare the receptor, once per receptor content
+        if self.receptor_cache_dir is not None:
+            cache = receptorcache.ReceptorCache(self.receptor_cache_dir)
+            self.rec_pdbqt = cache.prepare(self.receptor, self.mglpath)
+        else:
+            self.rec_pdbqt = molop.Receptor(self.receptor, self.mglpath).topdbqt()
+        # Parse receptor and template once, shared read-only with the workers
+        self.receptor_model = molop.MolModel.from_file(self.rec_pdbqt)
         if self.ligand is not None:
-            self.cx, self.cy, self.cz = molop.get_mol_baricentre(self.ligand)
-        # Prepare the database split multi mol2
-        tmppath = tempfile.mkdtemp()
-        mol2lst = multimol2op.split_mol2(self.db, tmppath)
-        agcmdlst = []
-        adcmdlst = []
-        vinacmdlst = []
-        vinalogout = []
-        dpfout = []
-        mnames = []
-        # Create a directory with the name of the mol2 molecule
-        # and copy the receptor and itself
-        for mol2 in mol2lst:
-            molname_ext = str(Path(mol2).resolve().name)
-            molname = molname_ext.replace(".mol2", "")
-            mnames.append(molname)
-            mpath = str(Path(self.wpath + "/" + molname).absolute())
-            if not Path(f"{mpath}/dock_confs_{molname}.pdbqt").exists():
-                if not Path(mpath).exists():
-                    os.makedirs(mpath)
-                if not Path(mpath + "/" + molname_ext).exists():
-                    shutil.move(str(Path(mol2).resolve()), mpath)
-
-                mol = molop.Molecule(
-                    str(Path(mpath + "/" + molname_ext).absolute()), self.mglpath
-                )
-                mol_pdbqt = mol.topdbqt([self.cx, self.cy, self.cz])
-                mol_pdbqt_name = str(Path(mol_pdbqt).resolve().name)
-                if self.atd:
-                    gpf_path, dpf_path = self.write_autodock_param_files(
-                        mpath, rec_pdbqt, mol_pdbqt_name, [self.cx, self.cy, self.cz]
-                    )
-                    first_arg = str(gpf_path)
-                    second_arg = str(gpf_path).replace(".gpf", "")
-                    ag = f'-p "{first_arg}" -l "{second_arg}.glg"'
-                    agcmdlst.append(ag)
-                    dpfout.append(str(dpf_path).replace(".dpf", ".dlg"))
-                    ad = f'-p "{str(dpf_path)}" -l "{dpfout[-1]}"'
-                    adcmdlst.append(ad)
-
-                if self.vina:
-                    vinalogout.append(f"{mpath}/vina_log.txt")
-                    # If the log and the docking pose extists then
-                    # there is no need to run the calculation
-                    vconf_path = self.write_vina_param_files(
-                        mpath,
-                        [self.cx, self.cy, self.cz],
-                        [self.gsize_x, self.gsize_y, self.gsize_z],
-                    )
-                    vinacmdlst.append(
-                        self.make_vina_cmd(
-                            vconf_path,
-                            rec_pdbqt,
-                            mol_pdbqt,
-                            mpath,
-                            molname,
-                            vinalogout[-1],
-                        )
-                    )
-            else:
-                vinalogout.append(f"{mpath}/vina_log.txt")
-        shutil.rmtree(tmppath)
-        ncpu = multiprocessing.cpu_count()
+            self.template = molop.MolModel.from_file(self.ligand)
+            self.cx, self.cy, self.cz = self.template.centroid
         if self.atd:
-            # Run AutoGrid
-            pool = multiprocessing.Pool(ncpu)
-            pool.map(self.RunAutoGrid, agcmdlst)
-            # RunAutodock
-            pool = multiprocessing.Pool(ncpu)
-            pool.map(self.RunAutoDock, adcmdlst)
+            self.gridmaps = gridcache.GridMapCache(
+                self.gridcache_dir,
+                self.rec_pdbqt,
+                self.receptor_model.unique_types,
+                [self.cx, self.cy, self.cz],
+                [self.gsize_x, self.gsize_y, self.gsize_z],
+            )
+        self.engine = self.make_engine()
+        self.rec_digest = resultcache.pdbqt_digest(self.rec_pdbqt)
+        if self.result_cache_dir is not None:
+            self.result_cache = resultcache.ResultCache(
+                self.result_cache_dir, self.result_cache_size
+            )
+        if self.ligand_store_dir is not None:
+            self.ligand_store = ligandstore.LigandStore(
+                self.ligand_store_dir, self.mglpath
+            )
+        os.makedirs(self.wpath, exist_ok=True)
+        self.ledger = ledger.Ledger(f"{self.wpath}/ledger.sqlite")
+        self.write_screen_params()
 
+    def write_screen_params(self):
+        """
+        Write the parameter files shared by every ligand of the screen in
+        wpath, and open the shard archive of the finished ligands.
+        """
+        os.makedirs(self.wpath, exist_ok=True)
         if self.vina:
-            # RunVina
-            pool = multiprocessing.Pool(ncpu)
-            pool.map(self.RunVina, vinacmdlst)
+            self.vina_conf = self.write_vina_param_files(
+                self.wpath,
+                [self.cx, self.cy, self.cz],
+                [self.gsize_x, self.gsize_y, self.gsize_z],
+            )
+        if self.pack_ligands:
+            self.archive = archive.ShardArchive(
+                f"{self.wpath}/{ARCHIVE_DIR}", self.archive_shard_size
+            )
+
+    def make_engine(self):
+        """
+        The in-process vina engine of the screen settings, or None.
+        """
+        if not self.vina or self.vina_engine != "python":
+            return None
+        return vinaengine.VinaEngine(
+            self.rec_pdbqt,
+            [self.cx, self.cy, self.cz],
+            [self.gsize_x, self.gsize_y, self.gsize_z],
+            self.exhaustiveness,
+            self.num_modes,
+        )
 
+    def virtual_screening(self, otab):
+        if self.trace is not None:
+            trace.enable()
+        self.prepare_screen()
+        # Results are stored as soon as each ligand is done
+        if results.is_results_db(otab):
+            resdb = results.ResultsDB(otab)
+        else:
+            resdb = results.ResultsDB(f"{self.wpath}/results.sqlite")
+        # Stream the database records from the multi mol2
+        resdb.clear_library()
+        pipeline = ScreeningPipeline(self, resdb)
+        pipeline.run(self.library_records([resdb]))
+        if self.trace is not None:
+            events = trace.drain()
+            trace.write_chrome(self.trace, events)
+            print(trace.summary(events, pipeline.sched.cores, pipeline.nparsed))
+            trace.enable(False)
         # Write the output table
-        self.gen_vs_output(vinalogout, dpfout, mnames, otab)
+        if not results.is_results_db(otab):
+            resdb.export(otab)
+        resdb.close()
+
+
+@dataclass
+class LigandJob:
+    """State of a ligand moving through the screening pipeline."""
+
+    molname: str
+    mpath: str
+    mol_pdbqt: Optional[str] = None
+    lat_lst: list = field(default_factory=list)
+    dlg: Optional[str] = None
+    vinalog: Optional[str] = None
+    vina_poses: Optional[list] = None
+    dlg_result: Optional[parsers.DLGResult] = None
+    metrics: list = field(default_factory=list)
+    failed: bool = False
+
+    def merge(self, job):
+        """
+        Add the outputs of the same ligand docked by another branch.
+        """
+        self.dlg = job.dlg or self.dlg
+        self.vinalog = job.vinalog or self.vinalog
+        if job.vina_poses is not None:
+            self.vina_poses = job.vina_poses
+        if job.dlg_result is not None:
+            self.dlg_result = job.dlg_result
+        self.metrics = self.metrics + [m for m in job.metrics if m not in self.metrics]
+
+
+class ScreeningPipeline(object):
+    """
+    Move every ligand through prepare -> grid -> AutoDock/vina -> parse.
+
+    Ligands are prepared one by one, or in chunks of prep_batch_size
+    converted by a single obabel run.
+
+    Each stage is submitted to a single scheduler.Scheduler as soon as
+    the stages it depends on are done. AutoDock and vina of a ligand run
+    concurrently; AutoDock waits only for the grid maps of the ligand
+    atom types, which are computed once in the shared grid cache.
+    The directories of parsed ligands are packed in the shard archive.
+    vina tasks are elastic, except with the in-process vina engine,
+    whose number of threads is fixed when it is built.
+    """
+
+    def __init__(self, dock, resdb, cores=None):
+        self.dock = dock
+        self.resdb = resdb
+        self.sched = scheduler.Scheduler(
+            dock, cores or dock.cores, idle=self.flush_vina_batch
+        )
+        self.jobs = {}
+        self.vina_batch = []
+        self.packing = []
+        self.nparsed = 0
+        self.branches = {}
+        self.grid_ready = set()
+        self.grid_pending = set()
+        self.grid_waiting = []
+        if dock.atd:
+            self.grid_ready.update(dock.gridmaps.available_types())
+
+    def tasks(self, records):
+        chunk = []
+        batch_size = max(1, self.dock.prep_batch_size)
+        parsed = set()
+        if self.dock.ledger is not None:
+            parsed = self.dock.ledger.completed(ledger.PARSED)
+        for molname, record in records:
+            if molname in parsed and self.resdb.has(molname):
+                self.already_parsed(molname)
+                continue
+            elif molname in parsed:
+                # The ledger says the ligand is done: only collect its results
+                mpath = self.dock.unpack(molname) or self.dock.ligand_path(molname)
+                job = LigandJob(molname, mpath)
+                self.jobs[molname] = job
+                if self.dock.vina:
+                    job.vinalog = f"{mpath}/vina_log.txt"
+                if self.dock.atd:
+                    job.dlg = f"{mpath}/ind.dlg"
+                yield scheduler.Task("parse_ligand", (job,), self.parsed)
+            elif batch_size == 1:
+                yield scheduler.Task(
+                    "prepare_ligand",
+                    (molname, record),
+                    self.prepared,
+                    otherwise=self.unprepared,
+                )
+            else:
+                chunk.append((molname, record))
+                if len(chunk) == batch_size:
+                    yield self.prepare_batch_task(chunk)
+                    chunk = []
+        if chunk:
+            yield self.prepare_batch_task(chunk)
+
+    def prepare_batch_task(self, chunk):
+        return scheduler.Task(
+            "prepare_batch",
+            (chunk,),
+            self.prepared_batch,
+            otherwise=self.unprepared_batch,
+        )
+
+    def prepared_batch(self, jobs):
+        for job in jobs:
+            self.prepared(job)
+
+    def unprepared(self, molname, record=None):
+        """
+        Called when the preparation of a ligand raised: it is parsed as
+        a failed ligand. A docking task that raises is likewise followed
+        by the parsing of the outputs the ligand has.
+        """
+        self.prepared(LigandJob(molname, self.dock.ligand_path(molname), failed=True))
+
+    def unprepared_batch(self, chunk):
+        for molname, record in chunk:
+            self.unprepared(molname, record)
+
+    def prepared(self, job):
+        self.jobs[job.molname] = job
+        if job.failed:
+            self.ligand_failed(job)
+            return
+        self.branches[job.molname] = int(self.dock.atd) + int(self.dock.vina)
+        if self.dock.vina and self.dock.vina_batch_size > 1:
+            self.vina_batch.append(job)
+            if len(self.vina_batch) >= self.dock.vina_batch_size:
+                self.flush_vina_batch()
+        elif self.dock.vina:
+            self.sched.submit(
+                scheduler.Task(
+                    "dock_vina",
+                    (job,),
+                    self.docked,
+                    otherwise=self.docked,
+                    elastic=self.dock.engine is None,
+                )
+            )
+        if self.dock.atd:
+            self.autodock(job)
+        if self.branches[job.molname] == 0:
+            self.sched.submit(scheduler.Task("parse_ligand", (job,), self.parsed))
+
+    def ligand_failed(self, job):
+        """
+        A ligand that could not be prepared is parsed without docking
+        outputs, so it gets a row of 9999 values as a failed run.
+        """
+        self.branches[job.molname] = 0
+        self.sched.submit(scheduler.Task("parse_ligand", (job,), self.parsed))
+
+    def already_parsed(self, molname):
+        """
+        Called for the ligands whose results are already stored.
+        """
+
+    def autodock(self, job):
+        """
+        Submit the AutoDock run of a job, or make it wait for the grid
+        maps of its atom types.
+        """
+        missing = set(job.lat_lst) - self.grid_ready
+        if not missing:
+            self.submit_autodock(job)
+            return
+        self.grid_waiting.append(job)
+        missing -= self.grid_pending
+        if missing:
+            self.grid_pending.update(missing)
+            self.sched.submit(
+                scheduler.Task(
+                    "build_grid",
+                    (sorted(missing),),
+                    self.gridded,
+                    otherwise=self.grid_failed,
+                )
+            )
+
+    def submit_autodock(self, job):
+        self.sched.submit(
+            scheduler.Task("dock_autodock", (job,), self.docked, otherwise=self.docked)
+        )
+
+    def flush_vina_batch(self):
+        """
+        Submit the ligands waiting for a vina batch.
+
+        Called when a batch is full, and by the scheduler when cores
+        would otherwise stay idle, so the last partial batch never waits.
+        """
+        if self.vina_batch:
+            self.sched.submit(
+                scheduler.Task(
+                    "dock_vina_batch",
+                    (self.vina_batch,),
+                    self.docked_batch,
+                    otherwise=self.docked_batch,
+                    elastic=self.dock.engine is None,
+                )
+            )
+            self.vina_batch = []
+
+    def docked_batch(self, jobs):
+        for job in jobs:
+            self.docked(job)
+
+    def gridded(self, lat_lst):
+        self.grid_ready.update(lat_lst)
+        self.grid_pending.difference_update(lat_lst)
+        waiting = []
+        for job in self.grid_waiting:
+            if set(job.lat_lst) <= self.grid_ready:
+                self.submit_autodock(job)
+            else:
+                waiting.append(job)
+        self.grid_waiting = waiting
+
+    def grid_failed(self, lat_lst):
+        """
+        The grid maps of lat_lst could not be computed: the ligands
+        waiting for them are parsed without AutoDock results.
+        """
+        self.grid_pending.difference_update(lat_lst)
+        waiting = []
+        for job in self.grid_waiting:
+            if set(job.lat_lst) & set(lat_lst):
+                self.autodock_failed(job)
+            else:
+                waiting.append(job)
+        self.grid_waiting = waiting
+
+    def autodock_failed(self, job):
+        self.docked(job)
+
+    def docked(self, job):
+        merged = self.jobs[job.molname]
+        merged.merge(job)
+        self.branches[job.molname] -= 1
+        if self.branches[job.molname] == 0:
+            self.sched.submit(scheduler.Task("parse_ligand", (merged,), self.parsed))
+
+    def parsed(self, result):
+        header, row = result
+        self.resdb.add(header, row)
+        self.nparsed += 1
+        job = self.jobs.get(row[0])
+        if job is not None and job.metrics:
+            self.resdb.add_metrics(row[0], job.metrics)
+        if job is not None:
+            self.resdb.add_poses(row[0], job.vina_poses, job.dlg_result)
+        if self.dock.ledger is not None:
+            self.dock.ledger.mark(row[0], ledger.PARSED)
+        self.jobs.pop(row[0], None)
+        if job is not None:
+            self.pack(self.dock, job)
+
+    def pack(self, dock, job):
+        """
+        Queue the directory of a parsed ligand for the shard archive of
+        dock; directories are packed in batches of pack_batch_size.
+        """
+        if dock.archive is None:
+            return
+        self.packing.append((dock, job))
+        if len(self.packing) >= dock.pack_batch_size:
+            self.flush_packing()
+
+    def flush_packing(self):
+        packing = self.packing
+        self.packing = []
+        for dock in set(dock for dock, _ in packing):
+            dock.pack([job for d, job in packing if d is dock])
+
+    def run(self, records):
+        """
+        Run the pipeline on the (molname, mol2 record) of the library.
+        Results are added to resdb as soon as each ligand is done.
+        """
+        for _ in self.sched.run(self.tasks(records)):
+            pass
+        self.flush_packing()
+        self.resdb.commit()
+        return self.resdb
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""archive.py
+
+This file is part of PAutoDock.
+Copyright (C) 2020 Giuseppe Marco Randazzo <gmrandazzo@gmail.com>
+PAutoDock is distributed under GPLv3 license.
+To know more in detail how the license work,
+please read the file "LICENSE" or
+go to "http://www.gnu.org/licenses/gpl-3.0.en.html"
+
+Provides append-only shard archives of the finished ligand directories.
+
+Once a ligand is parsed, its files (prepared ligand, poses, logs,
+parameter files) are compressed into the current shard and its
+directory is removed, so a screen of a million ligands leaves a few
+large files instead of millions of small ones.
+
+A shard is a sequence of gzip members, one per file, only ever appended
+to. An SQLite index gives the shard, offset and size of every member,
+so a single ligand is extracted with a seek and a read; zcat on a shard
+gives the concatenated files. Members are synced to disk before they
+are indexed: a crash leaves at most an unindexed tail, cut off by the
+next writer.
+"""
+
+import gzip
+import os
+import sqlite3
+from pathlib import Path
+
+SHARD_PREFIX = "shard-"
+SHARD_SUFFIX = ".gz"
+
+
+class ShardArchive(object):
+    """
+    Ligand files packed in path/shard-NNNNN.gz, indexed in path/index.sqlite.
+
+    A shard is closed once it is larger than shard_size bytes. Only one
+    process writes an archive (the pipeline parent); as the Ledger, the
+    index connection is opened lazily in each process, so readers may
+    run in the pool workers.
+    """
+
+    def __init__(self, path, shard_size=1 << 30):
+        self.path = Path(path).absolute()
+        self.db = str(self.path / "index.sqlite")
+        self.shard_size = int(shard_size)
+        self._conn = None
+        self._pid = None
+
+    def __getstate__(self):
+        return dict(self.__dict__, _conn=None, _pid=None)
+
+    @property
+    def conn(self):
+        if self._conn is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self.path.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.db, timeout=60, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS members ("
+                "molname TEXT NOT NULL, "
+                "name TEXT NOT NULL, "
+                "shard TEXT NOT NULL, "
+                "offset INTEGER, "
+                "size INTEGER, "
+                "PRIMARY KEY (molname, name))"
+            )
+        return self._conn
+
+    def current_shard(self) -> Path:
+        """
+        The shard to append to, without its unindexed tail.
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        shards = sorted(self.path.glob(f"{SHARD_PREFIX}*{SHARD_SUFFIX}"))
+        if not shards:
+            return self.path / f"{SHARD_PREFIX}00000{SHARD_SUFFIX}"
+        shard = shards[-1]
+        end = self.conn.execute(
+            "SELECT COALESCE(MAX(offset + size), 0) FROM members WHERE shard = ?",
+            (shard.name,),
+        ).fetchone()[0]
+        if shard.stat().st_size > end:
+            os.truncate(shard, end)
+        if end >= self.shard_size:
+            n = int(shard.name.split(".")[0].split("-")[-1]) + 1
+            return self.path / f"{SHARD_PREFIX}{n:05d}{SHARD_SUFFIX}"
+        return shard
+
+    def add(self, ligands) -> int:
+        """
+        Append the files of the (molname, directory) of ligands.
+        Return the number of files archived.
+        """
+        shard = self.current_shard()
+        rows = []
+        with open(shard, "ab") as f:
+            for molname, mpath in ligands:
+                with os.scandir(mpath) as it:
+                    entries = sorted(
+                        (e for e in it if e.is_file(follow_symlinks=False)),
+                        key=lambda e: e.name,
+                    )
+                for entry in entries:
+                    with open(entry.path, "rb") as fi:
+                        member = gzip.compress(fi.read(), compresslevel=6, mtime=0)
+                    rows.append(
+                        (molname, entry.name, shard.name, f.tell(), len(member))
+                    )
+                    f.write(member)
+            f.flush()
+            os.fsync(f.fileno())
+        self.conn.execute("BEGIN")
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO members VALUES (?, ?, ?, ?, ?)", rows
+        )
+        self.conn.execute("COMMIT")
+        return len(rows)
+
+    def has(self, molname) -> bool:
+        row = self.conn.execute(
+            "SELECT 1 FROM members WHERE molname = ? LIMIT 1", (molname,)
+        ).fetchone()
+        return row is not None
+
+    def names(self, molname) -> list:
+        """
+        Names of the archived files of a ligand.
+        """
+        return [
+            row[0]
+            for row in self.conn.execute(
+                "SELECT name FROM members WHERE molname = ? ORDER BY name", (molname,)
+            )
+        ]
+
+    def molnames(self) -> list:
+        return [
+            row[0]
+            for row in self.conn.execute(
+                "SELECT DISTINCT molname FROM members ORDER BY molname"
+            )
+        ]
+
+    def read(self, molname, name):
+        """
+        Return the content of an archived file, or None.
+        """
+        row = self.conn.execute(
+            "SELECT shard, offset, size FROM members WHERE molname = ? AND name = ?",
+            (molname, name),
+        ).fetchone()
+        if row is None:
+            return None
+        shard, offset, size = row
+        with open(self.path / shard, "rb") as f:
+            f.seek(offset)
+            return gzip.decompress(f.read(size))
+
+    def extract(self, molname, dst) -> list:
+        """
+        Write the archived files of a ligand in the directory dst.
+        Return their paths.
+        """
+        os.makedirs(dst, exist_ok=True)
+        paths = []
+        for name in self.names(molname):
+            path = f"{dst}/{name}"
+            with open(path, "wb") as f:
+                f.write(self.read(molname, name))
+            paths.append(path)
+        return paths
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -12,7 +12,9 @@ go to "http://www.gnu.org/licenses/gpl-3.0.en.html"
 Provides the basic operation for molecular files.
 
 """
+import hashlib
 import logging
+import os
 import platform
 import tarfile
 from pathlib import Path
@@ -23,18 +25,30 @@ import requests
 def get_bin_path(bin_name: str):
     """
     Get the path to the bin_name executable based on the operating system.
+
+    The directories listed in the PAUTODOCK_BIN_PATH environment variable
+    (separated by os.pathsep) are searched first.
     """
     paths = {"Linux": ["/usr/bin/", "/usr/local/bin"], "Darwin": ["/opt/homebrew/bin/"]}
     system = platform.system()
     if system not in paths:
         raise ValueError("Platform not supported")
 
-    for bin_path in paths.get(system):
+    env_paths = os.environ.get("PAUTODOCK_BIN_PATH", "").split(os.pathsep)
+    for bin_path in [p for p in env_paths if p] + paths.get(system):
         if bin_path and Path(f"{bin_path}/{bin_name}").exists():
             return bin_path
     raise ValueError(f"Unable to find {bin_name} installed.")
 
 
+def pautodock_home() -> str:
+    """
+    Directory of the PAutoDock data (MGLTools, caches): ~/.pautodock
+    unless the PAUTODOCK_HOME environment variable is set.
+    """
+    return os.environ.get("PAUTODOCK_HOME", f"{Path.home()}/.pautodock")
+
+
 def download_file(url, destination):
     """
     Download a file from a URL to a local destination.
@@ -64,3 +78,17 @@ def extract_tar_gz(file_path, extract_to):
         logging.error(f"Failed to extract file: {err}")
         return False
     return True
+
+
+def file_checksum(path, h=None):
+    """
+    Return the sha256 hex digest of a file content.
+
+    If a hashlib object h is given the file content is added to it.
+    """
+    if h is None:
+        h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
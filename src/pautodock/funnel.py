@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""funnel.py
+
+This file is part of PAutoDock.
+Copyright (C) 2020 Giuseppe Marco Randazzo <gmrandazzo@gmail.com>
+PAutoDock is distributed under GPLv3 license.
+To know more in detail how the license work,
+please read the file "LICENSE" or
+go to "http://www.gnu.org/licenses/gpl-3.0.en.html"
+
+Provides a two-stage funnel screening.
+
+Stage one docks the whole library with vina at a low exhaustiveness and
+a few modes. The top ligands by vina energy (top-K or top-percent) are
+rescored in stage two with the screen settings: vina at the requested
+exhaustiveness and/or AutoDock at the slow setting.
+
+Stage-two jobs run on the same scheduler as stage one. A ligand is
+promoted as soon as its stage-one energy is below the selection
+threshold estimated from the ranking so far; the ligands of the exact
+final selection that were not promoted early are rescored once stage
+one is over.
+"""
+
+import copy
+import heapq
+import math
+import os
+import shutil
+from pathlib import Path
+
+from pautodock import ledger, results, scheduler, trace
+from pautodock.adparallel import LigandJob, ScreeningPipeline
+
+# methods of the stage-one tasks
+SCREEN_METHODS = [
+    "prepare_ligand",
+    "prepare_batch",
+    "dock_vina",
+    "dock_vina_batch",
+    "parse_ligand",
+]
+
+
+class FunnelSelector(object):
+    """
+    Streaming choice of the ligands promoted to stage two.
+
+    Either top (number of ligands) or fraction (of the library) is
+    given; top needs the library size to promote ligands before the end
+    of stage one. The threshold is the energy of the selection quantile
+    among the energies seen so far; it is computed once warmup energies
+    are known and refreshed every time their number grows by 10 %.
+    The final selection is always the exact top (or fraction) of the
+    library. With top, early promotions only start the rescoring sooner
+    and stop after slack * top ligands, so at most (1 + slack) * top
+    ligands are rescored.
+    """
+
+    def __init__(self, top=None, fraction=None, total=None, warmup=200, slack=1.2):
+        if (top is None) == (fraction is None):
+            raise ValueError("Give either the top number or the fraction of ligands")
+        if fraction is not None and not 0.0 < fraction <= 1.0:
+            raise ValueError("The fraction of ligands must be in (0, 1]")
+        self.top = top
+        self.fraction = fraction
+        if fraction is None and total:
+            self.fraction = min(1.0, top / float(total))
+        self.limit = None if top is None else math.ceil(slack * top)
+        self.warmup = warmup
+        self.energies = {}
+        self.promoted = set()
+        self.threshold = None
+        self.next_refresh = warmup
+
+    def target(self, n):
+        """
+        Number of ligands selected among n.
+        """
+        if self.top is not None:
+            return min(self.top, n)
+        return min(n, max(1, math.ceil(self.fraction * n)))
+
+    def refresh(self):
+        n = len(self.energies)
+        self.next_refresh = max(n + 1, int(n * 1.1))
+        if self.fraction is None:
+            return
+        k = max(1, math.ceil(self.fraction * n))
+        self.threshold = heapq.nsmallest(k, self.energies.values())[-1]
+
+    def add(self, molname, energy) -> bool:
+        """
+        Add the stage-one energy of a ligand. Return True if the ligand
+        is promoted now.
+        """
+        self.energies[molname] = energy
+        if len(self.energies) >= self.next_refresh:
+            self.refresh()
+        if self.limit is not None and len(self.promoted) >= self.limit:
+            return False
+        if self.threshold is not None and energy <= self.threshold:
+            self.promoted.add(molname)
+            return True
+        return False
+
+    def finish(self) -> list:
+        """
+        Return the ligands of the final selection not promoted yet.
+        """
+        best = heapq.nsmallest(
+            self.target(len(self.energies)), self.energies, key=self.energies.get
+        )
+        late = [molname for molname in best if molname not in self.promoted]
+        self.promoted.update(late)
+        return late
+
+
+class FunnelWorker(object):
+    """
+    Pool worker of a funnel: stage-one tasks run on the screen
+    ADParallel, stage-two tasks on the rescore ADParallel.
+    """
+
+    def __init__(self, screen, rescore):
+        self.screen = screen
+        self.rescore = rescore
+
+    def prepare_ligand(self, molname, record):
+        return self.screen.prepare_ligand(molname, record)
+
+    def prepare_batch(self, chunk):
+        return self.screen.prepare_batch(chunk)
+
+    def dock_vina(self, job, ncpu=1):
+        return self.screen.dock_vina(job, ncpu)
+
+    def dock_vina_batch(self, jobs, ncpu=1):
+        return self.screen.dock_vina_batch(jobs, ncpu)
+
+    def parse_ligand(self, job):
+        return self.screen.parse_ligand(job)
+
+    def build_grid(self, lat_lst):
+        return self.rescore.build_grid(lat_lst)
+
+    def rescore_vina(self, job, ncpu=1):
+        return self.rescore.dock_vina(job, ncpu)
+
+    def rescore_autodock(self, job):
+        return self.rescore.dock_autodock(job)
+
+    def parse_rescored(self, job):
+        return self.rescore.parse_ligand(job)
+
+
+class FunnelPipeline(ScreeningPipeline):
+    """
+    Stage one is the vina-only ScreeningPipeline of the screen
+    ADParallel; the promoted ligands are rescored by the rescore
+    ADParallel in its own working directory, ledger and results.
+    """
+
+    def __init__(self, screen, rescore, resdb, rescore_db, selector, cores=None):
+        super().__init__(screen, resdb, cores)
+        self.rescore = rescore
+        self.rescore_db = rescore_db
+        self.selector = selector
+        self.sched = scheduler.Scheduler(
+            FunnelWorker(screen, rescore), cores or screen.cores, idle=self.idle
+        )
+        self.rescore_jobs = {}
+        self.rescore_branches = {}
+        self.nrescored = 0
+        self.finished = False
+        if rescore.atd:
+            self.grid_ready.update(rescore.gridmaps.available_types())
+
+    def screening(self) -> bool:
+        """
+        True while stage-one tasks are running or still to come.
+        """
+        return (
+            not self.sched.exhausted
+            or bool(self.vina_batch)
+            or any(self.sched.active[m] > 0 for m in SCREEN_METHODS)
+        )
+
+    def idle(self):
+        self.flush_vina_batch()
+        if not self.finished and not self.screening():
+            self.finished = True
+            for molname in self.selector.finish():
+                self.promote(molname)
+
+    def select(self, molname, energy, mol_pdbqt=None):
+        # 9999 marks a failed vina run
+        if energy < 9999.0 and self.selector.add(molname, energy):
+            self.promote(molname, mol_pdbqt)
+
+    def already_parsed(self, molname):
+        for row in self.resdb.query(where="molname = ?", params=(molname,)):
+            self.select(molname, row["vina_min"])
+
+    def parsed(self, result):
+        header, row = result
+        job = self.jobs.get(row[0])
+        # promoted before the ligand directory is packed
+        self.select(row[0], row[-3], job and job.mol_pdbqt)
+        super().parsed(result)
+
+    def promote(self, molname, mol_pdbqt=None):
+        """
+        Submit the stage-two jobs of a ligand.
+
+        The prepared ligand is copied to the rescore directory of the
+        ligand, so the stage-one directory is never written again; the
+        ligands already packed are read from the stage-one archive.
+        """
+        if self.rescore_db.has(molname):
+            return
+        mpath = self.rescore.ligand_path(molname)
+        rescore_pdbqt = f"{mpath}/{molname}.pdbqt"
+        if not os.path.exists(rescore_pdbqt):
+            if mol_pdbqt is None:
+                mol_pdbqt = self.dock.stage_done(molname, ledger.PREPARED)
+            if mol_pdbqt:
+                os.makedirs(mpath, exist_ok=True)
+                shutil.copyfile(mol_pdbqt, rescore_pdbqt)
+            elif not self.unpack_prepared(molname, rescore_pdbqt):
+                return
+        job = LigandJob(molname, mpath, rescore_pdbqt)
+        if self.rescore.atd:
+            _, job.lat_lst = self.rescore.read_atom_types(rescore_pdbqt)
+        self.rescore_jobs[molname] = job
+        self.rescore_branches[molname] = int(self.rescore.atd) + int(self.rescore.vina)
+        if self.rescore.vina:
+            self.sched.submit(
+                scheduler.Task(
+                    "rescore_vina",
+                    (job,),
+                    self.rescored,
+                    otherwise=self.rescored,
+                    elastic=self.rescore.engine is None,
+                )
+            )
+        if self.rescore.atd:
+            self.autodock(job)
+
+    def unpack_prepared(self, molname, dst) -> bool:
+        """
+        Write the prepared ligand archived by stage one to dst.
+        """
+        if self.dock.archive is None:
+            return False
+        data = self.dock.archive.read(molname, f"{molname}.pdbqt")
+        if data is None:
+            return False
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        with open(dst, "wb") as f:
+            f.write(data)
+        return True
+
+    def submit_autodock(self, job):
+        self.sched.submit(
+            scheduler.Task(
+                "rescore_autodock", (job,), self.rescored, otherwise=self.rescored
+            )
+        )
+
+    def autodock_failed(self, job):
+        self.rescored(job)
+
+    def rescored(self, job):
+        merged = self.rescore_jobs[job.molname]
+        merged.merge(job)
+        self.rescore_branches[job.molname] -= 1
+        if self.rescore_branches[job.molname] == 0:
+            self.sched.submit(
+                scheduler.Task("parse_rescored", (merged,), self.rescore_parsed)
+            )
+
+    def rescore_parsed(self, result):
+        header, row = result
+        self.rescore_db.add(header, row)
+        self.nrescored += 1
+        job = self.rescore_jobs.pop(row[0], None)
+        if job is not None:
+            if job.metrics:
+                self.rescore_db.add_metrics(row[0], job.metrics)
+            self.rescore_db.add_poses(row[0], job.vina_poses, job.dlg_result)
+        self.rescore.mark_stage(row[0], ledger.PARSED)
+        if job is not None:
+            self.pack(self.rescore, job)
+
+    def run(self, records):
+        super().run(records)
+        self.rescore_db.commit()
+        return self.rescore_db
+
+
+def funnel_screening(
+    dock, otab, top=None, fraction=None, exhaustiveness=4, num_modes=3
+):
+    """
+    Screen the library of dock with a two-stage funnel.
+
+    Stage one docks every ligand with vina at exhaustiveness and
+    num_modes; its results are stored in wpath/results.sqlite. The top
+    ligands (top number or fraction of the library) are rescored with
+    the vina and AutoDock settings of dock, AutoDock at the slow
+    setting, in wpath/rescore. The rescored results are written to otab.
+    """
+    if dock.trace is not None:
+        trace.enable()
+    dock.prepare_screen()
+    screen = copy.copy(dock)
+    screen.atd = False
+    screen.vina = True
+    screen.exhaustiveness = exhaustiveness
+    screen.num_modes = num_modes
+    screen.engine = screen.make_engine()
+    screen.write_screen_params()
+    rescore = copy.copy(dock)
+    rescore.wpath = str(Path(f"{dock.wpath}/rescore").absolute())
+    rescore.speed = "slow"
+    os.makedirs(rescore.wpath, exist_ok=True)
+    rescore.ledger = ledger.Ledger(f"{rescore.wpath}/ledger.sqlite")
+    rescore.write_screen_params()
+    total = dock.library_size() if top is not None else None
+    selector = FunnelSelector(top, fraction, total)
+    resdb = results.ResultsDB(f"{dock.wpath}/results.sqlite")
+    if results.is_results_db(otab):
+        rescore_db = results.ResultsDB(otab)
+    else:
+        rescore_db = results.ResultsDB(f"{rescore.wpath}/results.sqlite")
+    resdb.clear_library()
+    rescore_db.clear_library()
+    pipeline = FunnelPipeline(screen, rescore, resdb, rescore_db, selector)
+    pipeline.run(dock.library_records([resdb, rescore_db]))
+    if dock.trace is not None:
+        events = trace.drain()
+        trace.write_chrome(dock.trace, events)
+        print(trace.summary(events, pipeline.sched.cores, pipeline.nparsed))
+        trace.enable(False)
+    print(
+        f"{len(selector.energies)} ligands screened, "
+        f"{len(selector.promoted)} promoted, {pipeline.nrescored} rescored"
+    )
+    resdb.close()
+    if not results.is_results_db(otab):
+        rescore_db.export(otab)
+    rescore_db.close()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""gridcache.py
+
+This file is part of PAutoDock.
+Copyright (C) 2020 Giuseppe Marco Randazzo <gmrandazzo@gmail.com>
+PAutoDock is distributed under GPLv3 license.
+To know more in detail how the license work,
+please read the file "LICENSE" or
+go to "http://www.gnu.org/licenses/gpl-3.0.en.html"
+
+Provides a content-addressed cache of AutoGrid maps.
+
+AutoGrid maps depend only on the receptor, the box and the atom types,
+never on the ligand. The cache computes them once per receptor/box and
+adds the per-type maps for new ligand atom types when they show up.
+"""
+
+import fcntl
+import hashlib
+import os
+from contextlib import contextmanager
+from pathlib import Path
+
+from pautodock.fileutils import file_checksum
+
+GRID_SPACING = 0.33
+GRID_SMOOTH = 0.5
+GRID_DIELECTRIC = -0.1465
+MAPS_PREFIX = "receptor_model"
+
+
+def write_gpf(gpf, rec_pdbqt, rec_types, lig_types, cc, npts, maps_path, **names):
+    """
+    Write an AutoGrid parameter file.
+
+    By default map and field files are named after MAPS_PREFIX inside
+    maps_path. The fld, elecmap and dsolvmap keyword arguments override
+    the names of the field, electrostatic and desolvation files.
+    """
+    maps_path = Path(maps_path).absolute()
+    fld = names.get("fld", f"{maps_path}/{MAPS_PREFIX}.maps.fld")
+    elecmap = names.get("elecmap", f"{maps_path}/{MAPS_PREFIX}.e.map")
+    dsolvmap = names.get("dsolvmap", f"{maps_path}/{MAPS_PREFIX}.d.map")
+    with open(gpf, "w", encoding="utf8") as f:
+        f.write("npts %d %d %d # num.grid points in xyz\n" % tuple(npts))
+        f.write("gridfld %s     # grid_data_file\n" % (fld))
+        f.write("spacing %s # spacing(A)\n" % (GRID_SPACING))
+        f.write("receptor_types %s # receptor atom types\n" % (" ".join(rec_types)))
+        f.write("ligand_types %s # ligand atom types\n" % (" ".join(lig_types)))
+        f.write("receptor %s    # macromolecule\n" % (rec_pdbqt))
+        f.write(
+            "gridcenter %.3f %.3f %.3f       # xyz-coordinates or auto\n"
+            % (cc[0], cc[1], cc[2])
+        )
+        f.write("smooth %s  # store minimum energy w/in rad(A)\n" % (GRID_SMOOTH))
+        for at in lig_types:
+            f.write(
+                "map %s/%s.%s.map # atom-specific aff. map\n"
+                % (maps_path, MAPS_PREFIX, at)
+            )
+        f.write("elecmap %s # El. Pot potential map\n" % (elecmap))
+        f.write("dsolvmap %s # desolv. potential map\n" % (dsolvmap))
+        f.write(
+            "dielectric %s # <0, AD4 dist-dep.diel;>0, constant\n" % (GRID_DIELECTRIC)
+        )
+    return Path(gpf).absolute()
+
+
+class GridMapCache(object):
+    """
+    AutoGrid maps shared by every ligand docked on the same receptor/box.
+
+    Maps live in cache_dir/<key> where key hashes the receptor PDBQT
+    content and the grid parameters. The list of ligand atom types with a
+    complete map is kept in a manifest that is only rewritten after
+    AutoGrid succeeded, so an interrupted run never exposes partial maps.
+    """
+
+    def __init__(self, cache_dir, rec_pdbqt, rec_types, cc, npts):
+        self.rec_pdbqt = str(Path(rec_pdbqt).absolute())
+        self.rec_types = list(rec_types)
+        self.cc = [float(c) for c in cc]
+        self.npts = [int(n) for n in npts]
+        self.key = self.make_key()
+        self.path = Path(cache_dir).absolute() / self.key
+        self.fld = self.path / f"{MAPS_PREFIX}.maps.fld"
+        self.manifest = self.path / "types.txt"
+
+    def make_key(self):
+        h = hashlib.sha256()
+        file_checksum(self.rec_pdbqt, h)
+        params = "npts=%d,%d,%d;center=%.3f,%.3f,%.3f;" % (*self.npts, *self.cc)
+        params += f"spacing={GRID_SPACING};smooth={GRID_SMOOTH};"
+        params += f"dielectric={GRID_DIELECTRIC}"
+        h.update(params.encode("utf8"))
+        return h.hexdigest()
+
+    def map_path(self, at):
+        return self.path / f"{MAPS_PREFIX}.{at}.map"
+
+    def available_types(self):
+        """
+        Ligand atom types with a complete map in the cache.
+        """
+        if not self.manifest.exists():
+            return []
+        return self.manifest.read_text(encoding="utf8").split()
+
+    def missing_types(self, lig_types):
+        available = set(self.available_types())
+        return [at for at in dict.fromkeys(lig_types) if at not in available]
+
+    @contextmanager
+    def lock(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self.path / ".lock", "w") as fl:
+            fcntl.flock(fl, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fl, fcntl.LOCK_UN)
+
+    def ensure(self, lig_types, run_autogrid):
+        """
+        Make sure the maps for lig_types exist and return the cache path.
+
+        run_autogrid receives the AutoGrid argument list and must return
+        0 on success. Only the missing atom types are computed. The
+        electrostatic and desolvation maps are written once; later
+        incremental runs write them to scratch files that are removed,
+        so that readers of the published maps are never disturbed.
+        """
+        with self.lock():
+            available = self.available_types()
+            missing = self.missing_types(lig_types)
+            if not missing:
+                return self.path
+            names = {}
+            scratch = []
+            if available:
+                n = len(list(self.path.glob("grid_*.gpf")))
+                names = {
+                    "fld": f"{self.path}/scratch_{n}.maps.fld",
+                    "elecmap": f"{self.path}/scratch_{n}.e.map",
+                    "dsolvmap": f"{self.path}/scratch_{n}.d.map",
+                }
+                scratch = [Path(p) for p in names.values()]
+                scratch.append(Path(f"{self.path}/scratch_{n}.maps.xyz"))
+            else:
+                n = 0
+            gpf = write_gpf(
+                self.path / f"grid_{n}.gpf",
+                self.rec_pdbqt,
+                self.rec_types,
+                missing,
+                self.cc,
+                self.npts,
+                self.path,
+                **names,
+            )
+            glg = str(gpf).replace(".gpf", ".glg")
+            ret = run_autogrid(["-p", str(gpf), "-l", glg])
+            for p in scratch:
+                if p.exists():
+                    p.unlink()
+            if ret != 0 or not all(self.map_path(at).exists() for at in missing):
+                raise RuntimeError(
+                    f"AutoGrid failed for atom types {' '.join(missing)}; see {glg}"
+                )
+            tmp = self.manifest.with_suffix(".tmp")
+            tmp.write_text(" ".join(available + missing) + "\n", encoding="utf8")
+            os.replace(tmp, self.manifest)
+        return self.path
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""ledger.py
+
+This file is part of PAutoDock.
+Copyright (C) 2020 Giuseppe Marco Randazzo <gmrandazzo@gmail.com>
+PAutoDock is distributed under GPLv3 license.
+To know more in detail how the license work,
+please read the file "LICENSE" or
+go to "http://www.gnu.org/licenses/gpl-3.0.en.html"
+
+Provides a durable SQLite ledger of the screening jobs.
+
+Every ligand stage (prepared, gridded, docked, parsed) is recorded once
+its output is complete, together with the output checksum. A restarted
+screen skips exactly the stages recorded as done and whose output is
+unchanged, and retries everything else.
+"""
+
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+from pautodock.fileutils import file_checksum
+
+PREPARED = "prepared"
+GRIDDED = "gridded"
+DOCKED_AUTODOCK = "docked:autodock"
+DOCKED_VINA = "docked:vina"
+PARSED = "parsed"
+
+
+class Ledger(object):
+    """
+    Per ligand and per stage job states stored in an SQLite database.
+
+    The connection is opened lazily in each process (and reopened after a
+    fork), so a Ledger can be shipped to the pool workers. Each transition is a single atomic
+    transaction and the database runs in WAL mode, so workers and the
+    parent can record stages concurrently.
+    """
+
+    def __init__(self, path):
+        self.path = str(Path(path).absolute())
+        self._conn = None
+        self._pid = None
+
+    def __getstate__(self):
+        return {"path": self.path, "_conn": None, "_pid": None}
+
+    @property
+    def conn(self):
+        if self._conn is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS stages ("
+                "molname TEXT NOT NULL, "
+                "stage TEXT NOT NULL, "
+                "output TEXT, "
+                "checksum TEXT, "
+                "updated REAL, "
+                "PRIMARY KEY (molname, stage))"
+            )
+        return self._conn
+
+    def mark(self, molname, stage, output=None):
+        """
+        Record a stage as done. output is the file the stage produced.
+        """
+        checksum = None
+        if output is not None:
+            output = str(output)
+            checksum = file_checksum(output)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO stages VALUES (?, ?, ?, ?, ?)",
+            (molname, stage, output, checksum, time.time()),
+        )
+
+    def unmark(self, molname, stage):
+        self.conn.execute(
+            "DELETE FROM stages WHERE molname = ? AND stage = ?", (molname, stage)
+        )
+
+    def done(self, molname, stage):
+        """
+        Return the output of a stage recorded as done, True if the stage
+        has no output, or None if the stage must be run.
+
+        A stage whose output was removed or changed is not done.
+        """
+        row = self.conn.execute(
+            "SELECT output, checksum FROM stages WHERE molname = ? AND stage = ?",
+            (molname, stage),
+        ).fetchone()
+        if row is None:
+            return None
+        output, checksum = row
+        if output is None:
+            return True
+        if not Path(output).is_file() or file_checksum(output) != checksum:
+            return None
+        return output
+
+    def completed(self, stage=PARSED):
+        """
+        Names of the ligands with the given stage recorded.
+        """
+        rows = self.conn.execute(
+            "SELECT molname FROM stages WHERE stage = ?", (stage,)
+        ).fetchall()
+        return set(row[0] for row in rows)
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""ligandstore.py
+
+This file is part of PAutoDock.
+Copyright (C) 2020 Giuseppe Marco Randazzo <gmrandazzo@gmail.com>
+PAutoDock is distributed under GPLv3 license.
+To know more in detail how the license work,
+please read the file "LICENSE" or
+go to "http://www.gnu.org/licenses/gpl-3.0.en.html"
+
+Provides a content-addressed store of prepared ligands.
+
+The PDBQT written by obabel depends only on the mol2 record and on the
+preparation settings, never on the receptor. The store keeps it, before
+the translation to the box centre, under the hash of the record and the
+settings, so a library is prepared once and every later screen against
+any receptor copies the prepared ligands from the store.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from pautodock import molop
+
+# obabel preparation of molop.Molecule.topdbqt and molop.batch_topdbqt
+PREP_SETTINGS = "obabel -p gastaiger -imol2 -opdbqt"
+
+
+class LigandStore(object):
+    """
+    Prepared ligands stored in root/<key[:2]>/<key>.pdbqt.
+
+    Files are published with an atomic rename, so concurrent screens
+    may prepare and read the same ligands.
+    """
+
+    def __init__(self, root, mglpath):
+        self.root = Path(root).absolute()
+        self.mglpath = str(mglpath)
+
+    def key(self, record: bytes) -> str:
+        h = hashlib.sha256(PREP_SETTINGS.encode("utf8"))
+        h.update(b"\0")
+        h.update(record)
+        return h.hexdigest()
+
+    def path(self, key) -> Path:
+        return self.root / key[:2] / f"{key}.pdbqt"
+
+    def has(self, record) -> bool:
+        return self.path(self.key(record)).is_file()
+
+    def add(self, key, pdbqt):
+        """
+        Publish a prepared PDBQT under key.
+        """
+        dst = self.path(key)
+        if dst.exists():
+            return
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dst.with_suffix(f".{os.getpid()}.tmp")
+        shutil.copyfile(pdbqt, tmp)
+        os.replace(tmp, dst)
+
+    def fetch(self, record, dst) -> bool:
+        """
+        Copy the prepared ligand of a mol2 record to dst.
+        Return False if it is not in the store.
+        """
+        try:
+            shutil.copyfile(self.path(self.key(record)), dst)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def prepare_batch(self, chunk) -> int:
+        """
+        Prepare the (molname, mol2 record) of chunk missing from the store
+        with a single obabel run. Return the number of ligands prepared.
+        """
+        todo = {}
+        for _, record in chunk:
+            key = self.key(record)
+            if not self.path(key).exists():
+                todo[key] = record
+        if not todo:
+            return 0
+        tmppath = tempfile.mkdtemp(prefix="pautodock_prep_")
+        try:
+            mol2lst = []
+            for i, record in enumerate(todo.values()):
+                mol2lst.append(f"{tmppath}/{i}.mol2")
+                with open(mol2lst[-1], "wb") as f:
+                    f.write(record)
+            pdbqtlst = molop.batch_topdbqt(mol2lst, self.mglpath)
+            nprepared = 0
+            for key, pdbqt in zip(todo, pdbqtlst):
+                if pdbqt and os.path.isfile(pdbqt) and os.path.getsize(pdbqt) > 0:
+                    self.add(key, pdbqt)
+                    nprepared += 1
+        finally:
+            shutil.rmtree(tmppath, ignore_errors=True)
+        return nprepared
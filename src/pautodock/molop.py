@@ -14,9 +14,15 @@ Provides the basic operation for molecular files.
 """
 
 import logging
+import shutil
 import subprocess
+import tempfile
+from dataclasses import dataclass
 from pathlib import Path
 
+import numpy as np
+
+from pautodock import trace
 from pautodock.fileutils import get_bin_path
 
 
@@ -41,41 +47,138 @@ def extract_coordinates(line, ftype):
         return None
 
 
+class AtomBlock(object):
+    """
+    The atom records of a pdb/pdbqt file loaded as NumPy arrays.
+
+    The file is read in one pass; coordinates, charges and atom types of
+    the ATOM/HETATM records are arrays, so translations and centroids are
+    array operations and the records are written back in bulk with the
+    coordinates in the fixed-width columns 31-54.
+    """
+
+    def __init__(self, lines, atom_idx, coords, types, charges):
+        self.lines = lines
+        self.atom_idx = atom_idx
+        self.coords = coords
+        self.types = types
+        self.charges = charges
+
+    @classmethod
+    def read(cls, path: str):
+        with open(path, "r", encoding="utf-8") as f:
+            lines = f.read().splitlines(keepends=True)
+        atom_idx = [
+            i
+            for i, line in enumerate(lines)
+            if line.lstrip().startswith(("ATOM", "HETATM"))
+        ]
+        atoms = [lines[i].lstrip() for i in atom_idx]
+        coords = np.array(
+            [(a[30:38], a[38:46], a[46:54]) for a in atoms], dtype=np.float64
+        ).reshape(-1, 3)
+        types = np.array([(a.split() or [""])[-1] for a in atoms], dtype=str)
+        charges = np.array([_to_float(a[70:76]) for a in atoms], dtype=np.float64)
+        return cls(lines, np.array(atom_idx, dtype=np.int64), coords, types, charges)
+
+    def __len__(self):
+        return len(self.atom_idx)
+
+    def centroid(self) -> list:
+        if len(self) == 0:
+            raise ValueError("no atoms found")
+        return self.coords.mean(axis=0).tolist()
+
+    def translate(self, vec):
+        self.coords += np.asarray(vec, dtype=np.float64)
+
+    def recenter(self, centre):
+        """
+        Translate the atoms so that their centroid is centre.
+        """
+        self.translate(np.asarray(centre, dtype=np.float64) - self.coords.mean(axis=0))
+
+    def write(self, path: str):
+        n = len(self)
+        xyz = (("%8.3f%8.3f%8.3f\n" * n) % tuple(self.coords.ravel())).splitlines()
+        lines = list(self.lines)
+        for i, cc in zip(self.atom_idx.tolist(), xyz):
+            line = lines[i].lstrip()
+            lines[i] = line[:30] + cc + line[54:]
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("".join(lines))
+
+
+def _to_float(s: str) -> float:
+    try:
+        return float(s)
+    except ValueError:
+        return 0.0
+
+
 def get_mol_baricentre(mol: str) -> tuple:
     """
     Get molecular baricentre from a molecule
     """
-    cc = [0.0, 0.0, 0.0]
-    n = 0
-    if mol.endswith(".pdbqt"):
-        ftype = "pdbqt"
-    elif mol.endswith(".pdb"):
-        ftype = "pdb"
-    else:
+    if not mol.endswith((".pdbqt", ".pdb")):
         raise ValueError(
             "Molecual format not supported {mol}. Supported formats: pdb or pdbqt"
         )
+    return AtomBlock.read(mol).centroid()
 
-    with open(mol, "r", encoding="utf-8") as f:
-        for line in f:
-            if ("ATOM" in line or "HETATM" in line) and "REMARK" not in line:
-                try:
-                    ex_cc = extract_coordinates(line.strip(), ftype)
-                    if ex_cc:
-                        for i, val in enumerate(ex_cc):
-                            cc[i] += val
-                    n += 1
-                except IndexError as err:
-                    logging.error("%s get_mol_baricentre problem with %s", err, line)
-    return [cc[i] / float(n) for i in range(len(cc))]
+
+@dataclass(frozen=True)
+class MolModel:
+    """
+    Immutable parsed molecule: atom types, coordinates and bounding box.
+
+    Built once per screen for the receptor and the template ligand and
+    shared read-only with the pool workers, so the per-ligand setup never
+    re-reads them. The coordinates array is not writeable.
+    """
+
+    path: str
+    atom_types: tuple
+    coords: np.ndarray
+
+    @classmethod
+    def from_file(cls, path: str):
+        """
+        Parse the ATOM/HETATM records of a pdb or pdbqt file.
+
+        The atom type is the last field of the record: the AutoDock type
+        in pdbqt files and the element in pdb files.
+        """
+        block = AtomBlock.read(path)
+        coords = block.coords
+        coords.flags.writeable = False
+        return cls(str(path), tuple(block.types.tolist()), coords)
+
+    @property
+    def unique_types(self) -> list:
+        return [at for at in dict.fromkeys(self.atom_types) if at]
+
+    @property
+    def centroid(self) -> list:
+        return self.coords.mean(axis=0).tolist()
+
+    @property
+    def bbox(self) -> tuple:
+        return self.coords.min(axis=0), self.coords.max(axis=0)
 
 
 class Receptor(object):
-    def __init__(self, receptor, mglpath):
+    def __init__(self, receptor, mglpath, flags=()):
         self.receptor = receptor
         self.mglpath = str(Path(mglpath).resolve())
+        # extra prepare_receptor4.py options
+        self.flags = list(flags)
 
-    def topdbqt(self):
+    def topdbqt(self, pdbqt=None):
+        """
+        Convert the receptor with MGLTools prepare_receptor4.py to pdbqt,
+        by default written next to the receptor.
+        """
         python_env = (
             "export LD_LIBRARY_PATH=\"%s/lib\"${LD_LIBRARY_PATH:+':'$LD_LIBRARY_PATH};"
             % (self.mglpath)
@@ -84,9 +187,13 @@ class Receptor(object):
         prep_rec = self.mglpath
         prep_rec += "/MGLToolsPckgs/AutoDockTools/Utilities24/"
         prep_rec += "prepare_receptor4.py"
-        pdbqt = self.receptor.replace(".pdb", ".pdbqt")
+        if pdbqt is None:
+            pdbqt = self.receptor.replace(".pdb", ".pdbqt")
         cmd = "%s %s -r '%s' -o '%s'" % (python_env, prep_rec, self.receptor, pdbqt)
-        subprocess.call([cmd], shell=True)
+        for flag in self.flags:
+            cmd += " '%s'" % (flag)
+        with trace.span("receptor_prep"):
+            subprocess.call([cmd], shell=True)
         return str(Path(pdbqt).resolve())
 
 
@@ -111,35 +218,80 @@ class Molecule(object):
             self.molecule,
             molname,
         )
-        subprocess.call([cmd], shell=True)
+        with trace.span("obabel"):
+            subprocess.call([cmd], shell=True)
         # Translate to the new center
         fpdbqt = str(Path(molname).resolve())
         if len(tran0) > 0:
-            mem = []
-            fi = open(fpdbqt, "r")
-            for line in fi:
-                if "ATOM" in line:
-                    ex_cc = extract_coordinates(line.strip(), "pdbqt")
-                    if ex_cc:
-                        copy_line = line
-                        x = float(ex_cc[0]) + tran0[0]
-                        copy_line.replace(str(ex_cc[0]), str(x))
-                        y = float(ex_cc[1]) + tran0[0]
-                        copy_line.replace(str(ex_cc[1]), str(y))
-                        z = float(ex_cc[2]) + tran0[0]
-                        copy_line.replace(str(ex_cc[2]), str(z))
-                        mem.append(copy_line)
-                    else:
-                        msg = "Molecule.topdbqt Error!\n"
-                        msg += " X Y Z coordinates not found in "
-                        msg += f"line {line.strip()}"
-                        raise ValueError(msg)
-                else:
-                    mem.append(line)
-            fi.close()
-
-            fo = open(fpdbqt, "w")
-            for line in mem:
-                fo.write(line)
-            fo.close()
+            with trace.span("translate"):
+                translate_pdbqt(fpdbqt, tran0)
         return fpdbqt
+
+
+def translate_pdbqt(fpdbqt, tran0):
+    """
+    Translate the atoms of a pdbqt so that their centroid is tran0.
+    """
+    block = AtomBlock.read(fpdbqt)
+    if len(block) == 0:
+        msg = "Molecule.topdbqt Error!\n"
+        msg += f" X Y Z coordinates not found in {fpdbqt}"
+        raise ValueError(msg)
+    block.recenter(tran0[:3])
+    block.write(fpdbqt)
+
+
+def batch_topdbqt(mol2lst, mglpath, tran0=[]):
+    """
+    Convert a chunk of mol2 files to pdbqt with a single obabel run.
+
+    The molecules are concatenated, converted and split back by obabel
+    so that the process start and the charge model setup are paid once
+    per chunk. Every pdbqt is written next to its mol2 as done by
+    Molecule.topdbqt. If obabel does not return one pdbqt per input
+    molecule the chunk is converted again one molecule at a time. The
+    pdbqt of a molecule that cannot be converted is None.
+    """
+    obabel = f"{get_bin_path('obabel')}/obabel"
+    tmppath = tempfile.mkdtemp()
+    chunk = f"{tmppath}/chunk.mol2"
+    with open(chunk, "w") as fo:
+        for mol2 in mol2lst:
+            with open(mol2, "r") as fi:
+                shutil.copyfileobj(fi, fo)
+    cmd = "%s -p gastaiger -imol2 '%s' -opdbqt -O '%s/lig.pdbqt' -m" % (
+        obabel,
+        chunk,
+        tmppath,
+    )
+    with trace.span("obabel_batch", molecules=len(mol2lst)):
+        subprocess.call([cmd], shell=True)
+    splitted = [Path(f"{tmppath}/lig{i + 1}.pdbqt") for i in range(len(mol2lst))]
+    extra = Path(f"{tmppath}/lig{len(mol2lst) + 1}.pdbqt")
+    pdbqtlst = []
+    if all(p.exists() for p in splitted) and not extra.exists():
+        for mol2, tmp_pdbqt in zip(mol2lst, splitted):
+            fpdbqt = str(Path(str(mol2).replace(".mol2", ".pdbqt")).resolve())
+            shutil.move(str(tmp_pdbqt), fpdbqt)
+            if len(tran0) > 0:
+                try:
+                    with trace.span("translate"):
+                        translate_pdbqt(fpdbqt, tran0)
+                except ValueError as err:
+                    logging.error("Unable to convert %s: %s", mol2, err)
+                    fpdbqt = None
+            pdbqtlst.append(fpdbqt)
+    else:
+        logging.warning(
+            "obabel batch conversion of %d molecules failed, "
+            "converting one molecule at a time",
+            len(mol2lst),
+        )
+        for mol2 in mol2lst:
+            try:
+                pdbqtlst.append(Molecule(str(mol2), mglpath).topdbqt(tran0))
+            except (OSError, ValueError) as err:
+                logging.error("Unable to convert %s: %s", mol2, err)
+                pdbqtlst.append(None)
+    shutil.rmtree(tmppath)
+    return pdbqtlst
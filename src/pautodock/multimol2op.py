@@ -13,9 +13,14 @@ Provides the basic operation for MOL2 files in parallel
 
 """
 
+import mmap
 import os
-import shutil
+import random
+import struct
 from pathlib import Path
+from typing import Optional
+
+from pautodock import trace
 
 
 def read_molname(filemol2: str):
@@ -33,49 +38,226 @@ def read_molname(filemol2: str):
     return molname
 
 
-def get_mol2_name(filemol2: str):
-    molname = read_molname("tmp_")
-    filename = molname + ".mol2"
-    cc = 1
-    while True:
-        if os.path.isfile(filename) is False:
-            break
-        else:
-            filename = molname + "_" + str(cc) + ".mol2"
-            cc = cc + 1
-    return filename
+def unique_name(molname, seen):
+    """
+    Return molname, or molname_<n> if already seen, and record it.
+
+    seen maps every name handed out to the next counter to try,
+    so resolving many duplicates of the same name stays linear.
+    """
+    if not molname:
+        molname = "unnamed"
+    if molname not in seen:
+        seen[molname] = 1
+        return molname
+    cc = seen[molname]
+    while f"{molname}_{cc}" in seen:
+        cc += 1
+    seen[molname] = cc + 1
+    name = f"{molname}_{cc}"
+    seen[name] = 1
+    return name
+
+
+def scan_mol2(mmol2: str):
+    """
+    Iterate a multi mol2 yielding (byte offset, name, record bytes).
+
+    Names are returned as found in the file, duplicates included.
+    """
+    record = []
+    molname = None
+    offset = 0
+    start = 0
+    with open(mmol2, "rb") as f:
+        for line in f:
+            if line.strip().lower() == b"@<tripos>molecule":
+                if record:
+                    yield start, molname, b"".join(record)
+                record = [line]
+                molname = None
+                start = offset
+            elif record:
+                if molname is None and len(record) == 1:
+                    molname = line.strip().decode("utf8", "replace")
+                record.append(line)
+            offset += len(line)
+    if record:
+        yield start, molname, b"".join(record)
+
+
+def iter_mol2(mmol2: str):
+    """
+    Iterate a multi mol2 yielding (unique name, record bytes).
+
+    Every record is parsed once in memory; nothing is written to disk.
+    """
+    seen = {}
+    for _, molname, record in scan_mol2(mmol2):
+        yield unique_name(molname, seen), record
+
+
+def mol2_counts(record: bytes):
+    """
+    Return the number of atoms and bonds declared in a mol2 record.
+    """
+    lines = record.split(b"\n", 3)
+    try:
+        counts = [int(x) for x in lines[2].split()[:2]]
+        return counts[0], counts[1] if len(counts) > 1 else 0
+    except (IndexError, ValueError):
+        return 0, 0
+
+
+class Mol2Index(object):
+    """
+    Side-car byte-offset index of a multi mol2 library.
+
+    The index is built in one streaming pass and stored next to the
+    library as <db>.idx: a header, one fixed size entry per record
+    (offset, length, atoms, bonds, name offset, name length) and the
+    unique record names. Both files are then read through mmap, so any
+    record, shard or random subset is reached without scanning the
+    library again.
+    """
+
+    MAGIC = b"PADMOL2I"
+    HEADER = struct.Struct("<8sQQd")
+    ENTRY = struct.Struct("<QQIIQI")
+
+    def __init__(self, db: str, idx: Optional[str] = None):
+        self.db = str(Path(db).absolute())
+        self.idx = idx or self.db + ".idx"
+        if not self.is_current():
+            self.build()
+        self._load()
+
+    def is_current(self):
+        """
+        True if the index exists and matches the library size and mtime.
+        """
+        if not Path(self.idx).exists():
+            return False
+        st = os.stat(self.db)
+        with open(self.idx, "rb") as f:
+            header = f.read(self.HEADER.size)
+        if len(header) < self.HEADER.size:
+            return False
+        magic, _, size, mtime = self.HEADER.unpack(header)
+        return magic == self.MAGIC and size == st.st_size and mtime == st.st_mtime
+
+    def build(self):
+        with trace.span("mol2_index"):
+            self._build()
+
+    def _build(self):
+        seen = {}
+        entries = []
+        names = []
+        name_offset = 0
+        for offset, molname, record in scan_mol2(self.db):
+            name = unique_name(molname, seen).encode("utf8")
+            natoms, nbonds = mol2_counts(record)
+            entries.append(
+                self.ENTRY.pack(
+                    offset, len(record), natoms, nbonds, name_offset, len(name)
+                )
+            )
+            names.append(name)
+            name_offset += len(name)
+        st = os.stat(self.db)
+        # concurrent builders of the same library each write their own file
+        tmp = f"{self.idx}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(self.HEADER.pack(self.MAGIC, len(entries), st.st_size, st.st_mtime))
+            f.write(b"".join(entries))
+            f.write(b"".join(names))
+        os.replace(tmp, self.idx)
+
+    def _load(self):
+        with open(self.idx, "rb") as f:
+            self._idx = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        _, self.nrec, _, _ = self.HEADER.unpack_from(self._idx, 0)
+        self._names_start = self.HEADER.size + self.nrec * self.ENTRY.size
+        self._db = None
+        if self.nrec > 0:
+            with open(self.db, "rb") as f:
+                self._db = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self.nrec
+
+    def entry(self, i):
+        """
+        Return (offset, length, atoms, bonds) of the record i.
+        """
+        if i < 0 or i >= self.nrec:
+            raise IndexError(f"record {i} out of range")
+        pos = self.HEADER.size + i * self.ENTRY.size
+        return self.ENTRY.unpack_from(self._idx, pos)[:4]
+
+    def name(self, i):
+        self.entry(i)
+        pos = self.HEADER.size + i * self.ENTRY.size
+        _, _, _, _, noff, nlen = self.ENTRY.unpack_from(self._idx, pos)
+        start = self._names_start + noff
+        end = start + nlen
+        return self._idx[start:end].decode("utf8")
+
+    def record(self, i):
+        offset, length, _, _ = self.entry(i)
+        end = offset + length
+        return self._db[offset:end]
+
+    def select(self, start=0, stop=None, shard=0, nshards=1, sample=None, seed=0):
+        """
+        Return the record indices of a slice of the library.
+
+        The range [start, stop) is split in nshards contiguous blocks and
+        block shard is kept. sample, if given, draws that many records at
+        random (reproducible with seed) from the selection.
+        """
+        stop = self.nrec if stop is None else min(stop, self.nrec)
+        indices = range(max(0, start), max(0, stop))
+        n = len(indices)
+        first = n * shard // nshards
+        last = n * (shard + 1) // nshards
+        indices = indices[first:last]
+        if sample is not None and sample < len(indices):
+            indices = sorted(random.Random(seed).sample(indices, sample))
+        return list(indices)
+
+    def iter_records(self, indices=None):
+        """
+        Yield (name, record bytes) for the given record indices.
+        """
+        if indices is None:
+            indices = range(self.nrec)
+        for i in indices:
+            yield self.name(i), self.record(i)
+
+    def close(self):
+        self._idx.close()
+        if self._db is not None:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
 
 def split_mol2(mmol2, path="./"):
+    """
+    Split a multi mol2 into single <name>.mol2 files inside path.
+    """
     mol2splitted = []
-    fmol2 = open(mmol2, "r")
-    ftmp = open("tmp_", "w")
-    firstmol = True
-    for line in fmol2:
-        if line.strip().lower() == "@<TRIPOS>MOLECULE".lower():
-            if ftmp.closed is False and firstmol is False:
-                ftmp.close()
-                filename = get_mol2_name("tmp_")
-                mpath = str(Path(path + "/" + filename).absolute())
-                if Path(mpath).exists() is False:
-                    shutil.move("tmp_", mpath)
-                    mol2splitted.append(mpath)
-                else:
-                    os.remove("tmp_")
-                ftmp = open("tmp_", "w")
-            firstmol = False
-            ftmp.write(line)
-        else:
-            ftmp.write(line)
-
-    if ftmp.closed is False:
-        ftmp.close()
-        filename = get_mol2_name("tmp_")
-        mpath = str(Path(path + "/" + filename).absolute())
-        if Path(mpath).exists() is False:
-            shutil.move("tmp_", mpath)
-            mol2splitted.append(mpath)
-        else:
-            os.remove("tmp_")
-    fmol2.close()
+    with trace.span("mol2_split"):
+        for molname, record in iter_mol2(mmol2):
+            mpath = str(Path(path + "/" + molname + ".mol2").absolute())
+            if Path(mpath).exists() is False:
+                with open(mpath, "wb") as fo:
+                    fo.write(record)
+                mol2splitted.append(mpath)
     return mol2splitted
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""parsers.py
+
+This file is part of PAutoDock.
+Copyright (C) 2020 Giuseppe Marco Randazzo <gmrandazzo@gmail.com>
+PAutoDock is distributed under GPLv3 license.
+To know more in detail how the license work,
+please read the file "LICENSE" or
+go to "http://www.gnu.org/licenses/gpl-3.0.en.html"
+
+Provides single-pass parsers of the vina and AutoDock outputs.
+
+Every file is mapped in memory and scanned once by a compiled regular
+expression. The parsers return typed records with the energy and the
+RMSD of every pose; they run in the pool worker right after the
+docking job.
+"""
+
+import mmap
+import re
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Optional
+
+_FLOAT = rb"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?"
+_SEP = rb"[ \t]+"
+
+# a score table printed by vina: marker line followed by the pose rows
+_VINA_TABLE = re.compile(
+    rb"^-----\+------------\+----------\+----------[ \t]*\r?\n"
+    rb"((?:[ \t]*\d+(?:%s%s){3}[ \t]*(?:\r?\n|$))+)" % (_SEP, _FLOAT),
+    re.M,
+)
+_VINA_ROW = re.compile(rb"^[ \t]*(\d+)%s(%s)%s(%s)%s(%s)" % ((_SEP, _FLOAT) * 3), re.M)
+_VINA_REMARK = re.compile(
+    rb"^REMARK VINA RESULT:%s(%s)%s(%s)%s(%s)" % ((_SEP, _FLOAT) * 3), re.M
+)
+_DLG = re.compile(
+    rb"Partition function, Q =[ \t]+(?P<q>\S+)"
+    rb"|Free energy,[ \t]+A ~[ \t]+(?P<a>\S+)"
+    rb"|Internal energy,[ \t]+U =[ \t]+(?P<u>\S+)"
+    rb"|Entropy,[ \t]+S =[ \t]+(?P<s>\S+)"
+    rb"|^[ \t]*(?P<rank>\d+)[ \t]+(?P<subrank>\d+)[ \t]+(?P<run>\d+)[ \t]+"
+    rb"(?P<energy>%s)[ \t]+(?P<crmsd>%s)[ \t]+(?P<rrmsd>%s)[ \t]+RANKING"
+    % (_FLOAT, _FLOAT, _FLOAT),
+    re.M,
+)
+
+# DLG thermodynamic group -> ReadOutput header
+DLG_HEADER = {
+    "q": "Part. Func.",
+    "a": "Free Energy",
+    "u": "Internal Energy",
+    "s": "Entropy",
+}
+
+
+@dataclass(frozen=True)
+class VinaPose:
+    """A vina pose: mode number, affinity (kcal/mol) and RMSD bounds."""
+
+    mode: int
+    energy: float
+    rmsd_lb: float
+    rmsd_ub: float
+
+
+@dataclass(frozen=True)
+class DLGRanking:
+    """A RANKING row of an AutoDock DLG clustering histogram."""
+
+    rank: int
+    subrank: int
+    run: int
+    energy: float
+    cluster_rmsd: float
+    ref_rmsd: float
+
+
+@dataclass
+class DLGResult:
+    """The thermodynamic values and the pose rankings of an AutoDock DLG."""
+
+    values: dict = field(default_factory=dict)
+    rankings: list = field(default_factory=list)
+
+    def summary(self):
+        """
+        Return the (header, values) of ADParallel.ReadOutput.
+
+        The averages are left out if the DLG has no RANKING rows.
+        """
+        header = [DLG_HEADER[k] for k in self.values]
+        r = list(self.values.values())
+        if self.rankings:
+            n = float(len(self.rankings))
+            header += ["Binding Energy Average", "Cluster RMSD Average"]
+            header += ["Ref. RMSD Average"]
+            r.append(round(sum(p.energy for p in self.rankings) / n, 3))
+            r.append(round(sum(p.cluster_rmsd for p in self.rankings) / n, 3))
+            r.append(round(sum(p.ref_rmsd for p in self.rankings) / n, 3))
+        return header, r
+
+
+@contextmanager
+def _mapped(path):
+    """
+    The content of a file mapped in memory.
+    """
+    with open(path, "rb") as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file
+            yield b""
+            return
+        try:
+            yield data
+        finally:
+            data.close()
+
+
+def vina_table(data) -> list:
+    """
+    Poses of every vina score table in data (a log may hold several).
+    """
+    poses = []
+    for table in _VINA_TABLE.finditer(data):
+        for m in _VINA_ROW.finditer(table.group(1)):
+            poses.append(VinaPose(int(m[1]), float(m[2]), float(m[3]), float(m[4])))
+    return poses
+
+
+def vina_remarks(data) -> list:
+    """
+    Poses of the REMARK VINA RESULT records of docked poses.
+    """
+    if isinstance(data, str):
+        data = data.encode("utf8")
+    return [
+        VinaPose(i + 1, float(m[1]), float(m[2]), float(m[3]))
+        for i, m in enumerate(_VINA_REMARK.finditer(data))
+    ]
+
+
+def read_vina_log(path) -> list:
+    with _mapped(path) as data:
+        return vina_table(data)
+
+
+def read_vina_poses(path) -> list:
+    with _mapped(path) as data:
+        return vina_remarks(data)
+
+
+def read_dlg(path) -> DLGResult:
+    """
+    Parse an AutoDock DLG. Only the first value of every thermodynamic
+    quantity is kept.
+    """
+    res = DLGResult()
+    with _mapped(path) as data:
+        for m in _DLG.finditer(data):
+            _add_dlg_match(res, m)
+    return res
+
+
+def _add_dlg_match(res, m):
+    if m["rank"] is not None:
+        res.rankings.append(
+            DLGRanking(
+                int(m["rank"]),
+                int(m["subrank"]),
+                int(m["run"]),
+                float(m["energy"]),
+                float(m["crmsd"]),
+                float(m["rrmsd"]),
+            )
+        )
+        return
+    for key in DLG_HEADER:
+        value = m[key]
+        if value is not None and key not in res.values:
+            res.values[key] = value.decode()
+
+
+def energy_stats(poses) -> Optional[tuple]:
+    """
+    (average, min, max) of the pose energies, or None without poses.
+    """
+    if not poses:
+        return None
+    energies = [p.energy for p in poses]
+    return round(sum(energies) / float(len(energies)), 3), min(energies), max(energies)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""receptorcache.py
+
+This file is part of PAutoDock.
+Copyright (C) 2020 Giuseppe Marco Randazzo <gmrandazzo@gmail.com>
+PAutoDock is distributed under GPLv3 license.
+To know more in detail how the license work,
+please read the file "LICENSE" or
+go to "http://www.gnu.org/licenses/gpl-3.0.en.html"
+
+Provides a content-addressed cache of prepared receptors.
+
+A receptor is prepared once with MGLTools per content and preparation
+flags. The PDBQT is written in the cache, never next to the input PDB,
+and published with an atomic rename under a lock, so repeated and
+concurrent screens of the same target start from the cached receptor.
+"""
+
+import fcntl
+import hashlib
+import os
+from pathlib import Path
+
+from pautodock import molop
+from pautodock.fileutils import file_checksum
+
+
+class ReceptorCache(object):
+    """
+    Prepared receptors stored in cache_dir/<key>/receptor.pdbqt.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir).absolute()
+
+    def key(self, receptor, flags=()):
+        h = hashlib.sha256()
+        file_checksum(receptor, h)
+        h.update(("\0prepare_receptor4.py " + " ".join(flags)).encode("utf8"))
+        return h.hexdigest()
+
+    def path(self, key) -> Path:
+        return self.cache_dir / key / "receptor.pdbqt"
+
+    def prepare(self, receptor, mglpath, flags=()) -> str:
+        """
+        Return the cached PDBQT of receptor, preparing it if needed.
+        """
+        pdbqt = self.path(self.key(receptor, flags))
+        if pdbqt.is_file():
+            return str(pdbqt)
+        pdbqt.parent.mkdir(parents=True, exist_ok=True)
+        with open(pdbqt.parent / ".lock", "w") as fl:
+            fcntl.flock(fl, fcntl.LOCK_EX)
+            try:
+                # prepared by a concurrent screen while waiting for the lock
+                if pdbqt.is_file():
+                    return str(pdbqt)
+                tmp = pdbqt.with_suffix(f".{os.getpid()}.pdbqt")
+                rec = molop.Receptor(str(Path(receptor).absolute()), mglpath, flags)
+                rec.topdbqt(str(tmp))
+                if not tmp.is_file() or tmp.stat().st_size == 0:
+                    if tmp.exists():
+                        tmp.unlink()
+                    raise RuntimeError(f"Unable to prepare the receptor {receptor}")
+                os.replace(tmp, pdbqt)
+            finally:
+                fcntl.flock(fl, fcntl.LOCK_UN)
+        return str(pdbqt)
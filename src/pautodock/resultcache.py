@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""resultcache.py
+
+This file is part of PAutoDock.
+Copyright (C) 2020 Giuseppe Marco Randazzo <gmrandazzo@gmail.com>
+PAutoDock is distributed under GPLv3 license.
+To know more in detail how the license work,
+please read the file "LICENSE" or
+go to "http://www.gnu.org/licenses/gpl-3.0.en.html"
+
+Provides a persistent cache of the docking outputs shared by every screen.
+
+An entry holds the output files of a vina or AutoDock job (poses, log,
+DLG), compressed, under a key hashing the prepared ligand, the receptor,
+the box and the docking parameters. A screen in any working directory
+restores the files of an identical job instead of docking it again.
+The cache is bounded in size: the least recently used entries are
+evicted first.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import zlib
+from pathlib import Path
+
+# evict down to this fraction of the maximum size
+LOW_WATER = 0.9
+# puts between two checks of the cache size
+CHECK_EVERY = 64
+
+
+def pdbqt_digest(path, h=None):
+    """
+    sha256 hex digest of the content of a PDBQT without its REMARK
+    records and trailing blanks, which do not change the docking.
+    """
+    if h is None:
+        h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.startswith(b"REMARK"):
+                h.update(line.rstrip() + b"\n")
+    return h.hexdigest()
+
+
+def make_key(*parts):
+    """
+    Cache key of the given digests and parameters.
+    """
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(str(part).encode("utf8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class ResultCache(object):
+    """
+    Docking outputs stored in an SQLite database with LRU eviction.
+
+    max_size is in bytes of compressed data. As the Ledger, the
+    connection is opened lazily in each process, so the cache can be
+    shipped to the pool workers, and concurrent screens share the
+    database in WAL mode.
+    """
+
+    def __init__(self, path, max_size):
+        self.path = Path(path).absolute()
+        self.db = str(self.path / "cache.sqlite")
+        self.max_size = int(max_size)
+        self._conn = None
+        self._pid = None
+        self._puts = 0
+
+    def __getstate__(self):
+        return dict(self.__dict__, _conn=None, _pid=None, _puts=0)
+
+    @property
+    def conn(self):
+        if self._conn is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self.path.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.db, timeout=60, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, "
+                "program TEXT, "
+                "size INTEGER, "
+                "atime REAL, "
+                "data BLOB)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS entries_atime ON entries (atime)"
+            )
+        return self._conn
+
+    def get(self, key):
+        """
+        Return the {name: text} files of an entry, or None.
+        """
+        row = self.conn.execute(
+            "SELECT data FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        self.conn.execute(
+            "UPDATE entries SET atime = ? WHERE key = ?", (time.time(), key)
+        )
+        return json.loads(zlib.decompress(row[0]).decode("utf8"))
+
+    def put(self, key, program, files):
+        """
+        Store the {name: text} files of a job.
+        """
+        data = zlib.compress(json.dumps(files).encode("utf8"))
+        self.conn.execute(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+            (key, program, len(data), time.time(), data),
+        )
+        self._puts += 1
+        if self._puts >= CHECK_EVERY:
+            self._puts = 0
+            self.evict()
+
+    def size(self):
+        return self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()[0]
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def evict(self):
+        """
+        Remove the least recently used entries once the cache is larger
+        than max_size, down to LOW_WATER * max_size.
+        """
+        total = self.size()
+        if total <= self.max_size:
+            return
+        target = total - int(LOW_WATER * self.max_size)
+        keys = []
+        freed = 0
+        for key, size in self.conn.execute(
+            "SELECT key, size FROM entries ORDER BY atime"
+        ):
+            keys.append((key,))
+            freed += size
+            if freed >= target:
+                break
+        self.conn.executemany("DELETE FROM entries WHERE key = ?", keys)
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""results.py
+
+This file is part of PAutoDock.
+Copyright (C) 2020 Giuseppe Marco Randazzo <gmrandazzo@gmail.com>
+PAutoDock is distributed under GPLv3 license.
+To know more in detail how the license work,
+please read the file "LICENSE" or
+go to "http://www.gnu.org/licenses/gpl-3.0.en.html"
+
+Provides an incremental SQLite writer for the screening results.
+
+Results are appended as soon as each ligand completes, so partial
+results of a long screen can be queried while it runs, and sorting or
+filtering by binding energy is an indexed query.
+"""
+
+import sqlite3
+from pathlib import Path
+
+# AutoDock header written by ADParallel.ReadOutput -> column name
+AUTODOCK_COLUMNS = {
+    "Part. Func.": "ad_partition_function",
+    "Free Energy": "ad_free_energy",
+    "Internal Energy": "ad_internal_energy",
+    "Entropy": "ad_entropy",
+    "Binding Energy Average": "ad_binding_energy_avg",
+    "Cluster RMSD Average": "ad_cluster_rmsd_avg",
+    "Ref. RMSD Average": "ad_ref_rmsd_avg",
+}
+
+# vina columns -> header of the text table
+VINA_COLUMNS = {
+    "vina_avg": "Avg. vina Binding Energy",
+    "vina_min": "Min vina Binding Energy",
+    "vina_max": "Max vina Binding Energy",
+    "pose_distance": "Template-Ligand Baricenter Distance (docking pose check)",
+}
+
+
+def is_results_db(otab):
+    return str(otab).endswith((".sqlite", ".db"))
+
+
+class ResultsDB(object):
+    """
+    Screening results stored in an indexed SQLite table.
+
+    Rows are committed every commit_every additions and on close,
+    so readers see partial results while the screen is running.
+    """
+
+    def __init__(self, path, commit_every=100):
+        self.path = str(Path(path).absolute())
+        self.commit_every = commit_every
+        self.pending = 0
+        self.conn = sqlite3.connect(self.path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        columns = ["molname TEXT PRIMARY KEY"]
+        columns += [f"{col} REAL" for col in AUTODOCK_COLUMNS.values()]
+        columns += [f"{col} REAL" for col in VINA_COLUMNS]
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS results ({', '.join(columns)})")
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS results_vina_min ON results (vina_min)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS results_ad_binding "
+            "ON results (ad_binding_energy_avg)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS metrics ("
+            "molname TEXT NOT NULL, "
+            "program TEXT NOT NULL, "
+            "returncode INTEGER, "
+            "wall REAL, "
+            "user REAL, "
+            "sys REAL, "
+            "maxrss INTEGER, "
+            "timed_out INTEGER)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS metrics_molname ON metrics (molname)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS vina_poses ("
+            "molname TEXT NOT NULL, "
+            "mode INTEGER, "
+            "energy REAL, "
+            "rmsd_lb REAL, "
+            "rmsd_ub REAL, "
+            "PRIMARY KEY (molname, mode))"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS autodock_poses ("
+            "molname TEXT NOT NULL, "
+            "rank INTEGER, "
+            "subrank INTEGER, "
+            "run INTEGER, "
+            "energy REAL, "
+            "cluster_rmsd REAL, "
+            "ref_rmsd REAL, "
+            "PRIMARY KEY (molname, run))"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS library ("
+            "molname TEXT PRIMARY KEY, "
+            "idx INTEGER NOT NULL)"
+        )
+
+    def clear_library(self):
+        """
+        Forget the library of an earlier screen; export writes every
+        result until add_library is called again.
+        """
+        self.conn.execute("DELETE FROM library")
+
+    def add_library(self, idx, molname):
+        """
+        Record the index of a ligand in the screened library. Once a
+        library is recorded, export writes only its ligands, in library
+        order.
+        """
+        self.conn.execute(
+            "INSERT OR REPLACE INTO library VALUES (?, ?)", (molname, idx)
+        )
+
+    def add(self, header, row):
+        """
+        Add the (header, row) of a ligand given by ADParallel.ligand_results.
+        """
+        cols = ["molname"]
+        cols += [AUTODOCK_COLUMNS[h] for h in header if h in AUTODOCK_COLUMNS]
+        vals = [row[0]]
+        vals += [float(v) for h, v in zip(header, row[1:]) if h in AUTODOCK_COLUMNS]
+        cols += list(VINA_COLUMNS)
+        vals += [float(v) for v in row[-4:]]
+        self.conn.execute(
+            "INSERT OR REPLACE INTO results (%s) VALUES (%s)"
+            % (", ".join(cols), ", ".join("?" * len(cols))),
+            vals,
+        )
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.commit()
+
+    def add_metrics(self, molname, metrics):
+        """
+        Store the resource usage of the jobs of a ligand, as given by
+        runner.RunResult.metrics(). Earlier metrics of the ligand are
+        replaced.
+        """
+        self.conn.execute("DELETE FROM metrics WHERE molname = ?", (molname,))
+        self.conn.executemany(
+            "INSERT INTO metrics VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    molname,
+                    m["program"],
+                    m["returncode"],
+                    m["wall"],
+                    m["user"],
+                    m["sys"],
+                    m["maxrss"],
+                    int(m["timed_out"]),
+                )
+                for m in metrics
+            ],
+        )
+
+    def add_poses(self, molname, vina_poses=None, dlg_result=None):
+        """
+        Store every pose of a ligand, as given by the parsers: the vina
+        poses and the RANKING rows of the AutoDock DLG. Earlier poses of
+        the ligand are replaced.
+        """
+        if vina_poses is not None:
+            self.conn.execute("DELETE FROM vina_poses WHERE molname = ?", (molname,))
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO vina_poses VALUES (?, ?, ?, ?, ?)",
+                [(molname, p.mode, p.energy, p.rmsd_lb, p.rmsd_ub) for p in vina_poses],
+            )
+        if dlg_result is not None:
+            self.conn.execute(
+                "DELETE FROM autodock_poses WHERE molname = ?", (molname,)
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO autodock_poses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        molname,
+                        p.rank,
+                        p.subrank,
+                        p.run,
+                        p.energy,
+                        p.cluster_rmsd,
+                        p.ref_rmsd,
+                    )
+                    for p in dlg_result.rankings
+                ],
+            )
+
+    def poses(self, molname, program="vina"):
+        """
+        Return the vina (or "autodock") poses of a ligand as dictionaries.
+        """
+        table = {"vina": "vina_poses", "autodock": "autodock_poses"}[program]
+        cur = self.conn.execute(
+            f"SELECT * FROM {table} WHERE molname = ? ORDER BY rowid", (molname,)
+        )
+        names = [d[0] for d in cur.description]
+        for values in cur:
+            yield dict(zip(names, values))
+
+    def cost(self, limit=None):
+        """
+        Return the ligands by decreasing CPU time (user + sys) of their jobs.
+        """
+        sql = (
+            "SELECT molname, SUM(user + sys) AS cpu, SUM(wall) AS wall, "
+            "MAX(maxrss) AS maxrss, SUM(timed_out) AS timeouts "
+            "FROM metrics GROUP BY molname ORDER BY cpu DESC"
+        )
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        cur = self.conn.execute(sql)
+        names = [d[0] for d in cur.description]
+        for values in cur:
+            yield dict(zip(names, values))
+
+    def commit(self):
+        self.conn.commit()
+        self.pending = 0
+
+    def has(self, molname):
+        return (
+            self.conn.execute(
+                "SELECT 1 FROM results WHERE molname = ?", (molname,)
+            ).fetchone()
+            is not None
+        )
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def has_library(self):
+        return self.conn.execute("SELECT 1 FROM library LIMIT 1").fetchone() is not None
+
+    def query(self, order_by=None, where=None, params=(), limit=None, library=False):
+        """
+        Return the result rows as dictionaries.
+
+        e.g. query(order_by="vina_min", where="vina_min < ?", params=(-9,))
+
+        With library, only the ligands of the recorded library are
+        returned, by default in library order.
+        """
+        if library:
+            sql = "SELECT results.* FROM results JOIN library USING (molname)"
+            order_by = order_by or "library.idx"
+        else:
+            sql = "SELECT * FROM results"
+        if where is not None:
+            sql += f" WHERE {where}"
+        sql += f" ORDER BY {order_by or 'results.rowid'}"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        cur = self.conn.execute(sql, params)
+        names = [d[0] for d in cur.description]
+        for values in cur:
+            yield dict(zip(names, values))
+
+    def export(self, otab, sep=None, order_by=None):
+        """
+        Export the results to a text table.
+
+        The separator is a tab for .tsv files and ";" otherwise, as in
+        the original PAutoDock output. AutoDock columns are written only
+        if some ligand has AutoDock results. If a library is recorded
+        (add_library), only its ligands are written, by default in
+        library order.
+        """
+        self.commit()
+        if sep is None:
+            sep = "\t" if str(otab).endswith(".tsv") else ";"
+        library = self.has_library()
+        source = "results JOIN library USING (molname)" if library else "results"
+        ad_cols = [
+            col
+            for col in AUTODOCK_COLUMNS.values()
+            if self.conn.execute(
+                f"SELECT 1 FROM {source} WHERE {col} IS NOT NULL LIMIT 1"
+            ).fetchone()
+        ]
+        ad_header = {col: h for h, col in AUTODOCK_COLUMNS.items()}
+        with open(otab, "w") as fo:
+            header = ["Molname"] + [ad_header[col] for col in ad_cols]
+            header += list(VINA_COLUMNS.values())
+            fo.write(sep.join(header) + "\n")
+            for res in self.query(order_by=order_by, library=library):
+                line = [res["molname"]]
+                line += ["" if res[col] is None else str(res[col]) for col in ad_cols]
+                line += ["%f" % (res[col]) for col in VINA_COLUMNS]
+                fo.write(sep.join(line) + "\n")
+
+    def merge(self, path):
+        """
+        Add the results of another results database, e.g. a shard of a
+        distributed screen.
+        """
+        self.commit()
+        self.conn.execute("ATTACH DATABASE ? AS shard", (str(path),))
+        try:
+            cols = [
+                row[1] for row in self.conn.execute("PRAGMA shard.table_info(results)")
+            ]
+            self.conn.execute(
+                "INSERT OR REPLACE INTO results (%s) SELECT %s FROM shard.results"
+                % (", ".join(cols), ", ".join(cols))
+            )
+            for table in ["metrics", "vina_poses", "autodock_poses", "library"]:
+                if self.conn.execute(
+                    "SELECT 1 FROM shard.sqlite_master WHERE name = ?", (table,)
+                ).fetchone():
+                    self.conn.execute(
+                        f"DELETE FROM {table} WHERE molname IN "
+                        f"(SELECT DISTINCT molname FROM shard.{table})"
+                    )
+                    self.conn.execute(
+                        f"INSERT INTO {table} SELECT * FROM shard.{table}"
+                    )
+            self.conn.commit()
+        finally:
+            self.conn.execute("DETACH DATABASE shard")
+
+    def close(self):
+        self.commit()
+        self.conn.close()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""runner.py
+
+This file is part of PAutoDock.
+Copyright (C) 2020 Giuseppe Marco Randazzo <gmrandazzo@gmail.com>
+PAutoDock is distributed under GPLv3 license.
+To know more in detail how the license work,
+please read the file "LICENSE" or
+go to "http://www.gnu.org/licenses/gpl-3.0.en.html"
+
+Provides the runner of the external docking programs.
+
+Programs are started from an argument list, without a shell, with an
+optional wall-clock timeout. The output goes to a log file or is
+captured in memory, and the resource usage of every job (wall time,
+CPU time and peak memory) is collected with wait4.
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass
+
+from pautodock import trace
+
+
+@dataclass
+class RunResult:
+    """Exit status and resource usage of a job."""
+
+    program: str
+    returncode: int
+    wall: float
+    user: float
+    sys: float
+    maxrss: int
+    timed_out: bool = False
+    output: bytes = b""
+
+    def metrics(self) -> dict:
+        """
+        The resource usage without the captured output.
+        """
+        res = asdict(self)
+        res.pop("output")
+        return res
+
+
+def exit_code(status: int) -> int:
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def run(args, log=None, timeout=None, cwd=None) -> RunResult:
+    """
+    Run args and wait for it.
+
+    stdout and stderr go to the file log, or are captured in memory
+    when log is None. A job running longer than timeout seconds is
+    killed and flagged as timed out. maxrss is in kilobytes.
+    """
+    args = [str(a) for a in args]
+    program = os.path.basename(args[0])
+    out = open(log, "wb") if log is not None else tempfile.TemporaryFile()
+    with trace.span(program), out:
+        start = time.monotonic()
+        proc = subprocess.Popen(args, stdout=out, stderr=subprocess.STDOUT, cwd=cwd)
+        timer = None
+        killed = threading.Event()
+        if timeout is not None:
+
+            def kill():
+                killed.set()
+                proc.kill()
+
+            timer = threading.Timer(timeout, kill)
+            timer.start()
+        _, status, rusage = os.wait4(proc.pid, 0)
+        wall = time.monotonic() - start
+        if timer is not None:
+            timer.cancel()
+        # the process is reaped: tell Popen not to wait for it again
+        proc.returncode = exit_code(status)
+        output = b""
+        if log is None:
+            out.seek(0)
+            output = out.read()
+    return RunResult(
+        program=program,
+        returncode=proc.returncode,
+        wall=wall,
+        user=rusage.ru_utime,
+        sys=rusage.ru_stime,
+        maxrss=(
+            rusage.ru_maxrss // 1024 if sys.platform == "darwin" else rusage.ru_maxrss
+        ),
+        timed_out=killed.is_set(),
+        output=output,
+    )
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""scheduler.py
+
+This file is part of PAutoDock.
+Copyright (C) 2020 Giuseppe Marco Randazzo <gmrandazzo@gmail.com>
+PAutoDock is distributed under GPLv3 license.
+To know more in detail how the license work,
+please read the file "LICENSE" or
+go to "http://www.gnu.org/licenses/gpl-3.0.en.html"
+
+Provides a streaming task scheduler on top of a single process pool.
+
+Every task is a method call on a worker object installed once in each
+pool process. When a task completes its "then" callback runs in the
+parent and may submit the next tasks of the same ligand, so work moves
+through the pipeline as soon as its dependencies are done instead of
+waiting for a whole phase to finish.
+
+The scheduler owns a budget of cores. Single threaded tasks take one
+core each; elastic tasks (e.g. vina) receive an "ncpu" keyword with the
+number of threads they may use, one while the library is being fed and
+the free cores shared among the last few stragglers.
+
+An optional "idle" callback is called whenever cores are free and there
+is nothing left to dispatch, e.g. to submit a partially filled batch.
+
+If a pool process dies (e.g. killed by the OOM killer), its task can
+never complete: the run stops with a RuntimeError instead of waiting
+for it.
+"""
+
+import logging
+import multiprocessing
+import queue
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from pautodock import trace
+
+_WORKER = None
+
+
+def init_worker(worker, traced=False):
+    """
+    Pool initializer: install the worker object in the pool process.
+    """
+    global _WORKER
+    _WORKER = worker
+    trace.enable(traced)
+    # spans inherited from the parent by fork belong to the parent
+    trace.drain()
+
+
+def call_worker(method, args, kwargs):
+    """
+    Run a method of the worker object installed by init_worker.
+
+    When tracing, the spans recorded during the call are returned
+    with the result.
+    """
+    if not trace.enabled():
+        return getattr(_WORKER, method)(*args, **kwargs)
+    with trace.span(method, **task_ligand(args)):
+        result = getattr(_WORKER, method)(*args, **kwargs)
+    return result, trace.drain()
+
+
+def task_ligand(args):
+    """
+    Span arguments naming the ligand(s) a task works on.
+    """
+    if not args:
+        return {}
+    first = args[0]
+    if isinstance(first, str):
+        return {"molname": first}
+    if hasattr(first, "molname"):
+        return {"molname": first.molname}
+    if isinstance(first, list) and first:
+        return {"ligands": len(first)}
+    return {}
+
+
+def task_molnames(args) -> str:
+    """
+    The ligand(s) a task works on, for the log: never the mol2 records
+    or the whole jobs in its arguments.
+    """
+    if not args:
+        return ""
+    first = args[0]
+    if isinstance(first, str):
+        return first
+    if hasattr(first, "molname"):
+        return first.molname
+    if isinstance(first, list):
+        return ", ".join(
+            (
+                x.molname
+                if hasattr(x, "molname")
+                else str(x[0] if isinstance(x, tuple) else x)
+            )
+            for x in first
+        )
+    return str(first)
+
+
+@dataclass
+class Task:
+    """
+    A method call to run on the worker and what to do with its result.
+    If the call fails, otherwise is called with the same arguments.
+    """
+
+    method: str
+    args: tuple = ()
+    then: Optional[Callable] = None
+    otherwise: Optional[Callable] = None
+    kwargs: dict = field(default_factory=dict)
+    elastic: bool = False
+    ncpu: int = 1
+    submitted: float = 0.0
+    dispatched: float = 0.0
+
+
+class Scheduler(object):
+    """
+    Run tasks on one bounded process pool as soon as they are submitted.
+
+    Tasks submitted from a "then" callback are dispatched before new
+    tasks from the source iterator, so each ligand is completed before
+    many new ones are started and the first results show up early.
+    The number of tasks handed to the pool is bounded, so the source
+    iterator can be arbitrarily large.
+    """
+
+    def __init__(self, worker, cores=None, max_threads=None, idle=None):
+        self.worker = worker
+        self.idle = idle
+        self.traced = trace.enabled()
+        self.cores = cores or multiprocessing.cpu_count()
+        self.max_threads = max_threads or self.cores
+        self.ready = deque()
+        self.completed = queue.Queue()
+        self.inflight = 0
+        self.used = 0
+        self.exhausted = False
+        self.failed = []
+        # tasks submitted or running, by method
+        self.active = Counter()
+
+    def submit(self, task):
+        task.submitted = time.time()
+        self.active[task.method] += 1
+        self.ready.appendleft(task)
+
+    def _next_task(self, source):
+        if self.ready:
+            return self.ready.popleft()
+        task = next(source, None)
+        if task is None:
+            self.exhausted = True
+        else:
+            task.submitted = time.time()
+            self.active[task.method] += 1
+        return task
+
+    def threads(self, task):
+        """
+        Number of threads given to a task at dispatch time.
+
+        While the source still feeds new tasks every elastic task runs
+        single threaded, which gives the best throughput on big
+        libraries. Once the source is exhausted the free cores are
+        split among the elastic tasks still waiting.
+        """
+        if not task.elastic or not self.exhausted:
+            return 1
+        free = self.cores - self.used
+        waiting = 1 + sum(1 for t in self.ready if t.elastic)
+        return max(1, min(self.max_threads, free // waiting))
+
+    def _dispatch(self, pool, task):
+        task.ncpu = self.threads(task)
+        task.dispatched = time.time()
+        if task.elastic:
+            task.kwargs = dict(task.kwargs, ncpu=task.ncpu)
+
+        future = pool.submit(call_worker, task.method, task.args, task.kwargs)
+        future.add_done_callback(lambda f, task=task: self.completed.put((task, f)))
+        self.inflight += 1
+        self.used += task.ncpu
+
+    def _fill(self, pool, source):
+        while self.used < self.cores:
+            task = self._next_task(source)
+            if task is None:
+                break
+            self._dispatch(pool, task)
+
+    def run(self, source=()):
+        """
+        Run the tasks from source and everything they submit.
+
+        Yields (task, result) as soon as each task completes.
+        Failed tasks are logged and collected in self.failed; a RuntimeError
+        is raised if a pool process dies.
+        """
+        source = iter(source)
+        with ProcessPoolExecutor(
+            self.cores, initializer=init_worker, initargs=(self.worker, self.traced)
+        ) as pool:
+            while True:
+                self._fill(pool, source)
+                if self.used < self.cores and self.idle is not None:
+                    self.idle()
+                    self._fill(pool, source)
+                if self.inflight == 0:
+                    break
+                task, future = self.completed.get()
+                self.inflight -= 1
+                self.used -= task.ncpu
+                self.active[task.method] -= 1
+                if self.traced:
+                    trace.add(
+                        task.method,
+                        task.dispatched,
+                        time.time() - task.dispatched,
+                        "task",
+                        wait=task.dispatched - task.submitted,
+                        ncpu=task.ncpu,
+                    )
+                err = future.exception()
+                if isinstance(err, BrokenProcessPool):
+                    raise RuntimeError(
+                        f"A pool process died while running {task.method}"
+                    ) from err
+                if err is not None:
+                    logging.error(
+                        "%s(%s) failed: %s", task.method, task_molnames(task.args), err
+                    )
+                    self.failed.append((task, err))
+                    if task.otherwise is not None:
+                        task.otherwise(*task.args)
+                    continue
+                result = future.result()
+                if self.traced:
+                    result, spans = result
+                    trace.record(spans)
+                if task.then is not None:
+                    task.then(result)
+                yield task, result
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""trace.py
+
+This file is part of PAutoDock.
+Copyright (C) 2020 Giuseppe Marco Randazzo <gmrandazzo@gmail.com>
+PAutoDock is distributed under GPLv3 license.
+To know more in detail how the license work,
+please read the file "LICENSE" or
+go to "http://www.gnu.org/licenses/gpl-3.0.en.html"
+
+Provides per-stage timing spans of a screening.
+
+Spans are recorded only when tracing is enabled, otherwise span() costs
+a flag check. Each process keeps its own spans; the scheduler sends the
+spans recorded by a pool worker back to the parent with the task result.
+The spans are exported in the Chrome trace event format, which can be
+opened in chrome://tracing or https://ui.perfetto.dev.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+_ENABLED = False
+_EVENTS = []
+
+
+def enable(on=True):
+    global _ENABLED
+    _ENABLED = on
+
+
+def enabled() -> bool:
+    return _ENABLED
+
+
+@contextmanager
+def span(name, cat="stage", **args):
+    """
+    Record the duration of the with block as a span.
+    """
+    if not _ENABLED:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        add(name, start, time.time() - start, cat, **args)
+
+
+def add(name, start, dur, cat="stage", **args):
+    """
+    Record a span of dur seconds started at the epoch time start.
+    """
+    _EVENTS.append(
+        {
+            "name": name,
+            "cat": cat,
+            "ph": "X",
+            "ts": start * 1e6,
+            "dur": dur * 1e6,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": args,
+        }
+    )
+
+
+def drain() -> list:
+    """
+    Return and forget the spans recorded so far in this process.
+    """
+    events = list(_EVENTS)
+    del _EVENTS[:]
+    return events
+
+
+def record(events):
+    """
+    Add the spans recorded by another process.
+    """
+    _EVENTS.extend(events)
+
+
+def write_chrome(path, events):
+    with open(path, "w", encoding="utf8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+def read_chrome(path) -> list:
+    with open(path, "r", encoding="utf8") as f:
+        return json.load(f)["traceEvents"]
+
+
+def summary(events, cores, nligands) -> str:
+    """
+    Summary table of the stage times, throughput, queue wait and core
+    utilization of a traced run.
+    """
+    if not events:
+        return "No trace events recorded"
+    start = min(e["ts"] for e in events)
+    wall = (max(e["ts"] + e["dur"] for e in events) - start) / 1e6
+    stages = defaultdict(list)
+    for e in events:
+        if e["cat"] == "stage":
+            stages[e["name"]].append(e["dur"] / 1e6)
+    tasks = [e for e in events if e["cat"] == "task"]
+    busy = sum(e["dur"] / 1e6 * e["args"].get("ncpu", 1) for e in tasks)
+    waits = [e["args"].get("wait", 0.0) for e in tasks]
+    lines = ["%-20s %8s %12s %10s" % ("Stage", "Count", "Total (s)", "Mean (s)")]
+    for name, durs in sorted(stages.items(), key=lambda x: -sum(x[1])):
+        lines.append(
+            "%-20s %8d %12.2f %10.3f"
+            % (name, len(durs), sum(durs), sum(durs) / len(durs))
+        )
+    lines.append("")
+    lines.append("Wall time:          %.1f s" % (wall))
+    if wall > 0:
+        lines.append(
+            "Throughput:         %.1f ligands/hour" % (nligands * 3600.0 / wall)
+        )
+        lines.append("Core utilization:   %.1f %%" % (100.0 * busy / (cores * wall)))
+    if waits:
+        lines.append("Mean queue wait:    %.3f s" % (sum(waits) / len(waits)))
+        lines.append("Max queue wait:     %.3f s" % (max(waits)))
+    return "\n".join(lines)
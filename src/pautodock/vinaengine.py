@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""vinaengine.py
+
+This file is part of PAutoDock.
+Copyright (C) 2020 Giuseppe Marco Randazzo <gmrandazzo@gmail.com>
+PAutoDock is distributed under GPLv3 license.
+To know more in detail how the license work,
+please read the file "LICENSE" or
+go to "http://www.gnu.org/licenses/gpl-3.0.en.html"
+
+Provides an in-process vina engine based on the vina Python package.
+
+The package is optional: install it with "pip install vina" to use the
+engine. Each pool worker loads the receptor and computes the vina maps
+once, then docks every ligand it receives against the in-memory maps
+without spawning a process or writing a log.
+"""
+
+import os
+from dataclasses import dataclass
+
+try:
+    from vina import Vina
+except ImportError:
+    Vina = None
+
+ENERGY_RANGE = 3.0
+
+
+def available() -> bool:
+    return Vina is not None
+
+
+@dataclass
+class VinaResult:
+    """Energies (kcal/mol) of the docked poses and the poses as PDBQT."""
+
+    energies: list
+    poses: str
+
+
+class VinaEngine(object):
+    """
+    Dock ligands in process against maps computed once per worker.
+
+    The engine is shipped to the pool workers with the ADParallel object;
+    the vina object and its maps are built lazily in each process (and
+    rebuilt after a fork), never pickled.
+    """
+
+    def __init__(self, rec_pdbqt, center, box_size, exhaustiveness, num_modes):
+        if not available():
+            raise ValueError(
+                "The vina Python package is not installed: pip install vina"
+            )
+        self.rec_pdbqt = str(rec_pdbqt)
+        self.center = [float(c) for c in center]
+        self.box_size = [float(s) for s in box_size]
+        self.exhaustiveness = exhaustiveness
+        self.num_modes = num_modes
+        self._vina = None
+        self._pid = None
+
+    def __getstate__(self):
+        return dict(self.__dict__, _vina=None, _pid=None)
+
+    @property
+    def vina(self):
+        if self._vina is None or self._pid != os.getpid():
+            v = Vina(sf_name="vina", cpu=1, verbosity=0)
+            v.set_receptor(self.rec_pdbqt)
+            v.compute_vina_maps(center=self.center, box_size=self.box_size)
+            self._vina = v
+            self._pid = os.getpid()
+        return self._vina
+
+    def dock(self, mol_pdbqt) -> VinaResult:
+        v = self.vina
+        v.set_ligand_from_file(str(mol_pdbqt))
+        v.dock(exhaustiveness=self.exhaustiveness, n_poses=self.num_modes)
+        energies = v.energies(n_poses=self.num_modes, energy_range=ENERGY_RANGE)
+        poses = v.poses(n_poses=self.num_modes, energy_range=ENERGY_RANGE)
+        return VinaResult([float(e[0]) for e in energies], poses)
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""workqueue.py
+
+This file is part of PAutoDock.
+Copyright (C) 2020 Giuseppe Marco Randazzo <gmrandazzo@gmail.com>
+PAutoDock is distributed under GPLv3 license.
+To know more in detail how the license work,
+please read the file "LICENSE" or
+go to "http://www.gnu.org/licenses/gpl-3.0.en.html"
+
+Provides a work queue of library shards on a shared filesystem.
+
+A coordinator publishes the shards of a screen as small JSON files and
+any number of workers, on any node that mounts the queue directory,
+lease them. Every state change is a rename inside the queue directory,
+which is atomic also on network filesystems, so two workers never hold
+the same lease:
+
+    pending/<shard>.json -> leased/<shard>.<worker>.json -> done/<shard>.json
+
+A worker touches its lease file while it works (heartbeat). Leases not
+touched for lease_timeout seconds belong to dead workers and are moved
+back to pending by the next worker looking for work. Each shard writes
+its results to results/<shard>.sqlite; merge() collects them into one
+table. A traced shard also publishes results/<shard>.trace.json, and
+merge_traces() collects them into one trace. Before publishing a
+worker renames its lease once more, so a worker whose lease was
+reclaimed meanwhile never overwrites the results of the new owner.
+"""
+
+import json
+import logging
+import os
+import shutil
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+
+from pautodock import trace
+from pautodock.results import ResultsDB, is_results_db
+
+
+@dataclass
+class Lease:
+    """A shard leased by a worker."""
+
+    name: str
+    path: Path
+    spec: dict
+
+
+def worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class WorkQueue(object):
+    """
+    Shards of a screen stored as files in a shared directory.
+    """
+
+    STATES = ["pending", "leased", "done", "failed", "results"]
+
+    def __init__(self, path, lease_timeout=1800):
+        self.path = Path(path).absolute()
+        self.lease_timeout = lease_timeout
+        self.config = self.path / "config.json"
+
+    def state_dir(self, state):
+        return self.path / state
+
+    def _write_json(self, path, data):
+        tmp = path.with_name(f".{path.name}.{worker_id()}.tmp")
+        tmp.write_text(json.dumps(data), encoding="utf8")
+        os.replace(tmp, path)
+
+    def publish(self, config, shards):
+        """
+        Publish the screening config and the shard specs.
+
+        shards is a list of dictionaries; the screen is published once,
+        later calls on the same queue keep the existing shards.
+        Returns the number of shards in the queue.
+        """
+        for state in self.STATES:
+            self.state_dir(state).mkdir(parents=True, exist_ok=True)
+        if not self.config.exists():
+            for i, spec in enumerate(shards):
+                self._write_json(
+                    self.state_dir("pending") / f"shard_{i:06d}.json", spec
+                )
+            self._write_json(self.config, dict(config, nshards=len(shards)))
+        return self.read_config()["nshards"]
+
+    def read_config(self):
+        if not self.config.exists():
+            raise FileNotFoundError(f"No screen published in {self.path}")
+        return json.loads(self.config.read_text(encoding="utf8"))
+
+    def shards(self, state):
+        return sorted(self.state_dir(state).glob("*.json"))
+
+    def status(self):
+        return {state: len(self.shards(state)) for state in self.STATES[:-1]}
+
+    def finished(self):
+        status = self.status()
+        return status["done"] + status["failed"] == self.read_config()["nshards"]
+
+    def lease(self, wid=None):
+        """
+        Lease the next pending shard, or return None if there is none.
+
+        Expired leases are moved back to pending first.
+        """
+        wid = wid or worker_id()
+        self.reclaim()
+        for pending in self.shards("pending"):
+            name = pending.stem
+            leased = self.state_dir("leased") / f"{name}.{wid}.json"
+            try:
+                os.rename(pending, leased)
+            except FileNotFoundError:
+                # leased by another worker
+                continue
+            os.utime(leased)
+            spec = json.loads(leased.read_text(encoding="utf8"))
+            return Lease(name, leased, spec)
+        return None
+
+    def reclaim(self):
+        """
+        Move back to pending the leases without a recent heartbeat.
+        """
+        now = time.time()
+        for leased in self.shards("leased"):
+            try:
+                if now - leased.stat().st_mtime < self.lease_timeout:
+                    continue
+                name = leased.name.split(".")[0]
+                os.rename(leased, self.state_dir("pending") / f"{name}.json")
+                logging.warning("Lease %s expired: shard back to pending", leased.name)
+            except FileNotFoundError:
+                continue
+
+    def renew(self, lease):
+        """
+        Heartbeat: returns False if the lease was lost.
+        """
+        try:
+            os.utime(lease.path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    @contextmanager
+    def heartbeat(self, lease, interval=None):
+        """
+        Renew the lease in a background thread while the shard runs.
+        """
+        stop = threading.Event()
+        interval = interval or max(1.0, self.lease_timeout / 4)
+
+        def beat():
+            while not stop.wait(interval):
+                if not self.renew(lease):
+                    logging.warning("Lease %s lost", lease.path.name)
+                    return
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def _finish(self, lease, state):
+        try:
+            os.rename(lease.path, self.state_dir(state) / f"{lease.name}.json")
+        except FileNotFoundError:
+            logging.warning("Lease %s lost before completion", lease.path.name)
+
+    def complete(self, lease):
+        self._finish(lease, "done")
+
+    def fail(self, lease):
+        self._finish(lease, "failed")
+
+    def result_path(self, lease):
+        return self.state_dir("results") / f"{lease.name}.sqlite"
+
+    def fence(self, lease):
+        """
+        Check the lease is still held, by renaming it, and keep it from
+        expiring while the results are published. Returns False if the
+        lease was lost.
+        """
+        fenced = lease.path.with_suffix(".publish.json")
+        try:
+            os.rename(lease.path, fenced)
+        except FileNotFoundError:
+            logging.warning("Lease %s lost: results not published", lease.path.name)
+            return False
+        os.utime(fenced)
+        lease.path = fenced
+        return True
+
+    def trace_path(self, lease):
+        return self.state_dir("results") / f"{lease.name}.trace.json"
+
+    def _copy(self, src, dst):
+        tmp = dst.with_name(f".{dst.name}.{worker_id()}.tmp")
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+
+    def publish_result(self, lease, resdb_path, trace_path=None):
+        """
+        Copy a finished shard results database, and its trace if given,
+        into the queue atomically. Returns False, publishing nothing, if
+        the lease was lost.
+        """
+        if not self.fence(lease):
+            return False
+        if trace_path and os.path.isfile(trace_path):
+            self._copy(trace_path, self.trace_path(lease))
+        self._copy(resdb_path, self.result_path(lease))
+        return True
+
+    def serve(self, run_shard, wid=None, poll=10):
+        """
+        Lease and run shards until every shard is done or failed.
+
+        run_shard(lease) runs while the lease is renewed. A shard whose
+        run_shard raises is moved to failed and the worker goes on.
+        Returns the number of shards run by this worker.
+        """
+        nrun = 0
+        while True:
+            lease = self.lease(wid)
+            if lease is None:
+                if self.finished():
+                    return nrun
+                time.sleep(poll)
+                continue
+            try:
+                with self.heartbeat(lease):
+                    run_shard(lease)
+            except Exception as err:
+                logging.error("Shard %s failed: %s", lease.name, err)
+                self.fail(lease)
+            else:
+                self.complete(lease)
+            nrun += 1
+
+    def merge(self, resdb):
+        """
+        Merge the shard results into the ResultsDB resdb.
+        """
+        for shard in sorted(self.state_dir("results").glob("*.sqlite")):
+            resdb.merge(shard)
+        return resdb
+
+    def merge_traces(self, path):
+        """
+        Write the traces of the shards in one Chrome trace file.
+        Returns the trace events.
+        """
+        events = []
+        for shard in sorted(self.state_dir("results").glob("*.trace.json")):
+            events += trace.read_chrome(shard)
+        trace.write_chrome(path, events)
+        return events
+
+
+def merge_results(queue, otab, trace_path=None):
+    """
+    Merge the shard results of queue into otab (.sqlite/.db or text table),
+    and their traces into trace_path if given.
+    """
+    if trace_path:
+        queue.merge_traces(trace_path)
+    if is_results_db(otab):
+        resdb = ResultsDB(otab)
+    else:
+        resdb = ResultsDB(f"{queue.path}/merged.sqlite")
+    resdb.clear_library()
+    queue.merge(resdb)
+    if not is_results_db(otab):
+        resdb.export(otab)
+    resdb.close()
@@ -0,0 +1,52 @@
+import os
+
+from pautodock.archive import ShardArchive
+
+
+def ligand(tmp_path, molname, **files):
+    mpath = tmp_path / "ligands" / molname
+    mpath.mkdir(parents=True)
+    for name, text in files.items():
+        (mpath / name).write_text(text)
+    return molname, str(mpath)
+
+
+def test_add_and_read(tmp_path):
+    archive = ShardArchive(tmp_path / "archive")
+    ligands = [
+        ligand(tmp_path, "mol1", vina_log="-7.0", poses="MODEL 1"),
+        ligand(tmp_path, "mol2", vina_log="-8.0"),
+    ]
+    assert archive.add(ligands) == 3
+    assert archive.molnames() == ["mol1", "mol2"]
+    assert archive.has("mol1") and not archive.has("mol3")
+    assert archive.names("mol1") == ["poses", "vina_log"]
+    assert archive.read("mol2", "vina_log") == b"-8.0"
+    assert archive.read("mol2", "poses") is None
+    paths = archive.extract("mol1", tmp_path / "out")
+    assert [open(p).read() for p in paths] == ["MODEL 1", "-7.0"]
+
+
+def test_shard_rotation(tmp_path):
+    archive = ShardArchive(tmp_path / "archive", shard_size=1)
+    archive.add([ligand(tmp_path, "mol1", log="a" * 100)])
+    archive.add([ligand(tmp_path, "mol2", log="b" * 100)])
+    shards = sorted(p.name for p in (tmp_path / "archive").glob("shard-*"))
+    assert shards == ["shard-00000.gz", "shard-00001.gz"]
+    assert archive.read("mol1", "log") == b"a" * 100
+    assert archive.read("mol2", "log") == b"b" * 100
+
+
+def test_unindexed_tail(tmp_path):
+    archive = ShardArchive(tmp_path / "archive")
+    archive.add([ligand(tmp_path, "mol1", log="first")])
+    shard = archive.current_shard()
+    size = os.path.getsize(shard)
+    # a writer killed before indexing its members
+    with open(shard, "ab") as f:
+        f.write(b"partial member")
+    assert archive.current_shard() == shard
+    assert os.path.getsize(shard) == size
+    archive.add([ligand(tmp_path, "mol2", log="second")])
+    assert archive.read("mol1", "log") == b"first"
+    assert archive.read("mol2", "log") == b"second"
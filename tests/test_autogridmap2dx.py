@@ -0,0 +1,155 @@
+import gzip
+from pathlib import Path
+
+import numpy as np
+
+from pautodock.__autogridmap2dx__ import (
+    AutoGridMap2DX,
+    collect_maps,
+    convert_maps,
+    format_lines,
+    format_values,
+    read_fld_maps,
+)
+
+
+def baseline_dx_body(map_file, n):
+    """
+    DX body of the original pure Python writer: one float() per line of
+    the map, " %12.5E" fields written with the x/z transposition.
+    """
+    with open(map_file) as fp:
+        lines = fp.read().splitlines()[6:]
+    vals = [float(line) for line in lines]
+    nx, ny, nz = n
+    body = ""
+    col = 0
+    for k in range(nz):
+        for j in range(ny):
+            for i in range(nx):
+                body += f" {vals[i*ny*nz + j*nz + k]:12.5E}"
+                col += 1
+                if col == 3:
+                    body += "\n"
+                    col = 0
+    if col != 0:
+        body += "\n"
+    return body
+
+
+def write_map(path, npts, values):
+    with open(path, "w") as f:
+        f.write("GRID_PARAMETER_FILE grid.gpf\n")
+        f.write("GRID_DATA_FILE receptor_model.maps.fld\n")
+        f.write("MACROMOLECULE rec.pdbqt\n")
+        f.write("SPACING 0.375\n")
+        f.write("NELEMENTS %d %d %d\n" % tuple(npts))
+        f.write("CENTER 1.000 2.000 3.000\n")
+        for v in values:
+            f.write("%.3f\n" % (v))
+    return str(path)
+
+
+def test_read(tmp_path):
+    values = np.arange(2 * 3 * 4) / 10.0
+    agm = AutoGridMap2DX(write_map(tmp_path / "a.map", [1, 2, 3], values))
+    assert agm.n == [2, 3, 4]
+    assert agm.nelem == 24
+    assert agm.values.dtype == np.float64
+    assert np.allclose(agm.values, values)
+    assert agm.origin == [1.0 - 0.375 / 2, 2.0 - 0.375, 3.0 - 3 * 0.375 / 2]
+    assert agm.molecule == "rec.pdbqt"
+
+
+def test_dx_values_transposition(tmp_path):
+    nx, ny, nz = 2, 3, 4
+    values = np.arange(nx * ny * nz, dtype=float)
+    agm = AutoGridMap2DX(
+        write_map(tmp_path / "a.map", [nx - 1, ny - 1, nz - 1], values)
+    )
+    expected = [
+        values[i * ny * nz + j * nz + k]
+        for k in range(nz)
+        for j in range(ny)
+        for i in range(nx)
+    ]
+    assert agm.dx_values().tolist() == expected
+
+
+def test_writeDX(tmp_path):
+    values = np.linspace(-3.5, 1200.25, 2 * 3 * 4)
+    agm = AutoGridMap2DX(write_map(tmp_path / "a.map", [1, 2, 3], values))
+    agm.writeDX(str(tmp_path / "a.dx"), chunk_lines=2)
+    lines = (tmp_path / "a.dx").read_text().splitlines()
+    assert lines[4] == "object 1 class gridpositions counts 2 3 4"
+    body = lines[11:19]
+    vals = agm.dx_values().tolist()
+    lines_vals = [vals[i : i + 3] for i in range(0, 24, 3)]  # noqa: E203
+    assert body == ["".join(" %12.5E" % v for v in line) for line in lines_vals]
+    assert lines[19] == 'attribute "dep" string "positions"'
+
+
+def test_format_values():
+    vals = [0.0, -0.0, 1.0, -1e-5, 9.999995, 99999.95, 1.234375, 1e5, 1e-120, np.inf]
+    assert format_values(vals) == "".join(" %12.5E" % v for v in vals)
+    # fields wider than 13 characters are written as the original writer
+    vals = [1.0, -1e-120, 2.0, 3.0]
+    assert format_values(vals) == "".join(" %12.5E" % v for v in vals)
+    assert format_lines(vals) == (" %12.5E %12.5E %12.5E\n %12.5E\n" % tuple(vals))
+
+
+def test_writeDX_matches_baseline(tmp_path):
+    nx, ny, nz = 3, 4, 5
+    rng = np.random.default_rng(0)
+    values = ["%.3f" % v for v in rng.uniform(-2000.0, 2000.0, nx * ny * nz)]
+    # decimal ties at the 6th significant digit and extreme exponents
+    values[:8] = [
+        "1234.565",
+        "-0.1234565",
+        "99999.95",
+        "0.000",
+        "-1e-120",
+        "1e150",
+        "2.5e-7",
+        "-987654.5",
+    ]
+    map_file = tmp_path / "a.map"
+    with open(map_file, "w") as f:
+        f.write("GRID_PARAMETER_FILE grid.gpf\n")
+        f.write("GRID_DATA_FILE receptor_model.maps.fld\n")
+        f.write("MACROMOLECULE rec.pdbqt\n")
+        f.write("SPACING 0.375\n")
+        f.write("NELEMENTS %d %d %d\n" % (nx - 1, ny - 1, nz - 1))
+        f.write("CENTER 1.000 2.000 3.000\n")
+        f.write("\n".join(values) + "\n")
+    agm = AutoGridMap2DX(str(map_file))
+    for chunk_lines in [1, 4, 65536]:
+        agm.writeDX(str(tmp_path / "a.dx"), chunk_lines=chunk_lines)
+        lines = (tmp_path / "a.dx").read_text().splitlines(keepends=True)
+        body = "".join(lines[11:-5])
+        assert body == baseline_dx_body(map_file, [nx, ny, nz])
+
+
+def test_convert_map_set(tmp_path):
+    maps = []
+    for at in ["C", "e", "d"]:
+        maps.append(write_map(tmp_path / f"rec.{at}.map", [1, 1, 1], range(8)))
+    fld = tmp_path / "rec.maps.fld"
+    fld.write_text(
+        "# AVS field file\nndim=3\n"
+        + "".join(
+            f"variable {i + 1} file=rec.{at}.map filetype=ascii skip=6\n"
+            for i, at in enumerate(["C", "e", "d"])
+        )
+    )
+    assert read_fld_maps(str(fld)) == maps
+    assert collect_maps(str(tmp_path)) == sorted(maps)
+
+    outputs = convert_maps(maps, str(tmp_path / "dx"), compress=True, nprocs=2)
+    assert sorted(Path(p).name for p in outputs) == [
+        "rec.C.dx.gz",
+        "rec.d.dx.gz",
+        "rec.e.dx.gz",
+    ]
+    with gzip.open(tmp_path / "dx" / "rec.C.dx.gz", "rt") as fp:
+        assert "object 1 class gridpositions counts 2 2 2" in fp.read()
@@ -18,7 +18,12 @@ from unittest.mock import mock_open, patch
 import pytest
 import requests
 
-from pautodock.fileutils import download_file, extract_tar_gz, get_bin_path
+from pautodock.fileutils import (
+    download_file,
+    extract_tar_gz,
+    get_bin_path,
+    pautodock_home,
+)
 
 
 def test_get_bin_path_linux_first_path():
@@ -27,6 +32,20 @@ def test_get_bin_path_linux_first_path():
             assert get_bin_path("testbin") == "/usr/bin/"
 
 
+def test_get_bin_path_env_override(tmp_path, monkeypatch):
+    (tmp_path / "testbin").write_text("")
+    monkeypatch.setenv("PAUTODOCK_BIN_PATH", f"/nonexistent:{tmp_path}")
+    with patch("platform.system", return_value="Linux"):
+        assert get_bin_path("testbin") == str(tmp_path)
+
+
+def test_pautodock_home(monkeypatch):
+    monkeypatch.setenv("PAUTODOCK_HOME", "/scratch/pautodock")
+    assert pautodock_home() == "/scratch/pautodock"
+    monkeypatch.delenv("PAUTODOCK_HOME")
+    assert pautodock_home().endswith(".pautodock")
+
+
 def test_get_bin_path_linux_second_path():
     with patch("platform.system", return_value="Linux"):
         with patch("pathlib.Path.exists", side_effect=[False, True]):
@@ -0,0 +1,117 @@
+import random
+
+import pytest
+
+from pautodock import ledger
+from pautodock.adparallel import LigandJob
+from pautodock.funnel import FunnelPipeline, FunnelSelector
+from pautodock.results import ResultsDB
+
+
+class FakeDock:
+    """
+    Vina-only stand-in for the screen and rescore ADParallel.
+    """
+
+    def __init__(self, wpath, energy):
+        self.wpath = wpath
+        self.energy = energy
+        self.atd = False
+        self.vina = True
+        self.prep_batch_size = 1
+        self.vina_batch_size = 1
+        self.ledger = None
+        self.archive = None
+        self.engine = None
+        self.cores = 2
+
+    def ligand_path(self, molname):
+        return f"{self.wpath}/{molname}"
+
+    def prepare_ligand(self, molname, record):
+        mol_pdbqt = f"{self.wpath}/{molname}.pdbqt"
+        with open(mol_pdbqt, "w") as f:
+            f.write(molname)
+        return LigandJob(molname, self.wpath, mol_pdbqt)
+
+    def dock_vina(self, job, ncpu=1):
+        job.vinalog = f"{job.mpath}/vina_log.txt"
+        return job
+
+    def parse_ligand(self, job):
+        e = self.energy(job.molname)
+        return [], [job.molname, e, e, e, 1.0]
+
+    def stage_done(self, molname, stage):
+        # the ledger gives the prepared ligands of late promotions
+        return f"{self.wpath}/{molname}.pdbqt" if stage == ledger.PREPARED else None
+
+    def mark_stage(self, molname, stage, output=None):
+        pass
+
+
+def energies(n):
+    values = [-float(i) for i in range(n)]
+    random.Random(0).shuffle(values)
+    return values
+
+
+def test_selector_fraction():
+    selector = FunnelSelector(fraction=0.1, warmup=10)
+    promoted = [
+        f"m{i}" for i, e in enumerate(energies(100)) if selector.add(f"m{i}", e)
+    ]
+    late = selector.finish()
+    best = sorted(selector.energies, key=selector.energies.get)[:10]
+    assert set(best) <= selector.promoted
+    assert set(late).isdisjoint(promoted)
+    assert 10 <= len(selector.promoted) < 30
+
+
+def test_selector_top():
+    # without the library size only the final selection is promoted
+    selector = FunnelSelector(top=3)
+    assert not any(selector.add(f"m{i}", float(i)) for i in range(50))
+    assert selector.finish() == ["m0", "m1", "m2"]
+    selector = FunnelSelector(top=3, total=50, warmup=5)
+    assert selector.fraction == pytest.approx(0.06)
+    with pytest.raises(ValueError):
+        FunnelSelector(top=3, fraction=0.1)
+
+
+@pytest.mark.parametrize("drift", [1.0, -1.0, -0.05])
+def test_selector_top_keeps_true_top(drift):
+    # worsening, improving and slowly drifting energies with noise
+    rng = random.Random(1)
+    values = [drift * i + rng.gauss(0.0, 20.0) for i in range(2000)]
+    selector = FunnelSelector(top=20, total=2000, warmup=50)
+    early = [f"m{i}" for i, e in enumerate(values) if selector.add(f"m{i}", e)]
+    assert len(early) <= selector.limit == 24
+    late = selector.finish()
+    best = sorted(range(2000), key=values.__getitem__)[:20]
+    assert {f"m{i}" for i in best} <= selector.promoted
+    assert set(late).isdisjoint(early)
+    assert len(selector.promoted) <= 44
+
+
+def test_funnel_pipeline(tmp_path):
+    (tmp_path / "rescore").mkdir()
+    screen_energy = energies(100)
+    screen = FakeDock(str(tmp_path), lambda m: screen_energy[int(m[3:])])
+    rescore = FakeDock(str(tmp_path / "rescore"), lambda m: -100.0 - float(m[3:]))
+    resdb = ResultsDB(tmp_path / "results.sqlite")
+    rescore_db = ResultsDB(tmp_path / "rescore.sqlite")
+    selector = FunnelSelector(fraction=0.1, warmup=20)
+    pipeline = FunnelPipeline(screen, rescore, resdb, rescore_db, selector, cores=2)
+    records = [(f"mol{i}", b"@<TRIPOS>MOLECULE\n") for i in range(100)]
+    pipeline.run(records)
+    assert len(resdb) == 100
+    rescored = {row["molname"] for row in rescore_db.query()}
+    best = sorted(range(100), key=lambda i: screen_energy[i])[:10]
+    assert {f"mol{i}" for i in best} <= rescored
+    assert rescored == selector.promoted
+    assert all(
+        row["vina_min"] == -100.0 - float(row["molname"][3:])
+        for row in rescore_db.query()
+    )
+    assert (tmp_path / "rescore" / f"mol{best[0]}" / f"mol{best[0]}.pdbqt").is_file()
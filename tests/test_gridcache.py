@@ -0,0 +1,84 @@
+from pathlib import Path
+
+import pytest
+
+from pautodock.gridcache import GridMapCache, write_gpf
+
+
+@pytest.fixture
+def rec_pdbqt(tmp_path):
+    rec = tmp_path / "rec.pdbqt"
+    rec.write_text(
+        "ATOM   3511  CA  TYR A1161     -10.160  10.285   7.878  1.00 56.11     0.191 C\n"  # noqa: E501
+        "ATOM   3513  O   TYR A1161      -9.767   9.828  10.203  1.00 63.26    -0.268 OA\n"  # noqa: E501
+    )
+    return str(rec)
+
+
+def fake_autogrid(calls):
+    """
+    Emulate autogrid4 creating every map listed in the gpf.
+    """
+
+    def run(args):
+        gpf = args[1]
+        calls.append(gpf)
+        for line in Path(gpf).read_text().splitlines():
+            key, value = line.split()[:2]
+            if key in ["map", "elecmap", "dsolvmap", "gridfld"]:
+                Path(value).write_text("map\n")
+        return 0
+
+    return run
+
+
+def test_write_gpf(tmp_path, rec_pdbqt):
+    gpf = write_gpf(
+        tmp_path / "grid.gpf",
+        rec_pdbqt,
+        ["C", "OA"],
+        ["C", "N"],
+        [1, 2, 3],
+        [30] * 3,
+        tmp_path,
+    )
+    content = gpf.read_text()
+    assert "npts 30 30 30" in content
+    assert "receptor_types C OA" in content
+    assert "ligand_types C N" in content
+    assert "gridcenter 1.000 2.000 3.000" in content
+    assert f"map {tmp_path}/receptor_model.N.map" in content
+
+
+def test_key_depends_on_grid(tmp_path, rec_pdbqt):
+    a = GridMapCache(tmp_path, rec_pdbqt, ["C"], [0, 0, 0], [30, 30, 30])
+    b = GridMapCache(tmp_path, rec_pdbqt, ["C"], [0, 0, 0], [30, 30, 30])
+    c = GridMapCache(tmp_path, rec_pdbqt, ["C"], [0, 0, 1], [30, 30, 30])
+    assert a.key == b.key
+    assert a.key != c.key
+
+
+def test_ensure_computes_only_missing_types(tmp_path, rec_pdbqt):
+    calls = []
+    cache = GridMapCache(tmp_path / "maps", rec_pdbqt, ["C", "OA"], [0] * 3, [30] * 3)
+    path = cache.ensure(["C", "N", "C"], fake_autogrid(calls))
+    assert len(calls) == 1
+    assert cache.available_types() == ["C", "N"]
+    assert (path / "receptor_model.maps.fld").exists()
+    assert (path / "receptor_model.e.map").exists()
+
+    cache.ensure(["N", "C"], fake_autogrid(calls))
+    assert len(calls) == 1
+
+    cache.ensure(["OA", "C"], fake_autogrid(calls))
+    assert len(calls) == 2
+    assert "ligand_types OA " in Path(calls[-1]).read_text()
+    assert cache.available_types() == ["C", "N", "OA"]
+    assert not list(path.glob("scratch_*"))
+
+
+def test_ensure_failure_keeps_manifest(tmp_path, rec_pdbqt):
+    cache = GridMapCache(tmp_path, rec_pdbqt, ["C"], [0] * 3, [30] * 3)
+    with pytest.raises(RuntimeError):
+        cache.ensure(["C"], lambda args: 1)
+    assert cache.available_types() == []
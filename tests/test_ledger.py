@@ -0,0 +1,38 @@
+import pickle
+
+from pautodock import ledger
+from pautodock.ledger import Ledger
+
+
+def test_mark_and_done(tmp_path):
+    ldg = Ledger(tmp_path / "ledger.sqlite")
+    out = tmp_path / "dock_confs_mol.pdbqt"
+    out.write_text("MODEL 1\n")
+    assert ldg.done("mol", ledger.DOCKED_VINA) is None
+    ldg.mark("mol", ledger.DOCKED_VINA, out)
+    assert ldg.done("mol", ledger.DOCKED_VINA) == str(out)
+    ldg.mark("mol", ledger.PARSED)
+    assert ldg.done("mol", ledger.PARSED) is True
+    assert ldg.completed(ledger.PARSED) == {"mol"}
+    ldg.unmark("mol", ledger.PARSED)
+    assert ldg.completed(ledger.PARSED) == set()
+
+
+def test_changed_output_is_not_done(tmp_path):
+    ldg = Ledger(tmp_path / "ledger.sqlite")
+    out = tmp_path / "ind.dlg"
+    out.write_text("complete\n")
+    ldg.mark("mol", ledger.DOCKED_AUTODOCK, out)
+    out.write_text("partial")
+    assert ldg.done("mol", ledger.DOCKED_AUTODOCK) is None
+    out.unlink()
+    assert ldg.done("mol", ledger.DOCKED_AUTODOCK) is None
+
+
+def test_ledger_survives_pickle_and_reopen(tmp_path):
+    ldg = Ledger(tmp_path / "ledger.sqlite")
+    ldg.mark("mol", ledger.PREPARED)
+    copy = pickle.loads(pickle.dumps(ldg))
+    assert copy.done("mol", ledger.PREPARED) is True
+    ldg.close()
+    assert Ledger(tmp_path / "ledger.sqlite").completed(ledger.PREPARED) == {"mol"}
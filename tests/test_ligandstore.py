@@ -0,0 +1,92 @@
+from pautodock import ligandstore
+from pautodock.adparallel import ADParallel
+from pautodock.ligandstore import LigandStore
+
+RECORD = b"@<TRIPOS>MOLECULE\nmol\n"
+
+
+def fake_batch_topdbqt(calls):
+    def batch_topdbqt(mol2lst, mglpath, tran0=[]):
+        calls.append(len(mol2lst))
+        pdbqtlst = []
+        for mol2 in mol2lst:
+            pdbqt = mol2.replace(".mol2", ".pdbqt")
+            with open(mol2, "rb") as fi, open(pdbqt, "wb") as fo:
+                fo.write(b"REMARK prepared\n" + fi.read())
+            pdbqtlst.append(pdbqt)
+        return pdbqtlst
+
+    return batch_topdbqt
+
+
+def test_key(tmp_path):
+    store = LigandStore(tmp_path, tmp_path)
+    assert store.key(RECORD) == store.key(bytes(RECORD))
+    assert store.key(RECORD) != store.key(RECORD.replace(b"mol", b"lig"))
+    assert store.path(store.key(RECORD)).parent.name == store.key(RECORD)[:2]
+
+
+def test_prepare_and_fetch(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(ligandstore.molop, "batch_topdbqt", fake_batch_topdbqt(calls))
+    store = LigandStore(tmp_path / "ligands", tmp_path)
+    other = RECORD.replace(b"mol", b"lig")
+    assert not store.fetch(RECORD, tmp_path / "out.pdbqt")
+    assert store.prepare_batch([("mol", RECORD), ("lig", other)]) == 2
+    # only the missing ligands are prepared again
+    assert store.prepare_batch([("mol", RECORD), ("lig", other)]) == 0
+    assert calls == [2]
+    assert store.has(RECORD)
+    assert store.fetch(other, tmp_path / "out.pdbqt")
+    assert (tmp_path / "out.pdbqt").read_bytes() == b"REMARK prepared\n" + other
+    assert not list((tmp_path / "ligands").rglob("*.tmp"))
+
+
+class StoreDock:
+    ligand_path = ADParallel.ligand_path
+    ligand_dir = ADParallel.ligand_dir
+    prepare_batch = ADParallel.prepare_batch
+    prepare_from_store = ADParallel.prepare_from_store
+
+    def __init__(self, wpath):
+        self.wpath = wpath
+        self.pack_ligands = False
+        self.ligand_store = LigandStore(f"{wpath}/ligands", wpath)
+        self.atd = False
+        self.cx, self.cy, self.cz = 1.0, 1.0, 1.0
+        self.marked = []
+
+    def prepared_job(self, molname):
+        return None
+
+    def mark_stage(self, molname, stage, output=None):
+        self.marked.append(molname)
+
+
+def test_ligand_dir_keeps_mol2(tmp_path):
+    job, mol2_path = StoreDock(str(tmp_path)).ligand_dir("mol", RECORD)
+    assert job.mpath == str(tmp_path / "mol")
+    assert (tmp_path / "mol" / "mol.mol2").read_bytes() == RECORD
+    assert mol2_path == str(tmp_path / "mol" / "mol.mol2")
+
+
+def test_prepare_batch_bad_record(tmp_path, monkeypatch):
+    atom = b"ATOM      1  C   UNL     1       0.000   1.000   2.000  0.00  0.00    +0.000 C\n"
+
+    def batch_topdbqt(mol2lst, mglpath, tran0=[]):
+        # no coordinates for the bad record
+        pdbqtlst = []
+        for mol2 in mol2lst:
+            pdbqt = mol2.replace(".mol2", ".pdbqt")
+            with open(mol2, "rb") as fi, open(pdbqt, "wb") as fo:
+                fo.write(b"" if b"bad" in fi.read() else atom)
+            pdbqtlst.append(pdbqt)
+        return pdbqtlst
+
+    monkeypatch.setattr(ligandstore.molop, "batch_topdbqt", batch_topdbqt)
+    dock = StoreDock(str(tmp_path))
+    chunk = [("a", RECORD), ("b", b"@<TRIPOS>MOLECULE\nbad\n"), ("c", RECORD + b"c")]
+    jobs = dock.prepare_batch(chunk)
+    assert [job.failed for job in jobs] == [False, True, False]
+    assert jobs[1].mol_pdbqt is None
+    assert dock.marked == ["a", "c"]
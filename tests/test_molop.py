@@ -1,14 +1,19 @@
 import platform
+from pathlib import Path
 from unittest.mock import mock_open, patch
 
 import pytest
 
 from pautodock.molop import (
+    AtomBlock,
     Molecule,
+    MolModel,
     Receptor,
+    batch_topdbqt,
     extract_coordinates,
     get_mol_baricentre,
     nsplit,
+    translate_pdbqt,
 )
 
 
@@ -164,3 +169,114 @@ ATOM      3  N12 ZMA A 401      -8.585  -8.857  54.578  0.00  0.00    +0.000 NA
             result = molecule.topdbqt([1.0, 1.0, 1.0])
             assert result.endswith("test.pdbqt")
             mock_file.assert_called
+
+
+def fake_obabel_split(nout):
+    """
+    Emulate obabel -m writing nout numbered pdbqt files.
+    """
+
+    def call(cmd, shell):
+        if not cmd[0].endswith(" -m"):
+            return 0
+        outdir = cmd[0].split("-O '")[1].split("'")[0].replace("/lig.pdbqt", "")
+        for i in range(nout):
+            Path(f"{outdir}/lig{i + 1}.pdbqt").write_text(f"REMARK  lig{i + 1}\n")
+        return 0
+
+    return call
+
+
+def test_batch_topdbqt(tmp_path):
+    mol2lst = []
+    for name in ["a", "b", "c"]:
+        (tmp_path / f"{name}.mol2").write_text(f"@<TRIPOS>MOLECULE\n{name}\n")
+        mol2lst.append(str(tmp_path / f"{name}.mol2"))
+    with patch("pautodock.molop.get_bin_path", return_value="/usr/bin/"):
+        with patch("subprocess.call", side_effect=fake_obabel_split(3)) as mock_call:
+            pdbqtlst = batch_topdbqt(mol2lst, "/path/to/mgl")
+    mock_call.assert_called_once()
+    assert [Path(p).name for p in pdbqtlst] == ["a.pdbqt", "b.pdbqt", "c.pdbqt"]
+    assert Path(pdbqtlst[1]).read_text() == "REMARK  lig2\n"
+
+
+def test_batch_topdbqt_fallback(tmp_path):
+    mol2lst = []
+    for name in ["a", "b"]:
+        (tmp_path / f"{name}.mol2").write_text(f"@<TRIPOS>MOLECULE\n{name}\n")
+        mol2lst.append(str(tmp_path / f"{name}.mol2"))
+    with patch("pautodock.molop.get_bin_path", return_value="/usr/bin/"):
+        with patch("subprocess.call", side_effect=fake_obabel_split(1)) as mock_call:
+            pdbqtlst = batch_topdbqt(mol2lst, "/path/to/mgl")
+    # one batch run and one run per molecule
+    assert mock_call.call_count == 3
+    assert [Path(p).name for p in pdbqtlst] == ["a.pdbqt", "b.pdbqt"]
+
+
+def test_batch_topdbqt_bad_molecule(tmp_path):
+    mol2lst = []
+    for name in ["a", "bad", "c"]:
+        (tmp_path / f"{name}.mol2").write_text(f"@<TRIPOS>MOLECULE\n{name}\n")
+        mol2lst.append(str(tmp_path / f"{name}.mol2"))
+    atom = "ATOM      1  C   UNL     1       0.000   1.000   2.000  0.00  0.00    +0.000 C\n"
+
+    def call(cmd, shell):
+        # the batch run fails, and so does the bad molecule alone
+        out = cmd[0].split("-O '")[1].split("'")[0]
+        if not cmd[0].endswith(" -m") and Path(out).name != "bad.pdbqt":
+            Path(out).write_text(atom)
+        return 0
+
+    with patch("pautodock.molop.get_bin_path", return_value="/usr/bin/"):
+        with patch("subprocess.call", side_effect=call):
+            pdbqtlst = batch_topdbqt(mol2lst, "/path/to/mgl", [1.0, 1.0, 1.0])
+    assert [p and Path(p).name for p in pdbqtlst] == ["a.pdbqt", None, "c.pdbqt"]
+
+
+def test_mol_model_pdb():
+    model = MolModel.from_file("data/3EML/ligand.pdb")
+    assert len(model.atom_types) == 25
+    assert model.unique_types == ["C", "O", "N"]
+    assert model.centroid == pytest.approx([-9.06364, -7.1446, 55.8626])
+    bmin, bmax = model.bbox
+    assert (bmin <= model.coords).all() and (model.coords <= bmax).all()
+
+
+def test_mol_model_is_read_only():
+    model = MolModel.from_file("data/3EML/ligand.pdbqt")
+    assert model.centroid == pytest.approx([-9.06364, -7.1446, 55.8626])
+    with pytest.raises(ValueError):
+        model.coords[0, 0] = 0.0
+    with pytest.raises(AttributeError):
+        model.path = "other.pdbqt"
+
+
+PDBQT = (
+    "REMARK  test ligand\n"
+    "ATOM      1  C   LIG A   1       1.000   2.000   3.000  0.00  0.00    +0.120 C \n"
+    "ATOM      2  N   LIG A   1       3.000   4.000   5.000  0.00  0.00    -0.340 N \n"
+    "TORSDOF 0\n"
+)
+
+
+def test_atom_block(tmp_path):
+    fpdbqt = tmp_path / "lig.pdbqt"
+    fpdbqt.write_text(PDBQT)
+    block = AtomBlock.read(str(fpdbqt))
+    assert len(block) == 2
+    assert block.types.tolist() == ["C", "N"]
+    assert block.charges.tolist() == pytest.approx([0.12, -0.34])
+    assert block.centroid() == pytest.approx([2.0, 3.0, 4.0])
+
+
+def test_translate_pdbqt(tmp_path):
+    fpdbqt = tmp_path / "lig.pdbqt"
+    fpdbqt.write_text(PDBQT)
+    translate_pdbqt(str(fpdbqt), [10.0, 0.0, -1.5])
+    lines = fpdbqt.read_text().splitlines()
+    assert lines[0] == "REMARK  test ligand"
+    assert lines[1][30:54] == "   9.000  -1.000  -2.500"
+    assert lines[2][30:54] == "  11.000   1.000  -0.500"
+    assert lines[1][54:] == PDBQT.splitlines()[1][54:]
+    assert lines[3] == "TORSDOF 0"
+    assert get_mol_baricentre(str(fpdbqt)) == pytest.approx([10.0, 0.0, -1.5])
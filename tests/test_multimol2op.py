@@ -1,8 +1,15 @@
+import multiprocessing
 import shutil
 from pathlib import Path
 from unittest.mock import mock_open, patch
 
-from pautodock.multimol2op import read_molname, split_mol2
+from pautodock.multimol2op import (
+    Mol2Index,
+    iter_mol2,
+    read_molname,
+    split_mol2,
+    unique_name,
+)
 
 
 def test_read_molname():
@@ -34,3 +41,80 @@ def test_split_mol2():
     assert len(res) == 2
     for item in res:
         assert "Water.mol2" in item or "Methane.mol2" in item
+
+
+def test_iter_mol2():
+    records = list(iter_mol2("data/example.mol2"))
+    assert [name for name, _ in records] == ["Methane", "Water"]
+    assert records[1][1].startswith(b"@<TRIPOS>MOLECULE\nWater\n")
+    assert records[0][1].count(b"@<TRIPOS>MOLECULE") == 1
+
+
+def test_iter_mol2_duplicated_names(tmp_path):
+    mmol2 = tmp_path / "dup.mol2"
+    mmol2.write_text("@<TRIPOS>MOLECULE\nA\n" * 3 + "@<TRIPOS>MOLECULE\nA_1\n")
+    names = [name for name, _ in iter_mol2(str(mmol2))]
+    assert names == ["A", "A_1", "A_2", "A_1_1"]
+
+
+def test_unique_name():
+    seen = {}
+    assert unique_name("X", seen) == "X"
+    assert unique_name("X", seen) == "X_1"
+    assert unique_name("X_2", seen) == "X_2"
+    assert unique_name("X", seen) == "X_3"
+    assert unique_name("", seen) == "unnamed"
+
+
+def write_library(path, n):
+    with open(path, "w") as f:
+        for i in range(n):
+            name = "Dup" if i % 5 == 0 else f"Mol{i}"
+            f.write(f"@<TRIPOS>MOLECULE\n{name}\n {i + 1} {i} 0 0 0\nSMALL\n")
+            f.write("@<TRIPOS>ATOM\n")
+    return str(path)
+
+
+def test_mol2_index_matches_stream(tmp_path):
+    db = write_library(tmp_path / "lib.mol2", 20)
+    index = Mol2Index(db)
+    assert Path(db + ".idx").exists()
+    assert len(index) == 20
+    assert list(index.iter_records()) == list(iter_mol2(db))
+    assert index.entry(3)[2:] == (4, 3)
+    index.close()
+
+
+def test_mol2_index_select(tmp_path):
+    db = write_library(tmp_path / "lib.mol2", 20)
+    index = Mol2Index(db)
+    assert index.select(start=15) == [15, 16, 17, 18, 19]
+    assert index.select(start=2, stop=8) == [2, 3, 4, 5, 6, 7]
+    shards = [index.select(shard=k, nshards=3) for k in range(3)]
+    assert sum(shards, []) == list(range(20))
+    sample = index.select(sample=5, seed=1)
+    assert len(sample) == 5
+    assert sample == index.select(sample=5, seed=1)
+    assert index.name(5) == "Dup_1"
+    index.close()
+
+
+def test_mol2_index_rebuilt_when_stale(tmp_path):
+    db = write_library(tmp_path / "lib.mol2", 4)
+    Mol2Index(db).close()
+    write_library(tmp_path / "lib.mol2", 6)
+    index = Mol2Index(db)
+    assert len(index) == 6
+    index.close()
+
+
+def index_size(db):
+    with Mol2Index(db) as index:
+        return len(index)
+
+
+def test_mol2_index_concurrent_builds(tmp_path):
+    db = write_library(tmp_path / "lib.mol2", 200)
+    with multiprocessing.Pool(4) as pool:
+        assert pool.map(index_size, [db] * 8) == [200] * 8
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["lib.mol2", "lib.mol2.idx"]
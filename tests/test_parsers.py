@@ -0,0 +1,84 @@
+import pytest
+
+from pautodock import parsers
+
+VINA_TABLE = (
+    "mode |   affinity | dist from best mode\n"
+    "     | (kcal/mol) | rmsd l.b.| rmsd u.b.\n"
+    "-----+------------+----------+----------\n"
+    "   1       -9.317          0          0\n"
+    "   2       -8.823      3.083      9.394\n"
+    "   3       -8.819      2.787      9.676\n"
+)
+
+DLG = (
+    "    Estimated Free Energy of Binding    =   -6.52 kcal/mol\n"
+    "\tPartition function, Q =     1.23e+04   at Temperature, T = 298.15 K\n"
+    "\tFree energy,        A ~  -5580.1 kcal/mol\n"
+    "\tInternal energy,    U =  -6.73 kcal/mol\n"
+    "\tEntropy,            S =  0.0041 kcal/mol/K\n"
+    "      1      1      7       -6.52      0.00     31.20           RANKING\n"
+    "      1      2      3       -6.40      0.88     31.05           RANKING\n"
+    "      2      1      5       -5.10      0.00     28.40           RANKING\n"
+)
+
+
+def test_read_vina_log(tmp_path):
+    log = tmp_path / "vina_log.txt"
+    # a log holding two runs: every score table is read
+    log.write_text(
+        "AutoDock Vina\n" + VINA_TABLE + "Writing output ... done.\n" + VINA_TABLE
+    )
+    poses = parsers.read_vina_log(log)
+    assert len(poses) == 6
+    assert poses[1] == parsers.VinaPose(2, -8.823, 3.083, 9.394)
+    avg, emin, emax = parsers.energy_stats(poses)
+    assert avg == pytest.approx(-8.986)
+    assert (emin, emax) == (-9.317, -8.819)
+
+
+def test_vina_remarks(tmp_path):
+    text = (
+        "MODEL 1\nREMARK VINA RESULT:    -7.5      0.000      0.000\nENDMDL\n"
+        "MODEL 2\nREMARK VINA RESULT:    -6.9      1.846      2.712\nENDMDL\n"
+    )
+    poses = tmp_path / "dock_confs_A.pdbqt"
+    poses.write_text(text)
+    assert parsers.read_vina_poses(poses) == parsers.vina_remarks(text)
+    assert parsers.vina_remarks(text)[1] == parsers.VinaPose(2, -6.9, 1.846, 2.712)
+
+
+def test_read_dlg(tmp_path):
+    dlg = tmp_path / "ind.dlg"
+    dlg.write_text(DLG)
+    res = parsers.read_dlg(dlg)
+    assert [p.run for p in res.rankings] == [7, 3, 5]
+    header, r = res.summary()
+    assert header == [
+        "Part. Func.",
+        "Free Energy",
+        "Internal Energy",
+        "Entropy",
+        "Binding Energy Average",
+        "Cluster RMSD Average",
+        "Ref. RMSD Average",
+    ]
+    assert r[:4] == ["1.23e+04", "-5580.1", "-6.73", "0.0041"]
+    assert r[4] == pytest.approx(-6.007, abs=1e-3)
+
+
+def test_dlg_without_rankings(tmp_path):
+    dlg = tmp_path / "ind.dlg"
+    dlg.write_text(DLG.split("      1      1")[0])
+    header, r = parsers.read_dlg(dlg).summary()
+    assert "Binding Energy Average" not in header
+    assert len(header) == len(r) == 4
+
+
+def test_empty_files(tmp_path):
+    empty = tmp_path / "empty.txt"
+    empty.write_text("")
+    assert parsers.read_vina_log(empty) == []
+    assert parsers.read_vina_poses(empty) == []
+    assert parsers.read_dlg(empty).summary() == ([], [])
+    assert parsers.energy_stats([]) is None
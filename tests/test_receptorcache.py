@@ -0,0 +1,63 @@
+import pytest
+
+from pautodock import receptorcache
+from pautodock.receptorcache import ReceptorCache
+
+
+def fake_receptor(calls, output=b"ATOM prepared\n"):
+    class Receptor(object):
+        def __init__(self, receptor, mglpath, flags=()):
+            self.receptor = receptor
+            self.flags = list(flags)
+
+        def topdbqt(self, pdbqt=None):
+            calls.append((self.receptor, self.flags))
+            with open(pdbqt, "wb") as f:
+                f.write(output)
+            return pdbqt
+
+    return Receptor
+
+
+def test_key(tmp_path):
+    rec = tmp_path / "rec.pdb"
+    rec.write_text("ATOM 1\n")
+    cache = ReceptorCache(tmp_path / "receptors")
+    assert cache.key(rec) == cache.key(str(rec))
+    assert cache.key(rec) != cache.key(rec, ["-A", "hydrogens"])
+    other = tmp_path / "other.pdb"
+    other.write_text("ATOM 2\n")
+    assert cache.key(rec) != cache.key(other)
+
+
+def test_prepare(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(receptorcache.molop, "Receptor", fake_receptor(calls))
+    rec = tmp_path / "inputs" / "rec.pdb"
+    rec.parent.mkdir()
+    rec.write_text("ATOM 1\n")
+    rec.parent.chmod(0o555)
+    try:
+        cache = ReceptorCache(tmp_path / "receptors")
+        pdbqt = cache.prepare(str(rec), "/path/to/mgl")
+        assert pdbqt == str(cache.path(cache.key(rec)))
+        assert open(pdbqt, "rb").read() == b"ATOM prepared\n"
+        # prepared once, nothing written next to the input
+        assert cache.prepare(str(rec), "/path/to/mgl") == pdbqt
+        assert len(calls) == 1
+        assert sorted(p.name for p in rec.parent.iterdir()) == ["rec.pdb"]
+    finally:
+        rec.parent.chmod(0o755)
+
+
+def test_prepare_failure(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(receptorcache.molop, "Receptor", fake_receptor(calls, b""))
+    rec = tmp_path / "rec.pdb"
+    rec.write_text("ATOM 1\n")
+    cache = ReceptorCache(tmp_path / "receptors")
+    with pytest.raises(RuntimeError):
+        cache.prepare(str(rec), "/path/to/mgl")
+    # nothing published, nothing left behind
+    key = cache.key(rec)
+    assert [p.name for p in cache.path(key).parent.iterdir()] == [".lock"]
@@ -0,0 +1,59 @@
+import shutil
+
+from pautodock.__recover_output__ import ligand_dirs, recover
+from pautodock.archive import ShardArchive
+from pautodock.parsers import VinaPose
+from pautodock.results import ResultsDB
+
+
+class FakeDock:
+    def __init__(self, wpath, archive=None):
+        self.wpath = wpath
+        self.archive = archive
+
+    def recover_ligand(self, mpath):
+        with open(f"{mpath}/vina_log.txt") as f:
+            energy = float(f.read())
+        molname = mpath.rsplit("/", 1)[-1]
+        poses = [VinaPose(1, energy, 0.0, 0.0)]
+        return [], [molname, energy, energy, energy, 1.0], poses, None
+
+
+def test_recover(tmp_path):
+    for i in range(20):
+        (tmp_path / f"mol{i}").mkdir()
+        (tmp_path / f"mol{i}" / "vina_log.txt").write_text(str(-float(i)))
+    (tmp_path / "ledger.sqlite").write_text("")
+    assert len(list(ligand_dirs(tmp_path))) == 20
+    resdb = ResultsDB(tmp_path / "results.sqlite")
+    assert recover(FakeDock(str(tmp_path)), resdb, cores=2, chunksize=3) == 20
+    assert len(resdb) == 20
+    assert list(resdb.query(order_by="vina_min", limit=1))[0]["molname"] == "mol19"
+    assert [p["energy"] for p in resdb.poses("mol4")] == [-4.0]
+    resdb.close()
+
+
+def test_recover_fanout_and_archive(tmp_path):
+    archive = ShardArchive(tmp_path / "archive")
+    packed = []
+    for i in range(6):
+        mpath = tmp_path / "ligands" / f"{i:02x}" / "00" / f"mol{i}"
+        mpath.mkdir(parents=True)
+        (mpath / "vina_log.txt").write_text(str(-float(i)))
+        if i % 2:
+            packed.append((f"mol{i}", str(mpath)))
+    archive.add(packed)
+    for _, mpath in packed:
+        shutil.rmtree(mpath)
+    assert len(list(ligand_dirs(tmp_path))) == 3
+    dock = FakeDock(str(tmp_path), archive)
+    dock.recover_archived = lambda molname: (
+        [],
+        [molname, -1.0, -1.0, -1.0, 1.0],
+        [VinaPose(1, float(archive.read(molname, "vina_log.txt")), 0.0, 0.0)],
+        None,
+    )
+    resdb = ResultsDB(tmp_path / "results.sqlite")
+    assert recover(dock, resdb, cores=2, chunksize=2) == 6
+    assert [p["energy"] for p in resdb.poses("mol5")] == [-5.0]
+    resdb.close()
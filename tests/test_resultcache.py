@@ -0,0 +1,104 @@
+import pickle
+from pathlib import Path
+
+import pytest
+
+from pautodock.adparallel import ADParallel, LigandJob
+from pautodock.resultcache import ResultCache, make_key, pdbqt_digest
+from pautodock.runner import RunResult
+
+
+def test_pdbqt_digest(tmp_path):
+    a = tmp_path / "a.pdbqt"
+    b = tmp_path / "b.pdbqt"
+    atom = "ATOM      1  C   UNL     1       0.000   1.000   2.000  0.00  0.00    +0.000 C\n"
+    a.write_text("REMARK  Name = mol_a\n" + atom)
+    b.write_text("REMARK  Name = mol_b\n" + atom.rstrip() + "   \n")
+    assert pdbqt_digest(a) == pdbqt_digest(b)
+    b.write_text(atom.replace("2.000", "2.001"))
+    assert pdbqt_digest(a) != pdbqt_digest(b)
+    assert make_key("vina", 8) != make_key("vina8")
+
+
+def test_put_get(tmp_path):
+    cache = ResultCache(tmp_path / "results", 1 << 20)
+    assert cache.get("k") is None
+    cache.put("k", "vina", {"poses": "MODEL 1\n", "log": "mode |\n"})
+    assert cache.get("k") == {"poses": "MODEL 1\n", "log": "mode |\n"}
+    # a copy shipped to a worker reopens its own connection
+    copy = pickle.loads(pickle.dumps(cache))
+    assert copy._conn is None
+    assert copy.get("k")["poses"] == "MODEL 1\n"
+    assert len(cache) == 1
+
+
+def test_lru_eviction(tmp_path):
+    cache = ResultCache(tmp_path / "results", 0)
+    for i in range(5):
+        cache.put(f"k{i}", "vina", {"poses": str(i) * 100})
+    size = cache.size() // 5
+    cache.get("k0")
+    cache.max_size = 3 * size
+    cache.evict()
+    # the least recently used entries go first, down to the low water mark
+    assert cache.get("k0") is not None
+    assert cache.get("k1") is None
+    assert cache.size() <= 0.9 * cache.max_size + size
+    assert len(cache) == 2
+
+
+class BatchDock:
+    """
+    Stand-in for ADParallel running a vina batch that writes its outputs
+    and then exits with the given status.
+    """
+
+    dock_vina_batch = ADParallel.dock_vina_batch
+    run_failed = ADParallel.run_failed
+
+    def __init__(self, wpath, returncode, timed_out=False):
+        self.wpath = wpath
+        self.returncode = returncode
+        self.timed_out = timed_out
+        self.engine = None
+        self.ledger = None
+        self.vina_conf = f"{wpath}/vina_conf.txt"
+        self.rec_pdbqt = f"{wpath}/rec.pdbqt"
+        self.stored = []
+        self.single = []
+
+    def stage_done(self, molname, stage):
+        return None
+
+    def restore_vina(self, job):
+        return False
+
+    def RunVina(self, args, log=None):
+        bpath = Path(args[args.index("--dir") + 1])
+        for i, arg in enumerate(args):
+            if arg == "--batch":
+                out = bpath / f"{Path(args[i + 1]).stem}_out.pdbqt"
+                out.write_text("REMARK VINA RESULT:    -9.0      0.000      0.000\n")
+        return RunResult("vina", self.returncode, 3.0, 3.0, 0.0, 0, self.timed_out)
+
+    def dock_vina(self, job, ncpu=1):
+        self.single.append(job.molname)
+        return job
+
+    def store_result(self, job, program, **files):
+        self.stored.append(job.molname)
+
+
+@pytest.mark.parametrize("returncode,timed_out", [(1, False), (-9, True)])
+def test_failed_vina_batch_not_cached(tmp_path, returncode, timed_out):
+    dock = BatchDock(str(tmp_path), returncode, timed_out)
+    jobs = [
+        LigandJob(f"mol{i}", str(tmp_path), str(tmp_path / f"mol{i}.pdbqt"))
+        for i in range(3)
+    ]
+    assert dock.dock_vina_batch(jobs) == jobs
+    assert dock.stored == []
+    # the ligands are docked again one at a time
+    assert dock.single == ["mol0", "mol1", "mol2"]
+    assert all(job.metrics[0]["program"] == "vina-batch" for job in jobs)
+    assert not list(tmp_path.glob("vina_batch_*"))
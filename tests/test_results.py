@@ -0,0 +1,123 @@
+from pautodock.parsers import DLGRanking, DLGResult, VinaPose
+from pautodock.results import ResultsDB, is_results_db
+
+AD_HEADER = ["Free Energy", "Binding Energy Average"]
+
+
+def test_add_and_query(tmp_path):
+    resdb = ResultsDB(tmp_path / "results.sqlite", commit_every=2)
+    resdb.add([], ["A", -7.0, -8.0, -6.0, 1.5])
+    resdb.add(AD_HEADER, ["B", -5.5, -6.1, -9.0, -9.5, -8.0, 0.5])
+    resdb.add([], ["C", -8.0, -8.5, -7.5, 2.0])
+    assert len(resdb) == 3
+    assert resdb.has("B")
+    assert not resdb.has("D")
+    best = [r["molname"] for r in resdb.query(order_by="vina_min")]
+    assert best == ["B", "C", "A"]
+    b = list(resdb.query(where="molname = ?", params=("B",)))[0]
+    assert b["ad_free_energy"] == -5.5
+    assert b["ad_binding_energy_avg"] == -6.1
+    assert list(resdb.query(limit=1))[0]["molname"] == "A"
+    resdb.close()
+
+
+def test_rows_visible_while_screening(tmp_path):
+    writer = ResultsDB(tmp_path / "results.sqlite", commit_every=1)
+    writer.add([], ["A", -7.0, -8.0, -6.0, 1.5])
+    reader = ResultsDB(tmp_path / "results.sqlite")
+    assert len(reader) == 1
+    writer.close()
+    reader.close()
+
+
+def test_export(tmp_path):
+    resdb = ResultsDB(tmp_path / "results.sqlite")
+    resdb.add([], ["A", -7.0, -8.0, -6.0, 1.5])
+    resdb.export(tmp_path / "out.csv")
+    lines = (tmp_path / "out.csv").read_text().splitlines()
+    assert lines[0].startswith("Molname;Avg. vina Binding Energy;")
+    assert lines[1] == "A;-7.000000;-8.000000;-6.000000;1.500000"
+
+    resdb.add(AD_HEADER, ["B", -5.5, -6.1, -9.0, -9.5, -8.0, 0.5])
+    resdb.export(tmp_path / "out.tsv", order_by="vina_min")
+    lines = (tmp_path / "out.tsv").read_text().splitlines()
+    assert lines[0].split("\t")[:3] == [
+        "Molname",
+        "Free Energy",
+        "Binding Energy Average",
+    ]
+    assert lines[1].split("\t")[:3] == ["B", "-5.5", "-6.1"]
+    assert lines[2].split("\t")[:3] == ["A", "", ""]
+    resdb.close()
+
+
+def test_export_library(tmp_path):
+    resdb = ResultsDB(tmp_path / "results.sqlite")
+    # an earlier screen of another library
+    resdb.add([], ["old", -9.0, -9.0, -9.0, 1.0])
+    resdb.clear_library()
+    for idx, molname in [(0, "B"), (1, "A")]:
+        resdb.add_library(idx, molname)
+    resdb.add([], ["A", -7.0, -8.0, -6.0, 1.5])
+    resdb.add([], ["B", -6.0, -7.0, -5.0, 1.5])
+    resdb.export(tmp_path / "out.csv")
+    lines = (tmp_path / "out.csv").read_text().splitlines()
+    assert [line.split(";")[0] for line in lines[1:]] == ["B", "A"]
+
+    shard = ResultsDB(tmp_path / "shard.sqlite")
+    shard.add_library(2, "C")
+    shard.add([], ["C", -5.0, -5.0, -5.0, 1.0])
+    shard.close()
+    resdb.merge(tmp_path / "shard.sqlite")
+    resdb.export(tmp_path / "out.csv", order_by="vina_min")
+    lines = (tmp_path / "out.csv").read_text().splitlines()
+    assert [line.split(";")[0] for line in lines[1:]] == ["A", "B", "C"]
+
+    resdb.clear_library()
+    assert len(list(resdb.query(library=resdb.has_library()))) == 4
+    resdb.close()
+
+
+def test_is_results_db():
+    assert is_results_db("out.sqlite")
+    assert is_results_db("out.db")
+    assert not is_results_db("out.csv")
+
+
+def test_metrics(tmp_path):
+    resdb = ResultsDB(tmp_path / "results.sqlite")
+    job = {
+        "program": "vina",
+        "returncode": 0,
+        "wall": 10.0,
+        "user": 35.0,
+        "sys": 1.0,
+        "maxrss": 2048,
+        "timed_out": False,
+    }
+    resdb.add_metrics("A", [job, dict(job, program="autodock4", user=5.0)])
+    resdb.add_metrics("B", [dict(job, user=100.0, timed_out=True)])
+    cost = list(resdb.cost())
+    assert [c["molname"] for c in cost] == ["B", "A"]
+    assert cost[1]["cpu"] == 42.0
+    assert cost[0]["timeouts"] == 1
+    # metrics of a ligand are replaced when it is docked again
+    resdb.add_metrics("A", [job])
+    assert list(resdb.cost(limit=2))[1]["cpu"] == 36.0
+    resdb.close()
+
+
+def test_poses(tmp_path):
+    vina = [VinaPose(1, -9.3, 0.0, 0.0), VinaPose(2, -8.8, 3.083, 9.394)]
+    dlg = DLGResult(rankings=[DLGRanking(1, 1, 7, -6.5, 0.0, 31.2)])
+    resdb = ResultsDB(tmp_path / "a.sqlite")
+    resdb.add_poses("A", vina, dlg)
+    resdb.add_poses("A", vina[:1])
+    assert [p["energy"] for p in resdb.poses("A")] == [-9.3]
+    assert [p["run"] for p in resdb.poses("A", "autodock")] == [7]
+    resdb.close()
+    merged = ResultsDB(tmp_path / "b.sqlite")
+    merged.merge(tmp_path / "a.sqlite")
+    assert len(list(merged.poses("A"))) == 1
+    assert len(list(merged.poses("A", "autodock"))) == 1
+    merged.close()
@@ -0,0 +1,29 @@
+import sys
+
+from pautodock.runner import run
+
+
+def test_run_captures_output():
+    res = run([sys.executable, "-c", "print('hello')"])
+    assert res.returncode == 0
+    assert res.output == b"hello\n"
+    assert res.program == "python" or res.program.startswith("python")
+    assert res.wall > 0
+    assert res.maxrss > 0
+    assert not res.timed_out
+
+
+def test_run_writes_log(tmp_path):
+    log = tmp_path / "log.txt"
+    res = run([sys.executable, "-c", "import sys; sys.exit(3)"], log)
+    assert res.returncode == 3
+    assert log.exists()
+    assert res.output == b""
+
+
+def test_run_timeout():
+    res = run([sys.executable, "-c", "import time; time.sleep(30)"], timeout=0.5)
+    assert res.timed_out
+    assert res.returncode < 0
+    assert res.wall < 10
+    assert "output" not in res.metrics()
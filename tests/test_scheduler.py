@@ -0,0 +1,305 @@
+import os
+
+import pytest
+
+from pautodock.adparallel import ADParallel, LigandJob, ScreeningPipeline
+from pautodock.archive import ShardArchive
+from pautodock.parsers import VinaPose
+from pautodock.results import ResultsDB
+from pautodock.scheduler import Scheduler, Task
+
+
+class Worker:
+    def square(self, x, ncpu=1):
+        return x * x
+
+    def fail(self, x):
+        raise ValueError(x)
+
+    def die(self, x):
+        os._exit(1)
+
+
+class FakeGridMaps:
+    def available_types(self):
+        return ["C"]
+
+
+class FakeDock:
+    """
+    Stand-in for ADParallel recording the stages of each ligand.
+    """
+
+    def __init__(self, wpath):
+        self.wpath = wpath
+        self.atd = True
+        self.vina = True
+        self.gridmaps = FakeGridMaps()
+        self.prep_batch_size = 1
+        self.vina_batch_size = 1
+        self.ledger = None
+        self.archive = None
+        self.engine = None
+
+    def ligand_path(self, molname):
+        return f"{self.wpath}/{molname}"
+
+    def prepare_ligand(self, molname, record):
+        return LigandJob(molname, self.ligand_path(molname), lat_lst=["C", "N"])
+
+    def build_grid(self, lat_lst):
+        return lat_lst
+
+    def dock_autodock(self, job):
+        job.dlg = "ind.dlg"
+        return job
+
+    def dock_vina(self, job, ncpu=1):
+        job.vinalog = "vina_log.txt"
+        job.vina_poses = [VinaPose(1, -9.0, 0.0, 0.0), VinaPose(2, -7.0, 1.2, 2.5)]
+        return job
+
+    def dock_vina_batch(self, jobs, ncpu=1):
+        return [self.dock_vina(job, ncpu) for job in jobs]
+
+    def parse_ligand(self, job):
+        row = [job.molname, -1.0, -8.0, -9.0, -7.0, 1.0]
+        if job.dlg is None or job.vinalog is None:
+            row = [job.molname, 9999.0, 9999.0, 9999.0, 9999.0, 9999.0]
+        return ["Binding Energy Average"], row
+
+
+def test_scheduler_runs_chained_tasks():
+    sched = Scheduler(Worker(), cores=2)
+    results = []
+
+    def chain(result):
+        if result < 100:
+            sched.submit(Task("square", (result,), chain))
+
+    for task, result in sched.run([Task("square", (x,), chain) for x in [2, 3]]):
+        results.append(result)
+    assert sorted(results) == [4, 9, 16, 81, 256, 6561]
+    assert sched.inflight == 0
+
+
+def test_scheduler_collects_failures():
+    sched = Scheduler(Worker(), cores=2)
+    tasks = [Task("square", (2,)), Task("fail", (3,))]
+    results = [result for _, result in sched.run(tasks)]
+    assert results == [4]
+    assert len(sched.failed) == 1
+    assert isinstance(sched.failed[0][1], ValueError)
+
+
+def test_scheduler_worker_dies():
+    sched = Scheduler(Worker(), cores=2)
+    tasks = [Task("square", (2,)), Task("die", (3,))]
+    with pytest.raises(RuntimeError, match="died"):
+        list(sched.run(tasks))
+
+
+def test_scheduler_calls_otherwise():
+    sched = Scheduler(Worker(), cores=2)
+    failed = []
+    tasks = [Task("fail", (3,), otherwise=failed.append)]
+    assert list(sched.run(tasks)) == []
+    assert failed == [3]
+
+
+def test_screening_pipeline(tmp_path):
+    records = [(f"mol{i}", b"@<TRIPOS>MOLECULE\n") for i in range(5)]
+    resdb = ResultsDB(tmp_path / "results.sqlite")
+    pipeline = ScreeningPipeline(FakeDock(str(tmp_path)), resdb, cores=2)
+    pipeline.run(records)
+    rows = list(resdb.query(order_by="molname"))
+    assert [row["molname"] for row in rows] == [f"mol{i}" for i in range(5)]
+    for row in rows:
+        assert row["ad_binding_energy_avg"] == -1.0
+        assert row["vina_min"] == -9.0
+    assert pipeline.grid_ready == {"C", "N"}
+    assert not pipeline.grid_waiting
+    assert [p["energy"] for p in resdb.poses("mol0")] == [-9.0, -7.0]
+
+
+class GridFailDock(FakeDock):
+    def build_grid(self, lat_lst):
+        raise RuntimeError("autogrid failed")
+
+
+def test_screening_pipeline_grid_fails(tmp_path):
+    records = [(f"mol{i}", b"@<TRIPOS>MOLECULE\n") for i in range(5)]
+    resdb = ResultsDB(tmp_path / "results.sqlite")
+    pipeline = ScreeningPipeline(GridFailDock(str(tmp_path)), resdb, cores=2)
+    pipeline.run(records)
+    # the ligands waiting for the maps still get a row
+    rows = list(resdb.query(order_by="molname"))
+    assert [row["molname"] for row in rows] == [f"mol{i}" for i in range(5)]
+    assert all(row["ad_binding_energy_avg"] == 9999.0 for row in rows)
+    assert not pipeline.grid_waiting
+    assert pipeline.sched.failed
+
+
+class PackingDock(FakeDock):
+    ligand_path = ADParallel.ligand_path
+    pack = ADParallel.pack
+
+    def __init__(self, wpath):
+        super().__init__(wpath)
+        self.archive = ShardArchive(f"{wpath}/archive")
+        self.pack_ligands = True
+        self.pack_batch_size = 2
+
+    def prepare_ligand(self, molname, record):
+        job = super().prepare_ligand(molname, record)
+        job.mpath = self.ligand_path(molname)
+        os.makedirs(job.mpath)
+        with open(f"{job.mpath}/{molname}.pdbqt", "w") as f:
+            f.write(molname)
+        return job
+
+
+def test_screening_pipeline_packs(tmp_path):
+    records = [(f"mol{i}", b"@<TRIPOS>MOLECULE\n") for i in range(5)]
+    resdb = ResultsDB(tmp_path / "results.sqlite")
+    dock = PackingDock(str(tmp_path))
+    pipeline = ScreeningPipeline(dock, resdb, cores=2)
+    pipeline.run(records)
+    assert len(resdb) == 5
+    assert not pipeline.packing
+    assert dock.archive.molnames() == [f"mol{i}" for i in range(5)]
+    assert dock.archive.read("mol3", "mol3.pdbqt") == b"mol3"
+    assert not any((tmp_path / f"mol{i}").exists() for i in range(5))
+    assert os.listdir(tmp_path / "ligands") == []
+
+
+def test_screening_pipeline_batches(tmp_path):
+    dock = FakeDock(str(tmp_path))
+    dock.prep_batch_size = 2
+    records = [(f"mol{i}", b"@<TRIPOS>MOLECULE\n") for i in range(5)]
+    pipeline = ScreeningPipeline(dock, ResultsDB(tmp_path / "r.sqlite"), cores=2)
+    tasks = list(pipeline.tasks(records))
+    assert [task.method for task in tasks] == ["prepare_batch"] * 3
+    assert [len(task.args[0]) for task in tasks] == [2, 2, 1]
+
+
+class BadRecordDock(FakeDock):
+    def prepare_batch(self, chunk):
+        jobs = [self.prepare_ligand(molname, record) for molname, record in chunk]
+        for job, (_, record) in zip(jobs, chunk):
+            job.failed = record == b"bad"
+        return jobs
+
+
+def test_screening_pipeline_bad_record_in_batch(tmp_path):
+    dock = BadRecordDock(str(tmp_path))
+    dock.prep_batch_size = 3
+    records = [(f"mol{i}", b"@<TRIPOS>MOLECULE\n") for i in range(5)]
+    records[1] = ("mol1", b"bad")
+    resdb = ResultsDB(tmp_path / "results.sqlite")
+    pipeline = ScreeningPipeline(dock, resdb, cores=2)
+    pipeline.run(records)
+    rows = {row["molname"]: row for row in resdb.query()}
+    assert sorted(rows) == [f"mol{i}" for i in range(5)]
+    assert rows["mol1"]["vina_min"] == 9999.0
+    assert rows["mol2"]["vina_min"] == -9.0
+
+
+class FailingDock(FakeDock):
+    """
+    Every stage raises for one ligand: mol1 is not prepared, mol2 fails
+    vina and mol3 fails AutoDock.
+    """
+
+    def prepare_ligand(self, molname, record):
+        if molname == "mol1":
+            raise RuntimeError("obabel failed")
+        return super().prepare_ligand(molname, record)
+
+    def dock_vina(self, job, ncpu=1):
+        if job.molname == "mol2":
+            raise RuntimeError("vina failed")
+        return super().dock_vina(job, ncpu)
+
+    def dock_autodock(self, job):
+        if job.molname == "mol3":
+            raise RuntimeError("autodock failed")
+        return super().dock_autodock(job)
+
+
+def test_screening_pipeline_failed_stages(tmp_path, caplog):
+    records = [(f"mol{i}", b"@<TRIPOS>MOLECULE\n") for i in range(5)]
+    resdb = ResultsDB(tmp_path / "results.sqlite")
+    pipeline = ScreeningPipeline(FailingDock(str(tmp_path)), resdb, cores=2)
+    pipeline.run(records)
+    rows = {row["molname"]: row for row in resdb.query()}
+    assert sorted(rows) == [f"mol{i}" for i in range(5)]
+    for molname in ["mol1", "mol2", "mol3"]:
+        assert rows[molname]["vina_min"] == 9999.0
+    assert rows["mol4"]["vina_min"] == -9.0
+    assert len(pipeline.sched.failed) == 3
+    # the log names the ligand, not the mol2 record or the job
+    assert "prepare_ligand(mol1) failed: obabel failed" in caplog.text
+    assert "TRIPOS" not in caplog.text and "LigandJob" not in caplog.text
+
+
+def test_screening_pipeline_engine_not_elastic(tmp_path):
+    dock = FakeDock(str(tmp_path))
+    pipeline = ScreeningPipeline(dock, ResultsDB(tmp_path / "r.sqlite"), cores=2)
+    pipeline.prepared(dock.prepare_ligand("mol0", b""))
+    dock.engine = object()
+    pipeline.prepared(dock.prepare_ligand("mol1", b""))
+    vina = {
+        t.args[0].molname: t for t in pipeline.sched.ready if t.method == "dock_vina"
+    }
+    assert vina["mol0"].elastic
+    assert not vina["mol1"].elastic
+
+
+def test_scheduler_threads_policy():
+    sched = Scheduler(Worker(), cores=8)
+    vina = Task("square", (1,), elastic=True)
+    assert sched.threads(Task("square", (1,))) == 1
+    assert sched.threads(vina) == 1
+    # stragglers share the free cores once the source is exhausted
+    sched.exhausted = True
+    assert sched.threads(vina) == 8
+    sched.used = 2
+    sched.ready.extend([Task("square", (2,), elastic=True), Task("square", (3,))])
+    assert sched.threads(vina) == 3
+    assert sched.threads(Task("square", (1,))) == 1
+
+
+def test_scheduler_passes_ncpu():
+    sched = Scheduler(Worker(), cores=4)
+    results = [r for _, r in sched.run([Task("square", (2,), elastic=True)])]
+    assert results == [4]
+    assert sched.used == 0
+
+
+def test_screening_pipeline_vina_batches(tmp_path):
+    dock = FakeDock(str(tmp_path))
+    dock.vina_batch_size = 2
+    records = [(f"mol{i}", b"@<TRIPOS>MOLECULE\n") for i in range(5)]
+    resdb = ResultsDB(tmp_path / "results.sqlite")
+    pipeline = ScreeningPipeline(dock, resdb, cores=2)
+    methods = [task.method for task, _ in pipeline.sched.run(pipeline.tasks(records))]
+    # the last partial batch is flushed once the library is fed
+    assert methods.count("dock_vina_batch") >= 3
+    assert "dock_vina" not in methods
+    assert len(resdb) == 5
+    assert all(row["vina_min"] == -9.0 for row in resdb.query())
+    assert not pipeline.vina_batch
+
+
+def test_scheduler_idle_callback():
+    sched = Scheduler(Worker(), cores=2)
+    pending = [5]
+
+    def idle():
+        while pending:
+            sched.submit(Task("square", (pending.pop(),)))
+
+    sched.idle = idle
+    results = [r for _, r in sched.run([Task("square", (2,))])]
+    assert sorted(results) == [4, 25]
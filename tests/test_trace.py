@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+from pautodock import trace
+from pautodock.scheduler import Scheduler, Task
+
+
+class Worker:
+    def stage(self, molname):
+        with trace.span("inner", molname=molname):
+            return molname
+
+
+@pytest.fixture
+def tracing():
+    trace.drain()
+    trace.enable()
+    yield
+    trace.enable(False)
+    trace.drain()
+
+
+def test_span_disabled():
+    trace.drain()
+    with trace.span("stage"):
+        pass
+    assert trace.drain() == []
+
+
+def test_span_and_export(tracing, tmp_path):
+    with trace.span("vina", molname="mol1"):
+        pass
+    events = trace.drain()
+    assert [e["name"] for e in events] == ["vina"]
+    assert events[0]["ph"] == "X"
+    assert events[0]["args"] == {"molname": "mol1"}
+    trace.write_chrome(tmp_path / "trace.json", events)
+    data = json.loads((tmp_path / "trace.json").read_text())
+    assert data["traceEvents"][0]["name"] == "vina"
+
+
+def test_scheduler_collects_worker_spans(tracing):
+    sched = Scheduler(Worker(), cores=2)
+    results = [r for _, r in sched.run([Task("stage", (f"mol{i}",)) for i in range(3)])]
+    assert sorted(results) == ["mol0", "mol1", "mol2"]
+    events = trace.drain()
+    names = [e["name"] for e in events]
+    assert names.count("inner") == 3
+    assert names.count("stage") == 6  # worker span + scheduler task
+    tasks = [e for e in events if e["cat"] == "task"]
+    assert all(e["args"]["wait"] >= 0 for e in tasks)
+    text = trace.summary(events, 2, 3)
+    assert "ligands/hour" in text
+    assert "Core utilization" in text
@@ -0,0 +1,60 @@
+import pickle
+
+import pytest
+
+from pautodock import vinaengine
+
+
+class FakeVina:
+    maps = 0
+
+    def __init__(self, sf_name="vina", cpu=0, verbosity=1):
+        pass
+
+    def set_receptor(self, rec):
+        self.rec = rec
+
+    def compute_vina_maps(self, center, box_size):
+        FakeVina.maps += 1
+
+    def set_ligand_from_file(self, path):
+        self.ligand = path
+
+    def dock(self, exhaustiveness=8, n_poses=20):
+        pass
+
+    def energies(self, n_poses=9, energy_range=3.0):
+        return [[-9.1, -10.0, -0.5], [-8.4, -9.0, -0.4]]
+
+    def poses(self, n_poses=9, energy_range=3.0):
+        return (
+            f"MODEL 1\nREMARK VINA RESULT:    -9.1  0.0  0.0\n{self.ligand}\nENDMDL\n"
+        )
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    monkeypatch.setattr(vinaengine, "Vina", FakeVina)
+    FakeVina.maps = 0
+    return vinaengine.VinaEngine("rec.pdbqt", [0, 0, 0], [20, 20, 20], 8, 9)
+
+
+def test_maps_computed_once(engine):
+    res = [engine.dock(f"lig{i}.pdbqt") for i in range(3)]
+    assert FakeVina.maps == 1
+    assert res[0].energies == [-9.1, -8.4]
+    assert "lig2.pdbqt" in res[2].poses
+
+
+def test_engine_pickles_without_maps(engine):
+    engine.dock("lig.pdbqt")
+    clone = pickle.loads(pickle.dumps(engine))
+    assert clone._vina is None
+    clone.dock("lig.pdbqt")
+    assert FakeVina.maps == 2
+
+
+def test_engine_needs_vina(monkeypatch):
+    monkeypatch.setattr(vinaengine, "Vina", None)
+    with pytest.raises(ValueError):
+        vinaengine.VinaEngine("rec.pdbqt", [0, 0, 0], [20, 20, 20], 8, 9)
@@ -0,0 +1,104 @@
+import os
+import shutil
+import time
+
+from pautodock import trace
+from pautodock.results import ResultsDB
+from pautodock.workqueue import WorkQueue, merge_results
+
+SHARDS = [{"start": 0, "stop": 2}, {"start": 2, "stop": 4}, {"start": 4, "stop": 5}]
+
+
+def test_publish_and_lease(tmp_path):
+    queue = WorkQueue(tmp_path / "queue")
+    assert queue.publish({"db": "lib.mol2"}, SHARDS) == 3
+    # publishing again keeps the existing screen
+    assert queue.publish({"db": "lib.mol2"}, SHARDS[:1]) == 3
+    assert queue.read_config()["db"] == "lib.mol2"
+    a = queue.lease("node1")
+    b = queue.lease("node2")
+    assert a.name != b.name
+    assert a.spec == SHARDS[0]
+    assert queue.status() == {"pending": 1, "leased": 2, "done": 0, "failed": 0}
+    queue.complete(a)
+    queue.fail(b)
+    assert not queue.finished()
+    queue.complete(queue.lease("node1"))
+    assert queue.lease("node1") is None
+    assert queue.finished()
+
+
+def test_expired_lease_is_reclaimed(tmp_path):
+    queue = WorkQueue(tmp_path / "queue", lease_timeout=60)
+    queue.publish({}, SHARDS[:1])
+    lost = queue.lease("dead-node")
+    assert queue.lease("node2") is None
+    old = time.time() - 120
+    os.utime(lost.path, (old, old))
+    lease = queue.lease("node2")
+    assert lease.name == lost.name
+    assert not queue.renew(lost)
+    assert queue.renew(lease)
+
+
+def test_serve_and_merge(tmp_path):
+    queue = WorkQueue(tmp_path / "queue")
+    queue.publish({}, SHARDS)
+
+    def run_shard(lease):
+        if lease.spec["start"] == 4:
+            raise RuntimeError("broken shard")
+        resdb = ResultsDB(tmp_path / f"{lease.name}.sqlite")
+        for i in range(lease.spec["start"], lease.spec["stop"]):
+            resdb.add([], [f"mol{i}", -7.0, -8.0 - i, -6.0, 1.0])
+        resdb.close()
+        queue.publish_result(lease, tmp_path / f"{lease.name}.sqlite")
+
+    assert queue.serve(run_shard, "node1", poll=0) == 3
+    assert queue.status()["failed"] == 1
+    merge_results(queue, tmp_path / "out.txt")
+    lines = (tmp_path / "out.txt").read_text().splitlines()
+    assert [line.split(";")[0] for line in lines[1:]] == [f"mol{i}" for i in range(4)]
+
+
+def test_reclaimed_lease_not_published(tmp_path):
+    queue = WorkQueue(tmp_path / "queue", lease_timeout=60)
+    queue.publish({}, SHARDS[:1])
+    resdb = ResultsDB(tmp_path / "shard.sqlite")
+    resdb.add([], ["mol0", -7.0, -8.0, -6.0, 1.0])
+    resdb.close()
+    stale = queue.lease("slow-node")
+    old = time.time() - 120
+    os.utime(stale.path, (old, old))
+    lease = queue.lease("node2")
+    # the slow worker finishes after its lease was reclaimed
+    assert not queue.publish_result(stale, tmp_path / "shard.sqlite")
+    assert not queue.result_path(stale).exists()
+    assert queue.publish_result(lease, tmp_path / "shard.sqlite")
+    assert queue.result_path(lease).exists()
+    # a published lease does not expire back to pending
+    queue.reclaim()
+    assert queue.status()["leased"] == 1
+    queue.complete(lease)
+    assert queue.finished()
+
+
+def test_shard_traces_merged(tmp_path):
+    queue = WorkQueue(tmp_path / "queue")
+    queue.publish({}, SHARDS[:2])
+
+    def run_shard(lease):
+        wdir = tmp_path / lease.name
+        wdir.mkdir()
+        resdb = ResultsDB(wdir / "results.sqlite")
+        resdb.add([], [f"mol{lease.spec['start']}", -7.0, -8.0, -6.0, 1.0])
+        resdb.close()
+        trace.write_chrome(wdir / "trace.json", [{"name": lease.name, "ph": "X"}])
+        assert queue.publish_result(lease, wdir / "results.sqlite", wdir / "trace.json")
+        # the scratch directory may go once its results are published
+        shutil.rmtree(wdir)
+
+    queue.serve(run_shard, "node1", poll=0)
+    merge_results(queue, tmp_path / "out.txt", tmp_path / "trace.json")
+    events = trace.read_chrome(tmp_path / "trace.json")
+    assert [e["name"] for e in events] == ["shard_000000", "shard_000001"]